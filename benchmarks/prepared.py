@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+measures how long it takes to fetch the data of cultures from the database
+with and without server-side prepared statements (cf. climax.prepared).
+The data of each culture is fetched several times with a fresh session
+(without a cache), the fastest run is reported. The database login is read
+from ~/.climax.yaml.
+
+Usage: python benchmarks/prepared.py [repetitions] [culture IDs ...]
+"""
+
+import sys
+import time
+
+from climax.session import ClimateSession
+
+CULTURE_IDS = (56878, 44443)
+
+
+def fetch_time(culture_ids, prepared, repetitions=5):
+    """
+    returns the fastest wall time (in seconds) of fetching the data of the
+    cultures (after the statements have been prepared, if prepared is True)
+    """
+    times = []
+    with ClimateSession(cache_size=0, prepared=prepared) as session:
+        for culture_id in culture_ids:  # connects and prepares the statements
+            session.fetch_culture(culture_id)
+        for _ in range(repetitions):
+            start = time.time()
+            for culture_id in culture_ids:
+                session.fetch_culture(culture_id)
+            times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    repetitions = int(argv[0]) if argv else 5
+    culture_ids = [int(culture_id) for culture_id in argv[1:]] or CULTURE_IDS
+    print '{:<30}{:>10}'.format('queries', 'ms')
+    for name, prepared in (('driver-bound', False), ('prepared', True)):
+        print '{:<30}{:>10.1f}'.format(
+            name, fetch_time(culture_ids, prepared, repetitions) * 1000)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
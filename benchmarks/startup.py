@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+measures the startup time of the climaX command line tools, i.e. the time
+it takes to import the modules and print the --help message. Each command
+is run several times in a fresh interpreter, the fastest run is reported.
+
+Usage: python benchmarks/startup.py [repetitions]
+"""
+
+import sys
+import time
+import subprocess
+
+COMMANDS = (
+    ('import climax.login',
+     'import climax.login'),
+    ('import climax.climate_data',
+     'import climax.climate_data'),
+    ('getClimateData --help',
+     'from climax.climate_data import main; main(["--help"])'),
+    ('climax_batch --help',
+     'import sys; sys.argv[1:] = ["--help"]; '
+     'from climax.climax_batch import main; main()'),
+)
+
+
+def startup_time(code, repetitions=10):
+    """returns the fastest wall time (in seconds) of running the code"""
+    times = []
+    with open('/dev/null', 'w') as devnull:
+        for _ in range(repetitions):
+            start = time.time()
+            subprocess.call([sys.executable, '-c', code], stdout=devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    repetitions = int(argv[0]) if argv else 10
+    baseline = startup_time('pass', repetitions)
+    print '{:<30}{:>10}'.format('command', 'ms')
+    print '{:<30}{:>10.1f}'.format('python (baseline)', baseline * 1000)
+    for name, code in COMMANDS:
+        print '{:<30}{:>10.1f}'.format(name, startup_time(code, repetitions) * 1000)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
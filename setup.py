@@ -20,12 +20,16 @@ setup(name='climaX',
       entry_points={
         'console_scripts':
           ['getClimateData=climax.climate_data:main',
-           'climax_batch=climax.climax_batch:main']
+           'climax_batch=climax.climax_batch:main',
+           'climax_index_advisor=climax.index_advisor:main',
+           'climax_climatology=climax.climatology:main',
+           'climax_stress_index=climax.stress_index:main']
       },
 #      py_modules=['getClimateData', 'vpd_heatsum', 'queries', 'login'],
 #      scripts=['getClimateData.py', 'climax_batch.py'],
       license='MIT License',
-      install_requires=['mysql-python', 'pyyaml', 'BeautifulSoup4'],
+      install_requires=['mysql-python', 'pyyaml', 'BeautifulSoup4', 'numpy'],
+      extras_require={'arrow': ['pyarrow']},
      )
 
 
@@ -3,20 +3,43 @@
 import sys
 from itertools import starmap
 import datetime
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import argparse
 
-from climax.vpd_heatsum import calc_VPD
+import numpy as np
+
+from climax.metrics import (accumulate, compute_metrics, Accumulator,
+                            HOUR_METRICS, DEGREE_HOUR_METRICS)
+from climax.day_index import DayIndex
+from climax.series import (ClimateSeries, CLIMATE_COLUMNS, LIGHT_COLUMNS,
+                           PRECIPITATION_COLUMNS, IRRIGATION_COLUMNS)
+from climax.stress_grid import temp_stress_grid
 from climax.queries import (TRIAL_DATES_QUERY, PREC_QUERY, IRRI_QUERY,
                             FAST_CLIMATE_QUERY, DAYLIGHT_QUERY)
-from climax import login
-
-CONNECTED_TO_DB = False
+from climax.pipeline import run_concurrently
+from climax.prepared import PreparedCursor
 
 # treatment IDs
 CONTROL = (169, 171)
 STRESS = 170
 
+# WARNING: WORKAROUND for exceptional conditions (i.e. a non-movable
+# shelter) at one specific trial location
+SHELTER_CULTURES = (56875, 62327)
+
+# WARNING: WORKAROUND for database management SNAFU, cf. issue #6
+# The cultures 47109, 56879 have irrigation, but they don't distinguish
+# control/stress.
+UNSPLIT_CULTURES = (47109, 56879)
+
+# number of initial trial days, in which the soil only gains water
+INITIAL_DAYS = 14
+
+# all the data fetched from the database for one culture
+CultureData = namedtuple('CultureData', ['culture_id', 'trial_dates',
+                                         'precipitation', 'irrigation',
+                                         'climate_data', 'light_data'])
+
 
 def get_trial_daterange(culture_id, db_cursor):
     """
@@ -37,7 +60,7 @@ def get_trial_daterange(culture_id, db_cursor):
         a list of dates beginning with the first date of the
         trial and including the last date of the trial
     """
-    db_cursor.execute(TRIAL_DATES_QUERY % {'CULTURE_ID': culture_id})
+    db_cursor.execute(TRIAL_DATES_QUERY, {'CULTURE_ID': culture_id})
     start_date, end_date = db_cursor.fetchone()
     return list(generate_daterange(start_date, end_date, include_end_date=True))
 
@@ -107,7 +130,7 @@ def get_light_intensity(light_data, flowerDate='2012-07-01'):
 
     Parameters
     ----------
-    light_data : list of (datetime.datetime, float) tuples
+    light_data : list of (datetime.datetime, float) tuples or ClimateSeries
         hourly data of the amount of solar radiation
     flowerDate : str
         date string in YYYY-MM-DD format
@@ -118,22 +141,36 @@ def get_light_intensity(light_data, flowerDate='2012-07-01'):
         light intensity (before flowering, after flowering),
         e.g. (59630.84567157448, 49066.49380313513)
     """
-    dates = [row[0].date() for row in light_data]
-    flowering_date = datestring2object(flowerDate)
+    days, daily_light = \
+        compute_metrics({'light': light_data}, ['light'])['light']
+    return split_at_flowering(days, daily_light, flowerDate)
 
-    dailyLight = {date_: [] for date_ in set(dates)}
-    for row in light_data:
-        if row[1] > 0.0:
-            dailyLight[row[0].date()].append(row[1])
 
-    L1, L2 = [], []
-    for day in dailyLight:
-        if day < flowering_date:
-            L1.append(sum(dailyLight[day]))
-        else: # day >= flowering_date
-            L2.append(sum(dailyLight[day]))
+def split_at_flowering(days, daily_values, flowerDate='2012-07-01'):
+    """
+    sums up the (positive) daily values of a metric before and after the
+    flowering date.
 
-    return sum(L1) , sum(L2)
+    Parameters
+    ----------
+    days : np.ndarray of int
+        days since 1970-01-01
+    daily_values : np.ndarray of float
+        the value of each day
+    flowerDate : str
+        date string in YYYY-MM-DD format
+
+    Returns
+    -------
+    sums : 2-tuple of float
+        (sum before flowering, sum on/after flowering). A sum is the int 0,
+        if there are no positive values in its time span.
+    """
+    flowering_day = np.datetime64(flowerDate, 'D').astype(np.int64)
+    positive = daily_values > 0.0
+    before = positive & (days < flowering_day)
+    after = positive & (days >= flowering_day)
+    return sum(daily_values[before].tolist()), sum(daily_values[after].tolist())
 
 
 def yesterdays_soil_value(soil_water, day, treatment):
@@ -165,6 +202,43 @@ def yesterdays_soil_value(soil_water, day, treatment):
         return 0.0
 
 
+def precipitation_dict(precipitation):
+    """
+    converts daily precipitation data into a dict mapping from a
+    datetime.date to the amount of precipitation on that day.
+
+    Parameters
+    ----------
+    precipitation : ClimateSeries or dict
+        a series with an 'amount' column (dicts are returned unchanged)
+    """
+    if not isinstance(precipitation, ClimateSeries):
+        return precipitation
+    return dict(zip(days_to_dates(precipitation.days),
+                    precipitation['amount'].tolist()))
+
+
+def irrigation_dict(irrigation):
+    """
+    converts daily irrigation data into a dict mapping from a datetime.date
+    to a list of (irrigation amount, treatment_id) tuples.
+
+    Parameters
+    ----------
+    irrigation : ClimateSeries or dict
+        a series with 'amount' and 'treatment_id' columns (dicts are
+        returned unchanged)
+    """
+    if not isinstance(irrigation, ClimateSeries):
+        return irrigation
+    irrigation_days = defaultdict(list)
+    for date, irri_amount, treatment_id in zip(
+            days_to_dates(irrigation.days), irrigation['amount'].tolist(),
+            irrigation['treatment_id'].tolist()):
+        irrigation_days[date].append( (irri_amount, treatment_id) )
+    return irrigation_days
+
+
 def get_soil_water(trial_dates, precipitation, evaporation, soilVolume,
                    irrigation=dict()):
     """
@@ -176,14 +250,15 @@ def get_soil_water(trial_dates, precipitation, evaporation, soilVolume,
     trial_dates : list of datetime.date
         a list of dates beginning with the first date of the
         trial and including the last date of the trial
-    precipitation : dict, key = datatime.date, value = float
+    precipitation : dict, key = datatime.date, value = float or ClimateSeries
         amount of precipitation on a given day
     evaporation : dict, key = datatime.date, value = float
         amount of evaporation on a given day
     soilVolume : float
         soil volume
     irrigation : dict, key = datetime.date, value = list of (float, long) tuples
-        maps from a date to a list of (irrigation amount, treatment_id) tuples.
+        maps from a date to a list of (irrigation amount, treatment_id) tuples
+        (or a ClimateSeries with 'amount' and 'treatment_id' columns).
         The treatment ID is either 169 (control group) or 170 (stress).
         Default: empty dict (irrigation data is not available for all
         days / field trials)
@@ -195,10 +270,12 @@ def get_soil_water(trial_dates, precipitation, evaporation, soilVolume,
         ('control' and 'stress'). a treatment maps to the soil water content
         (on the given day and with the given treatment).
     """
+    precipitation = precipitation_dict(precipitation)
+    irrigation = irrigation_dict(irrigation)
     treatments = ('control', 'stress')
     soil_water = defaultdict(lambda : defaultdict(float))
 
-    initial_days = set(trial_dates[:14])
+    initial_days = set(trial_dates[:INITIAL_DAYS])
     for day in trial_dates:
         # Initial 14 days (0-13) ... sum up water gain up to soil capacity
         if day in initial_days:
@@ -254,14 +331,15 @@ def get_shelter_soil_water(trial_dates, precipitation, evaporation, soilVolume,
     trial_dates : list of datetime.date
         a list of dates beginning with the first date of the
         trial and including the last date of the trial
-    precipitation : dict, key = datatime.date, value = float
+    precipitation : dict, key = datatime.date, value = float or ClimateSeries
         amount of precipitation on a given day
     evaporation : dict, key = datatime.date, value = float
         amount of evaporation on a given day
     soilVolume : float
         soil volume
     irrigation : dict, key = datetime.date, value = list of (float, long) tuples
-        maps from a date to a list of (irrigation amount, treatment_id) tuples.
+        maps from a date to a list of (irrigation amount, treatment_id) tuples
+        (or a ClimateSeries with 'amount' and 'treatment_id' columns).
         The treatment ID is either 169 (control group) or 170 (stress).
         Default: empty dict (irrigation data is not available for all
         days / field trials)
@@ -273,10 +351,12 @@ def get_shelter_soil_water(trial_dates, precipitation, evaporation, soilVolume,
         ('control' and 'stress'). a treatment maps to the soil water content
         (on the given day and with the given treatment).
     """
+    precipitation = precipitation_dict(precipitation)
+    irrigation = irrigation_dict(irrigation)
     treatments = ('control', 'stress')
     soil_water = defaultdict(lambda : defaultdict(float))
 
-    initial_days = set(trial_dates[:14])
+    initial_days = set(trial_dates[:INITIAL_DAYS])
     for day in trial_dates:
         # Initial 14 days (0-13) ... sum up water gain up to soil capacity
         if day in initial_days:
@@ -323,6 +403,29 @@ def get_shelter_soil_water(trial_dates, precipitation, evaporation, soilVolume,
     return soil_water
 
 
+def get_culture_soil_water(culture_id, trial_dates, precipitation,
+                           evaporation, soilVolume, irrigation):
+    """
+    calculates the soil water values for all days of a trial, using the
+    soil water model that applies to the given culture (cf. get_soil_water()
+    for the parameters and return value).
+    """
+    if culture_id in SHELTER_CULTURES:
+        return get_shelter_soil_water(trial_dates, precipitation,
+                                      evaporation, soilVolume, irrigation)
+    else:
+        return get_soil_water(trial_dates, precipitation, evaporation,
+                              soilVolume, irrigation)
+
+
+def has_treatment_split(culture_id, irrigation):
+    """
+    returns True, iff the drought stress days of a culture have to be
+    calculated separately for its control and stress treatment.
+    """
+    return bool(irrigation) and culture_id not in UNSPLIT_CULTURES
+
+
 def get_temp_stress_days(climate_data, tub=30.0, tlb=8.0,
                             flowerDate='2012-07-01'):
     """
@@ -337,7 +440,9 @@ def get_temp_stress_days(climate_data, tub=30.0, tlb=8.0,
         celsius (float), hourly windspeed in m/sec (float),
         hourly relative humidity in % (float)).
         WARNING: some or all hourly values might be missing (None), i.e.
-        climate_data could be a (datetime, None, None, None) tuple
+        climate_data could be a (datetime, None, None, None) tuple.
+        climate_data may also be given as a ClimateSeries (cf.
+        climax.series).
     tub : float
         temperature upper bound
     tlb : float
@@ -353,44 +458,83 @@ def get_temp_stress_days(climate_data, tub=30.0, tlb=8.0,
         heat stress days after flowering).
         Example: (45.4, 4.3999999999999995, 2.5, 3.8999999999999986)
     """
-    dates = [row[0].date() for row in climate_data]
-    flowering_date = datestring2object(flowerDate)
+    metrics = compute_metrics({'climate': climate_data},
+                              ['cold_stress', 'heat_stress'], tub=tub, tlb=tlb)
+    return (split_at_flowering(*metrics['cold_stress'], flowerDate=flowerDate) +
+            split_at_flowering(*metrics['heat_stress'], flowerDate=flowerDate))
 
-    # initialize daily min/max temperature with values with unrealistically
-    # high/low values
-    dailyMinMaxTemp = {date_: [1000.0, -1000.0] for date_ in set(dates)}
-    # iterate over all hourly values to find the real min/max temperature
-    # for each day
-    for row in climate_data:
-        date_, temp = row[0].date(), row[1]
-        if temp: # if there's no temperature value, we don't need to update
-                 # the default values
-            dailyMinMaxTemp[date_] = [min(temp, dailyMinMaxTemp[date_][0]),
-                                      max(temp, dailyMinMaxTemp[date_][1])]
-
-    cold_before, cold_after, heat_before, heat_after = [], [], [], []
-    for day in dailyMinMaxTemp:
-        tMin, tMax = dailyMinMaxTemp[day]
-        coldStress, heatStress = tMin < tlb, tMax > tub
-
-        if day < flowering_date:
-            if coldStress:
-                cold_before.append(abs(tlb - tMin))
-            if heatStress:
-                heat_before.append(abs(tMax - tub))
-        else:  # day >= flowering_date
-            if coldStress:
-                cold_after.append(abs(tlb - tMin))
-            if heatStress:
-                heat_after.append(abs(tMax - tub))
-    return tuple(sum(abs_temp_differences)
-                 for abs_temp_differences in (cold_before, cold_after,
-                                              heat_before, heat_after))
+
+def get_degree_hours(climate_data, tub=30.0, tlb=8.0, flowerDate='2012-07-01'):
+    """
+    calculates the hours with a temperature above tub (resp. below tlb) and
+    the degree hours above tub (resp. below tlb) before and after flowering
+    directly from the hourly temperatures (cf. get_temp_stress_days(), which
+    only looks at the daily extremes).
+
+    Parameters
+    ----------
+    climate_data : (datetime.datetime, float or None, float or None, float or None)
+        hourly climate data (cf. get_temp_stress_days())
+    tub : float
+        temperature upper bound
+    tlb : float
+        temperature lower bound
+    flowerDate : str
+        date string in YYYY-MM-DD format
+
+    Returns
+    -------
+    degreeHours : 8-tuple of int or float
+        (heat hours BF, heat hours AF, cold hours BF, cold hours AF,
+        heat degree hours BF, heat degree hours AF, cold degree hours BF,
+        cold degree hours AF). The hours are ints.
+    """
+    metrics = compute_metrics({'climate': climate_data},
+                              DEGREE_HOUR_METRICS, tub=tub, tlb=tlb)
+    sums = []
+    for name in DEGREE_HOUR_METRICS:
+        before, after = split_at_flowering(*metrics[name], flowerDate=flowerDate)
+        if name in HOUR_METRICS:
+            before, after = int(before), int(after)
+        sums.extend((before, after))
+    return tuple(sums)
+
+
+def get_temp_stress_grid(climate_data, tubs, tlbs, flowerDate='2012-07-01'):
+    """
+    calculates the cold and heat stress sums before and after flowering
+    (cf. get_temp_stress_days()) for whole arrays of temperature bounds,
+    e.g. to calibrate crop-specific thresholds.
+
+    Parameters
+    ----------
+    climate_data : (datetime.datetime, float or None, float or None, float or None)
+        hourly climate data (cf. get_temp_stress_days())
+    tubs : array-like of float
+        temperature upper bounds, e.g. numpy.arange(25.0, 35.0, 0.5)
+    tlbs : array-like of float
+        temperature lower bounds, e.g. numpy.arange(0.0, 12.0, 0.5)
+    flowerDate : str
+        date string in YYYY-MM-DD format
+
+    Returns
+    -------
+    cold_before, cold_after : np.ndarray of float
+        sum of temperature differences of the cold stress days before/after
+        flowering, one value per lower bound
+    heat_before, heat_after : np.ndarray of float
+        sum of temperature differences of the heat stress days before/after
+        flowering, one value per upper bound
+    """
+    days, tmin, tmax = get_daily_min_max_temp(climate_data)
+    flowering_day = np.datetime64(flowerDate, 'D').astype(np.int64)
+    return temp_stress_grid(days, tmin, tmax, tubs, tlbs, flowering_day)
 
 
 def get_drought_stress_days(culture_id, trial_dates, climate_data, soilVolume,
                             precipitation, irrigation,
-                            stress_factor=0.2, flowerDate='2012-07-01'):
+                            stress_factor=0.2, flowerDate='2012-07-01',
+                            evaporation=None):
     """
     calculates the number of drought stress days before and after the flowering
     date.
@@ -407,13 +551,16 @@ def get_drought_stress_days(culture_id, trial_dates, climate_data, soilVolume,
         celsius (float), hourly windspeed in m/sec (float),
         hourly relative humidity in % (float)).
         WARNING: some or all hourly values might be missing (None), i.e.
-        climate_data could be a (datetime, None, None, None) tuple
+        climate_data could be a (datetime, None, None, None) tuple.
+        climate_data may also be given as a ClimateSeries (cf.
+        climax.series).
     soilVolume : float
         soil volume
-    precipitation : dict, key = datatime.date, value = float
+    precipitation : dict, key = datatime.date, value = float or ClimateSeries
         precipitation on a given day
     irrigation : dict, key = datetime.date, value = list of (float, long) tuples
-        maps from a date to a list of (irrigation amount, treatment_id) tuples.
+        maps from a date to a list of (irrigation amount, treatment_id) tuples
+        (or a ClimateSeries, cf. get_soil_water()).
         The treatment ID is either 169 (control group) or 170 (stress).
     stress_factor : float
         stress threshold = stress factor * soil volume. a day is considered
@@ -421,6 +568,9 @@ def get_drought_stress_days(culture_id, trial_dates, climate_data, soilVolume,
         threshold
     flowerDate : str
         flowering date in YYYY-MM-DD format
+    evaporation : dict, key = datatime.date, value = float or None
+        amount of evaporation on a given day. If not given, it will be
+        calculated from climate_data (cf. get_evaporation()).
 
     Returns
     -------
@@ -461,24 +611,15 @@ def get_drought_stress_days(culture_id, trial_dates, climate_data, soilVolume,
         return stress_days_before, stress_days_after
 
     stress_threshold = soilVolume * stress_factor
-    evaporation = get_evaporation(climate_data)
+    if evaporation is None:
+        evaporation = get_evaporation(climate_data)
     assert evaporation, "get_evaporation() returned no results"
     flowering_date = datestring2object(flowerDate)
 
-    # WARNING: WORKAROUND for exceptional conditions (i.e. a non-movable
-    # shelter) at one specific trial location
-    if culture_id in (56875, 62327):
-        soil_water = get_shelter_soil_water(trial_dates, precipitation,
-                                            evaporation, soilVolume,
-                                            irrigation)
-    else:
-        soil_water = get_soil_water(trial_dates, precipitation, evaporation,
-                                    soilVolume, irrigation)
+    soil_water = get_culture_soil_water(culture_id, trial_dates, precipitation,
+                                        evaporation, soilVolume, irrigation)
 
-    # WARNING: WORKAROUND for database management SNAFU, cf. issue #6
-    # The cultures 47109, 56879 have irrigation, but they don't distinguish
-    # control/stress.
-    if irrigation and culture_id not in (47109, 56879):
+    if has_treatment_split(culture_id, irrigation):
         control = {date: soil_water[date]['control'] for date in soil_water}
         stress = {date: soil_water[date]['stress'] for date in soil_water}
         return stress_days(control, flowering_date, stress_threshold), \
@@ -502,6 +643,8 @@ def get_evaporation(climate_data):
         celsius (float), hourly windspeed in m/sec (float),
         hourly relative humidity in % (float)).
         WARNING: all hourly values might be missing (None)!
+        climate_data may also be given as a ClimateSeries (cf.
+        climax.series).
 
     Returns
     -------
@@ -510,62 +653,26 @@ def get_evaporation(climate_data):
         WARNING: this dictionary contains only those dates, for which
         evaporation data could be calculated!
     """
-    def penman_evaporation(vpd, windspeed):
-        """
-        Calculates evaporation in mm/day from
-        vapour pressure deficit and windspeed.
-        Formula from Principles of Environmental Physics (Penman 1948)
+    days, evaporation = \
+        compute_metrics({'climate': climate_data}, ['evaporation'])['evaporation']
+    return daily_dict(days, evaporation)
 
-        ATT: Windspeed is coming in as m/s, needs to be mph
 
-        Parameters
-        ----------
-        vpd : float
-            Vapour Pressure Deficit
-        windspeed : float
-            wind in m/s
+def days_to_dates(days):
+    """converts days since 1970-01-01 into a list of datetime.date instances"""
+    return np.asarray(days).astype('datetime64[D]').tolist()
 
-        Returns
-        -------
-        evaporation : float
-            evaporation occurring in a day
-        """
-        ms_to_mph = 2.23693629205
-        windspeed_in_mph = windspeed * ms_to_mph
-        return 0.376 * vpd * (windspeed_in_mph ** 0.76)
-
-    # data format: [datetime.datetime, temperature, windspeed, relHumidity]
-    dates = [row[0].date() for row in climate_data]
-
-    daily_vpd = defaultdict(list) # VPD: Vapour Pressure Deficit
-    daily_windspeed = defaultdict(list)
-    for date_time, temperature, windspeed, humidity in climate_data:
-        day = date_time.date()
-        if temperature and humidity:
-            # rel. humidity is coming in as percentage, needs to be fraction
-            hourly_vpd = calc_VPD(temperature, humidity/100.0)
-            daily_vpd[day].append(hourly_vpd)
-        if windspeed:
-            daily_windspeed[day].append(windspeed)
-
-    def mean(numbers):
-        return sum(numbers) / float(len(numbers))
-
-    # return daily penman_evaporation for daily means of vpd and windspeed
-    daily_evaporation = {}
-    # a day may occur several times in climate_date, but we need to calculate
-    # evaporation only once
-    for day in set(dates):
-        # we can only calculate evaporation if VPD and windspeed are available
-        if day in daily_vpd and day in daily_windspeed:
-            daily_evaporation[day] = \
-                penman_evaporation(mean(daily_vpd[day]),
-                                   mean(daily_windspeed[day]))
-    return daily_evaporation
+
+def daily_dict(days, daily_values):
+    """
+    converts a daily metric, i.e. a (days, values) tuple of arrays, into
+    a dict mapping from a datetime.date to a float.
+    """
+    return dict(zip(days_to_dates(days), np.asarray(daily_values).tolist()))
 
 
 def get_climate_data(culture_id=56878, floweringDate='2012-07-01',
-                     soilVolume=42):
+                     soilVolume=42, concurrent=False):
     """
     extract climate data (temperature stress days, drought stress days and
     light intensity) from the database.
@@ -578,6 +685,13 @@ def get_climate_data(culture_id=56878, floweringDate='2012-07-01',
         date string in YYYY-MM-DD format, e.g. '2012-07-01'
     soilVolume : int or float
         soil volume in ???, e.g. 42
+    concurrent : bool
+        If True, the queries are run concurrently on separate pooled
+        connections (cf. fetch_culture_data_concurrently())
+
+    The data is fetched with the default session (cf.
+    climax.session.get_default_session()). Use a ClimateSession of your own
+    to control the database connection(s) and the caching of culture data.
 
     Returns
     -------
@@ -595,40 +709,338 @@ def get_climate_data(culture_id=56878, floweringDate='2012-07-01',
         light intensity (before flowering, after flowering),
         e.g. (59630.84567157448, 49066.49380313513)
     """
-    global CONNECTED_TO_DB
-    if not CONNECTED_TO_DB:
-        database = login.get_db()
-        global CURSOR
-        CURSOR = database.cursor()
-        CONNECTED_TO_DB = True
+    culture = get_default_session().fetch_culture(culture_id, concurrent)
+    return culture_climate_data(culture, floweringDate, soilVolume)
 
-    CURSOR.execute(PREC_QUERY % {'CULTURE_ID': culture_id})
-    precipitation = {date: precip for (date, precip) in CURSOR.fetchall()}
 
-    CURSOR.execute(IRRI_QUERY % {'CULTURE_ID': culture_id})
-    irrigation = defaultdict(list)
-    # for some days, there are two rows (stress vs. control)
-    for date, irri_amount, treatment_id in CURSOR.fetchall():
-        irrigation[date].append( (irri_amount, treatment_id) )
+def culture_climate_data(culture, floweringDate='2012-07-01', soilVolume=42,
+                         tub=30.0, tlb=8.0, stress_factor=0.2):
+    """
+    calculates the climate data (temperature stress days, drought stress
+    days and light intensity) of a culture, whose data has already been
+    fetched.
 
-    CURSOR.execute(FAST_CLIMATE_QUERY % {'CULTURE_ID': culture_id})
-    climate_data = [row for row in CURSOR.fetchall()]
+    Parameters
+    ----------
+    culture : CultureData
+        the data of a culture (cf. fetch_culture_data())
+    floweringDate : string
+        date string in YYYY-MM-DD format, e.g. '2012-07-01'
+    soilVolume : int or float
+        soil volume, e.g. 42
+    tub : float
+        temperature upper bound
+    tlb : float
+        temperature lower bound
+    stress_factor : float
+        stress threshold = stress factor * soil volume
 
-    trial_dates = get_trial_daterange(culture_id, CURSOR)
+    Returns
+    -------
+    has_irrigation, tempStressDays, droughtStressDays, lightIntensity
+        cf. get_climate_data()
+    """
+    # a single pass over the hourly rows calculates all daily metrics
+    metrics = get_daily_metrics(culture, tub, tlb)
 
     tempStressDays = \
-        get_temp_stress_days(climate_data, flowerDate=floweringDate)
+        split_at_flowering(*metrics['cold_stress'], flowerDate=floweringDate) + \
+        split_at_flowering(*metrics['heat_stress'], flowerDate=floweringDate)
     droughtStressDays = \
-        get_drought_stress_days(culture_id, trial_dates, climate_data, soilVolume,
-                            precipitation, irrigation, stress_factor=0.2,
-                            flowerDate=floweringDate)
+        get_drought_stress_days(culture.culture_id, culture.trial_dates,
+                            culture.climate_data, soilVolume,
+                            culture.precipitation, culture.irrigation,
+                            stress_factor=stress_factor, flowerDate=floweringDate,
+                            evaporation=daily_dict(*metrics['evaporation']))
+    lightIntensity = split_at_flowering(*metrics['light'],
+                                        flowerDate=floweringDate)
+
+    has_irrigation = True if culture.irrigation else False
+    return has_irrigation, tempStressDays, droughtStressDays, lightIntensity
+
 
-    CURSOR.execute(DAYLIGHT_QUERY % {'CULTURE_ID': culture_id})
-    lightData = [row for row in CURSOR.fetchall()]
-    lightIntensity = get_light_intensity(lightData, flowerDate=floweringDate)
+def get_climate_data_for_dates(culture_id=56878, floweringDates=('2012-07-01',),
+                               soilVolume=42, concurrent=False):
+    """
+    extract climate data (temperature stress days, drought stress days and
+    light intensity) from the database for several candidate flowering dates
+    of the same culture. The data is fetched and aggregated only once, each
+    flowering date is then answered in O(1) from a DayIndex.
+
+    Parameters
+    ----------
+    culture_id : int
+        ID of the culture, e.g. 56878
+    floweringDates : list of str
+        date strings in YYYY-MM-DD format, e.g. ['2012-06-25', '2012-07-01']
+    soilVolume : int or float
+        soil volume, e.g. 42
+    concurrent : bool
+        If True, the queries are run concurrently on separate pooled
+        connections (cf. fetch_culture_data_concurrently())
+
+    Returns
+    -------
+    climate_data : list of tuples
+        one (has_irrigation, tempStressDays, droughtStressDays,
+        lightIntensity) tuple per flowering date (cf. get_climate_data())
+    """
+    culture = get_default_session().fetch_culture(culture_id, concurrent)
+    return culture_climate_data_for_dates(culture, floweringDates, soilVolume)
+
+
+def culture_climate_data_for_dates(culture, floweringDates=('2012-07-01',),
+                                   soilVolume=42, tub=30.0, tlb=8.0,
+                                   stress_factor=0.2):
+    """
+    calculates the climate data of a culture, whose data has already been
+    fetched, for several candidate flowering dates (cf.
+    get_climate_data_for_dates()).
+    """
+    index = get_day_index(culture, soilVolume, tub, tlb, stress_factor)
+    return split_day_index(index, floweringDates, culture.culture_id,
+                           culture.irrigation)
+
+
+def get_default_session():
+    """
+    returns the session used by the module-level functions get_climate_data()
+    and get_climate_data_for_dates() (cf. climax.session).
+    """
+    # imported here, because climax.session builds on this module
+    from climax.session import get_default_session
+    return get_default_session()
+
+
+def fetch_culture_data(culture_id, db_cursor):
+    """
+    fetches all the data needed to calculate the climate data of a culture
+    from the database.
+
+    Parameters
+    ----------
+    culture_id : int
+        ID of the culture, e.g. 56878
+    db_cursor : MySQLdb.cursors.Cursor
+        a cursor to the (running) database
+
+    Returns
+    -------
+    culture : CultureData
+        trial dates (list of datetime.date), precipitation, irrigation,
+        hourly climate data and hourly light data (ClimateSeries) of the
+        culture
+    """
+    return CultureData(culture_id, *[fetch(culture_id, db_cursor)
+                                     for fetch in CULTURE_FETCHERS])
+
+
+def fetch_culture_data_concurrently(culture_id, pool, prepared=False):
+    """
+    fetches all the data needed to calculate the climate data of a culture
+    from the database. The (independent) queries are run concurrently on
+    separate connections, so this takes about as long as the slowest query.
+
+    Parameters
+    ----------
+    culture_id : int
+        ID of the culture, e.g. 56878
+    pool : login.ConnectionPool
+        a pool with (up to) one connection per query
+    prepared : bool
+        If True, the queries are run as server-side prepared statements
+        (cf. climax.prepared), which are prepared once per pooled connection
+
+    Returns
+    -------
+    culture : CultureData
+        cf. fetch_culture_data()
+    """
+    def on_pooled_connection(fetch):
+        def run():
+            with pool.connection() as connection:
+                cursor = connection.cursor()
+                if prepared:
+                    cursor = PreparedCursor(cursor, connection)
+                try:
+                    return fetch(culture_id, cursor)
+                finally:
+                    cursor.close()
+        return run
+
+    return CultureData(culture_id, *run_concurrently(
+        [on_pooled_connection(fetch) for fetch in CULTURE_FETCHERS]))
+
+
+def fetch_precipitation(culture_id, db_cursor):
+    """fetches the daily precipitation at the location of a culture"""
+    db_cursor.execute(PREC_QUERY, {'CULTURE_ID': culture_id})
+    return ClimateSeries.from_cursor(db_cursor, PRECIPITATION_COLUMNS)
+
+
+def fetch_irrigation(culture_id, db_cursor):
+    """fetches the daily irrigation (per treatment) of a culture"""
+    # for some days, there are two rows (stress vs. control)
+    db_cursor.execute(IRRI_QUERY, {'CULTURE_ID': culture_id})
+    return ClimateSeries.from_cursor(db_cursor, IRRIGATION_COLUMNS,
+                                     dtypes={'treatment_id': np.int64})
+
+
+def fetch_climate(culture_id, db_cursor):
+    """
+    fetches the hourly temperature, windspeed and relative humidity during
+    the trial of a culture
+    """
+    db_cursor.execute(FAST_CLIMATE_QUERY, {'CULTURE_ID': culture_id})
+    return ClimateSeries.from_cursor(db_cursor, CLIMATE_COLUMNS)
+
+
+def fetch_light(culture_id, db_cursor):
+    """fetches the hourly solar radiation during the trial of a culture"""
+    db_cursor.execute(DAYLIGHT_QUERY, {'CULTURE_ID': culture_id})
+    return ClimateSeries.from_cursor(db_cursor, LIGHT_COLUMNS)
+
+
+# the functions fetching the fields of a CultureData (after culture_id)
+CULTURE_FETCHERS = (get_trial_daterange, fetch_precipitation, fetch_irrigation,
+                    fetch_climate, fetch_light)
+
+
+def get_daily_metrics(culture, tub=30.0, tlb=8.0):
+    """
+    calculates the daily cold stress, heat stress, evaporation and light
+    metrics of a culture with a single pass over its hourly climate and
+    light rows (cf. climax.metrics).
+
+    Returns
+    -------
+    metrics : dict, key = str, value = (np.ndarray, np.ndarray)
+        maps from a metric name ('cold_stress', 'heat_stress',
+        'evaporation', 'light') to a (days, values) tuple of arrays
+    """
+    return compute_metrics({'climate': culture.climate_data,
+                            'light': culture.light_data},
+                           ['cold_stress', 'heat_stress', 'evaporation', 'light'],
+                           tub=tub, tlb=tlb)
+
+
+def get_daily_min_max_temp(climate_data):
+    """
+    calculates the minimum and maximum temperature of each day.
+
+    Returns
+    -------
+    days : np.ndarray of int
+        days (since 1970-01-01) with temperature data
+    tmin, tmax : np.ndarray of float
+        the minimum/maximum temperature of each day
+    """
+    daily = accumulate({'climate': climate_data},
+                       [Accumulator('climate', 'temperature', 'min'),
+                        Accumulator('climate', 'temperature', 'max')])
+    days, tmin = daily['climate', 'temperature', 'min']
+    return days, tmin, daily['climate', 'temperature', 'max'][1]
+
+
+def get_day_index(culture, soilVolume, tub=30.0, tlb=8.0, stress_factor=0.2):
+    """
+    builds a DayIndex over all days of a trial, which contains the daily
+    light sums ('light'), cold and heat stress degrees ('cold', 'heat') and
+    drought stress day flags ('control_drought', 'stress_drought').
+    If the culture doesn't distinguish control and stress treatments
+    (cf. has_treatment_split()), both drought series are identical.
+
+    Parameters
+    ----------
+    culture : CultureData
+        the data of a culture (cf. fetch_culture_data())
+    soilVolume : float
+        soil volume
+    tub : float
+        temperature upper bound
+    tlb : float
+        temperature lower bound
+    stress_factor : float
+        stress threshold = stress factor * soil volume
+
+    Returns
+    -------
+    index : DayIndex
+    """
+    metrics = get_daily_metrics(culture, tub, tlb)
+    light_days, daily_light = metrics['light']
+    temp_days, cold_stress = metrics['cold_stress']
+    heat_stress = metrics['heat_stress'][1]
+
+    evaporation = daily_dict(*metrics['evaporation'])
+    assert evaporation, "get_evaporation() returned no results"
+    soil_water = get_culture_soil_water(
+        culture.culture_id, culture.trial_dates, culture.precipitation,
+        evaporation, soilVolume, culture.irrigation)
+    soil_days = sorted(soil_water)
+    if has_treatment_split(culture.culture_id, culture.irrigation):
+        treatments = ('control', 'stress')
+    else:
+        treatments = ('control', 'control')
+    stress_threshold = soilVolume * stress_factor
+    control_flags, stress_flags = (
+        [soil_water[day].get(treatment, 0.0) < stress_threshold
+         for day in soil_days]
+        for treatment in treatments)
+
+    soil_days = np.array(soil_days, dtype='datetime64[D]').astype(np.int64)
+    all_days = np.concatenate((light_days, temp_days, soil_days))
+    index = DayIndex(all_days.min(), all_days.max())
+    index.add('light', light_days, daily_light)
+    index.add('cold', temp_days, cold_stress)
+    index.add('heat', temp_days, heat_stress)
+    index.add('control_drought', soil_days, np.array(control_flags, dtype=np.int64))
+    index.add('stress_drought', soil_days, np.array(stress_flags, dtype=np.int64))
+    return index
+
+
+def split_day_index(index, floweringDates, culture_id, irrigation):
+    """
+    splits the daily values of a culture's DayIndex around each flowering
+    date and returns the results in the format of get_climate_data().
+
+    Parameters
+    ----------
+    index : DayIndex
+        cf. get_day_index()
+    floweringDates : list of str
+        date strings in YYYY-MM-DD format
+    culture_id : int
+        culture ID of the trial
+    irrigation : dict
+        irrigation data of the culture (cf. get_soil_water())
+
+    Returns
+    -------
+    climate_data : list of tuples
+        one (has_irrigation, tempStressDays, droughtStressDays,
+        lightIntensity) tuple per flowering date (cf. get_climate_data())
+    """
+    # maps from the name of a series to a list of (before, after) tuples
+    splits = {}
+    for name in ('light', 'cold', 'heat', 'control_drought', 'stress_drought'):
+        before, after = index.split(name, floweringDates)
+        # like split_at_flowering(), return the int 0 for empty sums
+        splits[name] = [(b or 0, a or 0)
+                        for b, a in zip(before.tolist(), after.tolist())]
 
     has_irrigation = True if irrigation else False
-    return has_irrigation, tempStressDays, droughtStressDays, lightIntensity
+    results = []
+    for i in range(len(floweringDates)):
+        cold, heat = splits['cold'][i], splits['heat'][i]
+        if has_treatment_split(culture_id, irrigation):
+            droughtStressDays = \
+                splits['control_drought'][i], splits['stress_drought'][i]
+        else:
+            droughtStressDays = splits['control_drought'][i]
+        results.append((has_irrigation, cold + heat, droughtStressDays,
+                        splits['light'][i]))
+    return results
 
 
 def main(args=None):
@@ -640,6 +1052,9 @@ def main(args=None):
                         help='date string in YYYY-MM-DD format, e.g. 2012-07-01')
     parser.add_argument('soil_volume', type=float,
                         help='soil volume, e.g. 42 or 27.5')
+    parser.add_argument('--concurrent-queries', action='store_true',
+                        help=('run the queries concurrently on separate '
+                              'database connections'))
     if args:
         args = parser.parse_args(args)
     else:
@@ -647,7 +1062,7 @@ def main(args=None):
 
     has_irrigation, tempStressDays, droughtStressDays, lightIntensity = \
         get_climate_data(args.culture_id, args.flowering_date,
-                         args.soil_volume)
+                         args.soil_volume, concurrent=args.concurrent_queries)
 
     print 'has irrigation:', has_irrigation
     print 'temperature stress days:', tempStressDays
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+
+"""
+This module builds long-term climatology baselines, which the cold/heat
+stress sums and light totals of a trial (cf. climate_data.get_climate_data())
+can be compared with.
+
+A Climatology keeps running aggregates (number of days, sum and sum of
+squares) of daily metrics per day of the year in arrays of DAYS_PER_YEAR
+values. It is built by streaming all historical hourly rows of a source
+once, in chunks of whole days: the temperature rows of a weather station
+(cold and heat stress) resp. the solar radiation rows of a location
+(light). The daily metrics are calculated like the ones of a trial (cf.
+climax.metrics). Climatologies are stored as .npz files, so the baseline
+(i.e. the long-term mean) and the anomaly of any culture's trial window can
+be answered without rescanning decades of data.
+
+Usage:
+    climax_climatology build DIRECTORY LOCATION_ID [LOCATION_ID ...]
+    climax_climatology anomaly DIRECTORY CULTURE_ID FLOWERING_DATE
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from climax.metrics import compute_metrics
+from climax.series import ClimateSeries, CLIMATE_COLUMNS, LIGHT_COLUMNS
+from climax.prepared import expand_list_parameters
+from climax.queries import (STATION_HISTORY_QUERY, SOLAR_HISTORY_QUERY,
+                            LOCATION_STATIONS_QUERY, CULTURE_SOURCES_QUERY)
+
+# the days of a leap year. February 29th has its own slot, so that the
+# other days of non-leap years share the slot of the same calendar day.
+DAYS_PER_YEAR = 366
+
+# the day of the year (0-based) of March 1st in a leap year
+MARCH_1ST = 60
+
+# number of rows that are converted at a time while streaming
+STREAM_CHUNK_SIZE = 100000
+
+TEMPERATURE_TABLE = 'dwd_hourlyAirTemperature_TAHV'
+
+
+def day_of_year(days):
+    """
+    converts days (since 1970-01-01) into the (0-based) day of the year in
+    the calendar of a leap year, i.e. 0 ... 365.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    dates = days.astype('datetime64[D]')
+    years = dates.astype('datetime64[Y]')
+    doy = days - years.astype('datetime64[D]').astype(np.int64)
+    year_numbers = years.astype(np.int64) + 1970
+    is_leap = ((year_numbers % 4 == 0) & (year_numbers % 100 != 0)) | \
+        (year_numbers % 400 == 0)
+    return np.where(~is_leap & (doy >= MARCH_1ST - 1), doy + 1, doy)
+
+
+class Climatology(object):
+    """
+    running per-day-of-year aggregates of daily metrics.
+
+    Attributes
+    ----------
+    counts : dict, key = str, value = np.ndarray of int64
+        maps from a metric name to the number of days with a value per day
+        of the year
+    sums, squares : dict, key = str, value = np.ndarray of float64
+        maps from a metric name to the sum (resp. sum of squares) of its
+        values per day of the year
+    params : dict, key = str, value = float
+        the parameters of the metrics (e.g. tub, tlb)
+    """
+    def __init__(self, names, **params):
+        self.params = params
+        self.counts = {name: np.zeros(DAYS_PER_YEAR, dtype=np.int64)
+                       for name in names}
+        self.sums = {name: np.zeros(DAYS_PER_YEAR) for name in names}
+        self.squares = {name: np.zeros(DAYS_PER_YEAR) for name in names}
+
+    @property
+    def names(self):
+        return sorted(self.counts)
+
+    def add(self, name, days, values):
+        """
+        adds daily values of a metric.
+
+        Parameters
+        ----------
+        name : str
+            name of the metric, e.g. 'light'
+        days : np.ndarray of int
+            days (since 1970-01-01) of the values
+        values : np.ndarray of float
+            the value of each day
+        """
+        doy = day_of_year(days)
+        values = np.asarray(values, dtype=float)
+        self.counts[name] += np.bincount(doy, minlength=DAYS_PER_YEAR)
+        self.sums[name] += np.bincount(doy, weights=values,
+                                       minlength=DAYS_PER_YEAR)
+        self.squares[name] += np.bincount(doy, weights=values ** 2,
+                                          minlength=DAYS_PER_YEAR)
+
+    def mean(self, name):
+        """the long-term mean of a metric per day of the year (NaN without data)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums[name] / self.counts[name]
+
+    def std(self, name):
+        """the standard deviation of a metric per day of the year"""
+        mean = self.mean(name)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = self.squares[name] / self.counts[name] - mean ** 2
+        return np.sqrt(np.maximum(variance, 0.0))
+
+    def baseline(self, name, days):
+        """
+        returns the long-term mean total of a metric over the given days
+        (since 1970-01-01). Days of the year without data count as 0.
+        """
+        if len(days) == 0:
+            return 0.0
+        return float(np.nansum(self.mean(name)[day_of_year(days)]))
+
+    def save(self, path):
+        """stores the climatology as a .npz file"""
+        arrays = {'params_' + key: value for key, value in self.params.items()}
+        for name in self.names:
+            arrays['counts_' + name] = self.counts[name]
+            arrays['sums_' + name] = self.sums[name]
+            arrays['squares_' + name] = self.squares[name]
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(temp_path, **arrays)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """loads a climatology from a .npz file (cf. save())"""
+        with np.load(path) as arrays:
+            names = [key[len('counts_'):] for key in arrays.files
+                     if key.startswith('counts_')]
+            climatology = cls(names, **{key[len('params_'):]: float(arrays[key])
+                                        for key in arrays.files
+                                        if key.startswith('params_')})
+            for name in names:
+                climatology.counts[name] = arrays['counts_' + name]
+                climatology.sums[name] = arrays['sums_' + name]
+                climatology.squares[name] = arrays['squares_' + name]
+        return climatology
+
+
+def stream_days(cursor, columns, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    streams the hourly results of an executed query as ClimateSeries
+    chunks, which contain whole days only (i.e. the rows of the last day of
+    a chunk are held back until the next chunk). The rows have to be
+    ordered by time.
+
+    Parameters
+    ----------
+    cursor : MySQLdb.cursors.Cursor
+        a cursor on which a query was executed (use a server-side cursor,
+        e.g. MySQLdb.cursors.SSCursor, to stream the results)
+    columns : tuple of str
+        the names of the value columns
+    """
+    pending = None
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        series = ClimateSeries.from_rows(rows, columns)
+        if pending is not None:
+            series = ClimateSeries.concatenate([pending, series])
+        complete = series.days < series.days[-1]
+        pending = series.select(~complete)
+        if complete.any():
+            yield series.select(complete)
+    if pending is not None and len(pending):
+        yield pending
+
+
+def build_station_climatology(cursor, station_id, tub=30.0, tlb=8.0,
+                              chunk_size=STREAM_CHUNK_SIZE):
+    """
+    builds the cold/heat stress climatology ('cold_stress', 'heat_stress')
+    of a weather station from all its hourly temperature rows.
+    """
+    climatology = Climatology(('cold_stress', 'heat_stress'), tub=tub, tlb=tlb)
+    cursor.execute(STATION_HISTORY_QUERY.format(table=TEMPERATURE_TABLE),
+                   {'STATION_ID': station_id})
+    missing = None
+    for series in stream_days(cursor, ('temperature',), chunk_size):
+        if missing is None or len(missing) != len(series):
+            missing = np.full(len(series), np.nan)
+        climate = ClimateSeries(series.hours, CLIMATE_COLUMNS,
+                                [series['temperature'], missing, missing])
+        metrics = compute_metrics({'climate': climate},
+                                  ['cold_stress', 'heat_stress'],
+                                  tub=tub, tlb=tlb)
+        for name, (days, values) in metrics.items():
+            climatology.add(name, days, values)
+    return climatology
+
+
+def build_light_climatology(cursor, location_id,
+                            chunk_size=STREAM_CHUNK_SIZE):
+    """
+    builds the light climatology ('light') of a location from all its
+    hourly solar radiation rows.
+    """
+    climatology = Climatology(('light',))
+    cursor.execute(SOLAR_HISTORY_QUERY, {'LOCATION_ID': location_id})
+    for series in stream_days(cursor, LIGHT_COLUMNS, chunk_size):
+        days, values = compute_metrics({'light': series}, ['light'])['light']
+        climatology.add('light', days, values)
+    return climatology
+
+
+class ClimatologyStore(object):
+    """
+    a directory of stored climatologies: one per weather station
+    (station_ID.npz, cold/heat stress) and one per location
+    (location_ID.npz, light).
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def station_path(self, station_id):
+        return os.path.join(self.path, 'station_{}.npz'.format(station_id))
+
+    def location_path(self, location_id):
+        return os.path.join(self.path, 'location_{}.npz'.format(location_id))
+
+    def build(self, cursor, location_ids, tub=30.0, tlb=8.0,
+              chunk_size=STREAM_CHUNK_SIZE):
+        """
+        builds and stores the climatologies of the given locations. The rows
+        of each weather station are streamed only once, even if the station
+        is used at several locations.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        location_ids = sorted(set(location_ids))
+        cursor.execute(*expand_list_parameters(
+            LOCATION_STATIONS_QUERY, {'LOCATION_IDS': location_ids}))
+        station_ids = sorted(set(station_id
+                                 for _, station_id in cursor.fetchall()))
+        for station_id in station_ids:
+            build_station_climatology(cursor, station_id, tub, tlb,
+                                      chunk_size).save(
+                                          self.station_path(station_id))
+        for location_id in location_ids:
+            build_light_climatology(cursor, location_id, chunk_size).save(
+                self.location_path(location_id))
+
+    def culture_climatologies(self, cursor, culture_id):
+        """
+        returns the (temperature, light) climatologies of the location of a
+        culture.
+        """
+        cursor.execute(*expand_list_parameters(
+            CULTURE_SOURCES_QUERY, {'CULTURE_IDS': [culture_id]}))
+        rows = cursor.fetchall()
+        assert rows, "Unknown culture: {}".format(culture_id)
+        location_id = rows[0][1]
+        station_ids = [station_id for _, _, station_data, station_id in rows
+                       if station_data == 'TAHV']
+        assert station_ids, \
+            "No temperature station at location {}".format(location_id)
+        return (Climatology.load(self.station_path(station_ids[0])),
+                Climatology.load(self.location_path(location_id)))
+
+
+def trial_days(trial_dates):
+    """
+    returns the days (since 1970-01-01) of a trial, for which hourly data
+    is fetched (i.e. without the end date, cf. queries.FAST_CLIMATE_QUERY)
+    """
+    return np.array(trial_dates[:-1], dtype='datetime64[D]').astype(np.int64)
+
+
+def culture_baseline(trial_dates, floweringDate, temperature, light):
+    """
+    calculates the long-term means of the cold/heat stress sums and light
+    totals of a trial window (split at the flowering date).
+
+    Parameters
+    ----------
+    trial_dates : list of datetime.date
+        the dates of the trial (cf. climate_data.get_trial_daterange())
+    floweringDate : str
+        date string in YYYY-MM-DD format
+    temperature : Climatology
+        the cold/heat stress climatology of the culture's weather station
+    light : Climatology
+        the light climatology of the culture's location
+
+    Returns
+    -------
+    tempStressBaseline : 4-tuple of float
+        (cold before flowering, cold after, heat before, heat after), cf.
+        climate_data.get_climate_data()
+    lightBaseline : 2-tuple of float
+        light intensity (before flowering, after flowering)
+    """
+    days = trial_days(trial_dates)
+    flowering_day = np.datetime64(floweringDate, 'D').astype(np.int64)
+    before, after = days[days < flowering_day], days[days >= flowering_day]
+    tempStressBaseline = tuple(temperature.baseline(name, window)
+                               for name in ('cold_stress', 'heat_stress')
+                               for window in (before, after))
+    lightBaseline = (light.baseline('light', before),
+                     light.baseline('light', after))
+    return tempStressBaseline, lightBaseline
+
+
+def culture_anomaly(climate_data, trial_dates, floweringDate, temperature,
+                    light):
+    """
+    calculates the anomalies (i.e. the differences to the long-term means)
+    of the cold/heat stress sums and light totals of a trial.
+
+    Parameters
+    ----------
+    climate_data : tuple
+        (has_irrigation, tempStressDays, droughtStressDays, lightIntensity),
+        cf. climate_data.get_climate_data()
+    trial_dates, floweringDate, temperature, light
+        cf. culture_baseline()
+
+    Returns
+    -------
+    tempStressAnomaly : 4-tuple of float
+    lightAnomaly : 2-tuple of float
+    """
+    _, tempStressDays, _, lightIntensity = climate_data
+    tempStressBaseline, lightBaseline = culture_baseline(
+        trial_dates, floweringDate, temperature, light)
+    return (tuple(value - baseline for value, baseline
+                  in zip(tempStressDays, tempStressBaseline)),
+            tuple(value - baseline for value, baseline
+                  in zip(lightIntensity, lightBaseline)))
+
+
+def main(args=None):
+    """builds climatologies or reports the anomalies of a culture"""
+    parser = argparse.ArgumentParser(
+        description="long-term climatology baselines per location")
+    subparsers = parser.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help='builds the climatologies')
+    build.add_argument('directory', help='directory of the .npz files')
+    build.add_argument('location_ids', nargs='+', type=int)
+    build.add_argument('--tub', type=float, default=30.0,
+                       help='temperature upper bound (default: 30.0)')
+    build.add_argument('--tlb', type=float, default=8.0,
+                       help='temperature lower bound (default: 8.0)')
+    anomaly = subparsers.add_parser(
+        'anomaly', help="compares a culture with its location's baseline")
+    anomaly.add_argument('directory', help='directory of the .npz files')
+    anomaly.add_argument('culture_id', type=int)
+    anomaly.add_argument('flowering_date',
+                         help='date string in YYYY-MM-DD format')
+    args = parser.parse_args(args)
+
+    # imported here to keep the startup time low (cf. climax.login)
+    from climax.session import ClimateSession
+    store = ClimatologyStore(args.directory)
+    if args.command == 'build':
+        from MySQLdb.cursors import SSCursor
+        session = ClimateSession(prepared=False)
+        connection = session.connect()
+        try:
+            store.build(connection.cursor(SSCursor), args.location_ids,
+                        args.tub, args.tlb)
+        finally:
+            connection.close()
+        return
+
+    with ClimateSession(cache_size=1) as session:
+        temperature, light = store.culture_climatologies(session.cursor(),
+                                                         args.culture_id)
+        session.tub = temperature.params['tub']
+        session.tlb = temperature.params['tlb']
+        climate_data = session.get_climate_data(args.culture_id,
+                                                args.flowering_date, 42)
+        trial_dates = session.fetch_culture(args.culture_id).trial_dates
+    tempStressBaseline, lightBaseline = culture_baseline(
+        trial_dates, args.flowering_date, temperature, light)
+    tempStressAnomaly, lightAnomaly = culture_anomaly(
+        climate_data, trial_dates, args.flowering_date, temperature, light)
+    print 'temperature stress days:', climate_data[1]
+    print '\tbaseline:', tempStressBaseline
+    print '\tanomaly:', tempStressAnomaly
+    print 'light intensity:', climate_data[3]
+    print '\tbaseline:', lightBaseline
+    print '\tanomaly:', lightAnomaly
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -10,74 +10,399 @@ cold-before, cold-after, heat-before, heat-after, light-before, light-after).
 """
 
 import sys
+import copy
+import heapq
+import datetime
 import argparse
 import traceback
+import multiprocessing
+from operator import itemgetter
+from collections import namedtuple, OrderedDict
 
-from climate_data import get_climate_data
-import login
+from culture_matrix import CultureMatrix, HEAT_LOAD_DAYS, HEAT_WAVE_DAYS
+from incremental import IncrementalState
+from output import (climate_result, get_writer, FORMATS, SEEKABLE_FORMATS,
+                    is_seekable, DatabaseWriter, RESULT_COLUMNS, RUN_COLUMNS,
+                    DEGREE_HOUR_COLUMNS)
+from pipeline import prefetch
+from schedule import estimate_costs, longest_first
+from session import ClimateSession
+from shared_data import SharedWeatherData
+from stations import STATIONS_TABLE
+from stress_index import StressIndexBuilder, trial_flags
 
+# number of input lines that are processed together (cf. CultureMatrix)
+CHUNK_SIZE = 250
 
-def get_climate_data_from_str(cursor, parameter_line):
+# error message for cultures without evaporation data (cf.
+# climate_data.get_drought_stress_days())
+NO_EVAPORATION_ERROR = "AssertionError: get_evaporation() returned no results\n"
+
+# an input line, its parameters and the data of its culture (or the error
+# message, if the line caused trouble)
+FetchedLine = namedtuple('FetchedLine', ['line_number', 'line', 'culture_id',
+                                         'date', 'soil_volume', 'culture',
+                                         'error'])
+
+
+def parse_parameter_line(parameter_line):
     """
     Parameters
     ----------
-    cursor : MySQLdb.cursors.Cursor
-        a cursor to the (running) database
     parameter_line : str
         one line from a tab-separated file containing culture_id,
-        flowering date, soil volume and field capacity
+        flowering date and soil volume
 
     Returns
     -------
-    culture_id, temp_stress_days, drought_stress_days, light_intensity
+    culture_id : int
+    flowering_date : str
+        date string in YYYY-MM-DD format
+    soil_volume : float
     """
-    global CURSOR
-    CURSOR = cursor
-    global CONNECTED_TO_DB
-    CONNECTED_TO_DB = False
-
     columns = parameter_line.split('\t')
     assert len(columns) == 3, "Line {0} in file {1} doesn't contain 4 columns"
-    culture_id, date, soil_volume = parameter_line.split('\t')
-    return int(culture_id), get_climate_data(int(culture_id), date,
-                                             float(soil_volume))
-
-
-def format_climate_data(climate_data):
-    """
-    formats climate data (climate_id, irrigation, temp_stress_days, drought_stress_days,
-    light_intensity) for tab-separated output.
-    """
-    culture_id, (irrigation, temp_stress_days, drought_stress_days, light_intensity) = climate_data
-    climate_str = (
-        '{culture_id}\t{drought_before}\t{drought_after}\t{control_drought_before}'
-        '\t{control_drought_after}\t{stress_drought_before}\t{stress_drought_after}'
-         '\t{cold_before}\t{cold_after}\t{heat_before}\t{heat_after}'
-         '\t{light_before}\t{light_after}\n')
-
-    # WARNING: WORKAROUND for clusterfuck in database management, cf. issue #6
-    if irrigation and culture_id not in (47109, 56879):
-        control_dsds, stress_dsds = drought_stress_days
-        return climate_str.format(
-            culture_id=culture_id,
-            drought_before='NA', drought_after='NA',
-            control_drought_before=control_dsds[0],
-            control_drought_after=control_dsds[1],
-            stress_drought_before=stress_dsds[0],
-            stress_drought_after=stress_dsds[1],
-            cold_before=temp_stress_days[0], cold_after=temp_stress_days[1],
-            heat_before=temp_stress_days[2], heat_after=temp_stress_days[3],
-            light_before=light_intensity[0], light_after=light_intensity[1])
+    culture_id, date, soil_volume = columns
+    return int(culture_id), date, float(soil_volume)
+
+
+def group_lines(lines):
+    """
+    reorders input lines, so that the lines of the same culture follow each
+    other (the cultures keep the order of their first line). Lines that
+    can't be parsed stay on their own.
+
+    Parameters
+    ----------
+    lines : iterable of (int, str) tuples
+        (line number, line) tuples
+
+    Returns
+    -------
+    groups : list of lists of (int, str) tuples
+        the lines of each culture
+    """
+    groups = OrderedDict()
+    for line_number, line in lines:
+        try:
+            key = parse_parameter_line(line)[0]
+        except Exception:
+            key = (line_number,)  # reported by fetch_lines()
+        groups.setdefault(key, []).append((line_number, line))
+    return groups.values()
+
+
+def in_input_order(results, line_numbers=None):
+    """
+    yields (line_number, ...) results in the order of their line numbers,
+    as soon as all results of the preceding lines are available.
+
+    Parameters
+    ----------
+    results : iterable of tuples
+        results whose first element is a line number
+    line_numbers : list of int or None
+        the line numbers of all results (default: 1, 2, 3, ...)
+    """
+    pending = []
+    if line_numbers is None:
+        expected = iter(xrange(1, sys.maxint))
     else:
-        return climate_str.format(
-            culture_id=culture_id,
-            drought_before=drought_stress_days[0],
-            drought_after=drought_stress_days[1],
-            control_drought_before='NA', control_drought_after='NA',
-            stress_drought_before='NA', stress_drought_after='NA',
-            cold_before=temp_stress_days[0], cold_after=temp_stress_days[1],
-            heat_before=temp_stress_days[2], heat_after=temp_stress_days[3],
-            light_before=light_intensity[0], light_after=light_intensity[1])
+        expected = iter(sorted(line_numbers))
+    next_line_number = next(expected, None)
+    for result in results:
+        heapq.heappush(pending, result)
+        while pending and pending[0][0] == next_line_number:
+            yield heapq.heappop(pending)
+            next_line_number = next(expected, None)
+    while pending:
+        yield heapq.heappop(pending)
+
+
+def parse_culture_id(parameter_line):
+    """returns the culture ID of an input line (None, if it can't be parsed)"""
+    try:
+        return parse_parameter_line(parameter_line)[0]
+    except Exception:
+        return None
+
+
+def record_results(state, results):
+    """
+    stores the results of recomputed lines in the state of an incremental
+    run and passes them on.
+    """
+    for i, line, result, error in results:
+        state.record(line, result)
+        yield i, line, result, error
+
+
+def index_results(builder, results):
+    """
+    adds the stress flags of computed lines (the last element of their
+    climate data) to a stress index and passes the lines on without them.
+    """
+    for i, line, climate_data, error in results:
+        if climate_data is not None:
+            climate_data, flags = climate_data[:-1], climate_data[-1]
+            culture_id, date, soil_volume = parse_parameter_line(line)
+            builder.add(culture_id, date, soil_volume, flags)
+        yield i, line, climate_data, error
+
+
+def fetch_lines(session, lines):
+    """
+    parses input lines and fetches the data of their cultures from the
+    database. If consecutive lines belong to the same culture (cf.
+    group_lines()), its data is only fetched once.
+
+    Parameters
+    ----------
+    session : session.ClimateSession
+        the session (i.e. database connection and cache) to use
+    lines : iterable of (int, str) tuples
+        (line number, line) tuples from a tab-separated file containing
+        culture_id, flowering date and soil volume
+
+    Yields
+    ------
+    fetched_line : FetchedLine
+        the parameters and culture data of the line or, if the line caused
+        trouble, the error message
+    """
+    last_culture_id, culture, error = None, None, None
+    for line_number, line in lines:
+        try:
+            culture_id, date, soil_volume = parse_parameter_line(line)
+        except Exception:
+            yield FetchedLine(line_number, line, None, None, None, None,
+                              traceback.format_exc())
+            continue
+
+        if culture_id != last_culture_id:
+            last_culture_id, culture, error = culture_id, None, None
+            try:
+                culture = session.fetch_culture(culture_id)
+            except Exception:
+                error = traceback.format_exc()
+        if error is None:
+            yield FetchedLine(line_number, line, culture_id, date, soil_volume,
+                              culture, None)
+        else:
+            yield FetchedLine(line_number, line, None, None, None, None, error)
+
+
+def compute_lines(fetched_lines, run_metrics=False, degree_hours=False,
+                  stress_flags=False):
+    """
+    calculates the climate data for a chunk of fetched input lines at once
+    (cf. CultureMatrix).
+
+    Parameters
+    ----------
+    fetched_lines : list of FetchedLine
+        cf. fetch_lines()
+    run_metrics : bool
+        If True, the run metrics of the cultures are calculated, too (cf.
+        CultureMatrix.run_metrics())
+    degree_hours : bool
+        If True, the degree hour metrics of the cultures are calculated, too
+        (cf. CultureMatrix.degree_hours())
+    stress_flags : bool
+        If True, the packed daily stress flags of each line are returned,
+        too (cf. stress_index.trial_flags())
+
+    Yields
+    ------
+    line_number : int
+        number of the input line
+    line : str
+        the input line
+    climate_data : (culture_id, get_climate_data() tuple) or None
+        the results for the line (followed by the run metrics, the degree
+        hour metrics and the stress flags, if requested) or None, if the
+        line caused trouble
+    error : str or None
+        the error message, if the line caused trouble
+    """
+    results = {f.line_number: f.error for f in fetched_lines
+               if f.error is not None}
+    fetched = [f for f in fetched_lines if f.error is None]
+    if fetched:
+        try:
+            results.update(evaluate_lines(fetched, run_metrics, degree_hours,
+                                          stress_flags))
+        except Exception:
+            # find the culprit(s) by processing the lines one at a time
+            for f in fetched:
+                try:
+                    results.update(evaluate_lines([f], run_metrics,
+                                                  degree_hours, stress_flags))
+                except Exception:
+                    results[f.line_number] = traceback.format_exc()
+
+    for f in fetched_lines:
+        result = results[f.line_number]
+        if isinstance(result, basestring):
+            yield f.line_number, f.line, None, result
+        else:
+            yield f.line_number, f.line, result, None
+
+
+def evaluate_lines(fetched_lines, run_metrics=False, degree_hours=False,
+                   stress_flags=False):
+    """
+    calculates the climate data of fetched input lines with a CultureMatrix.
+    Each culture is aggregated only once, even if several lines (i.e.
+    flowering date and soil volume variants) belong to it.
+
+    Returns
+    -------
+    results : dict, key = int, value = tuple or str
+        maps from a line number to its (culture_id, climate data) results
+        (followed by the run metrics, the degree hour metrics and the
+        stress flags, if run_metrics, degree_hours resp. stress_flags is
+        True) or to an error message, if no evaporation could be calculated for
+        its culture
+    """
+    cultures, rows = [], []
+    row_of_culture = {}  # maps from id(CultureData) to its matrix row
+    for f in fetched_lines:
+        if id(f.culture) not in row_of_culture:
+            row_of_culture[id(f.culture)] = len(cultures)
+            cultures.append(f.culture)
+        rows.append(row_of_culture[id(f.culture)])
+    matrix = CultureMatrix(cultures, degree_hours=degree_hours).select_rows(rows)
+    soil_volumes = [f.soil_volume for f in fetched_lines]
+    drought_flags = matrix.drought_flags(soil_volumes)
+    dates = [f.date for f in fetched_lines]
+    climate_data = [(f.culture_id, result) for f, result in zip(
+        fetched_lines, matrix.climate_data(dates, soil_volumes,
+                                           drought_flags=drought_flags))]
+    if run_metrics:
+        climate_data = [result + (runs,) for result, runs
+                        in zip(climate_data, matrix.run_metrics(drought_flags))]
+    if degree_hours:
+        climate_data = [result + (hours,) for result, hours
+                        in zip(climate_data, matrix.degree_hours(dates))]
+    if stress_flags:
+        climate_data = [result + (flags,) for result, flags
+                        in zip(climate_data, trial_flags(matrix, drought_flags))]
+    return {f.line_number: result if has_evaporation else NO_EVAPORATION_ERROR
+            for f, result, has_evaporation
+            in zip(fetched_lines, climate_data, matrix.has_evaporation.tolist())}
+
+
+def process_lines(session, lines, chunk_size=CHUNK_SIZE, run_metrics=False,
+                  degree_hours=False, stress_flags=False):
+    """
+    calculates the climate data of input lines chunk by chunk (cf.
+    fetch_lines() and compute_lines()).
+
+    Returns
+    -------
+    results : list of tuples
+        one (line_number, line, climate_data, error) tuple per input line
+        (cf. compute_lines())
+    """
+    grouped_lines = (line for group in group_lines(lines) for line in group)
+    results = []
+    for chunk in chunks(fetch_lines(session, grouped_lines), chunk_size):
+        results.extend(compute_lines(chunk, run_metrics, degree_hours,
+                                     stress_flags))
+    return sorted(results, key=itemgetter(0))
+
+
+def _process_lines_worker(args):
+    """runs process_lines() in a worker process (with a copy of the session)"""
+    session, lines, chunk_size, run_metrics, degree_hours, stress_flags = args
+    try:
+        return process_lines(session, lines, chunk_size, run_metrics,
+                             degree_hours, stress_flags)
+    finally:
+        session.close()
+
+
+def process_lines_in_parallel(session, lines, workers, chunk_size=CHUNK_SIZE,
+                              run_metrics=False, degree_hours=False,
+                              stress_flags=False, shared_data=False):
+    """
+    calculates the climate data of input lines with several worker processes.
+    The cost of each culture is estimated first (cf. climax.schedule) and the
+    cultures (with all their lines) are distributed longest-first over the
+    workers, so that all workers finish at about the same time. Each worker
+    processes its cultures in order of decreasing cost, so that the trials
+    in a chunk have similar lengths.
+
+    Parameters
+    ----------
+    session : session.ClimateSession
+        the session used to estimate the costs. Each worker uses a copy of
+        it (with its own database connection).
+    lines : iterable of (int, str) tuples
+        (line number, line) tuples from a tab-separated file containing
+        culture_id, flowering date and soil volume
+    workers : int
+        number of worker processes
+    shared_data : bool
+        If True, the hourly weather data of all cultures is fetched once
+        (one query per weather station) and shared with the workers through
+        a memory-mapped file (cf. climax.shared_data)
+
+    Returns
+    -------
+    results : list of tuples
+        one (line_number, line, climate_data, error) tuple per input line
+        (cf. compute_lines()), in input order
+    """
+    groups = group_lines(lines)
+    if not groups:
+        return []
+    culture_ids = []
+    for group in groups:
+        try:
+            culture_ids.append(parse_parameter_line(group[0][1])[0])
+        except Exception:
+            culture_ids.append(None)  # the worker will report the error
+    costs = estimate_costs([culture_id for culture_id in culture_ids
+                            if culture_id is not None], session.cursor())
+    bins = longest_first([costs.get(culture_id, 0) for culture_id in culture_ids],
+                         workers)
+
+    worker_session = session
+    if shared_data:
+        # the copy (cf. ClimateSession.__getstate__()) only carries the
+        # layout of the shared file to the workers
+        worker_session = copy.copy(session)
+        worker_session.shared_data = SharedWeatherData.build(
+            session.cursor(), [culture_id for culture_id in culture_ids
+                               if culture_id is not None])
+    pool = multiprocessing.Pool(len(bins))
+    try:
+        binned_results = pool.map(
+            _process_lines_worker,
+            [(worker_session, [line for i in items for line in groups[i]],
+              chunk_size, run_metrics, degree_hours, stress_flags)
+             for items in bins])
+    finally:
+        pool.close()
+        pool.join()
+        if shared_data:
+            worker_session.shared_data.close()
+    return sorted((result for results in binned_results for result in results),
+                  key=itemgetter(0))
+
+
+def chunks(items, chunk_size):
+    """splits an iterable into lists of at most chunk_size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def main(args=None):
@@ -96,27 +421,178 @@ def main(args=None):
               "heat stress days (before/after flowering) and light sum "
               "(before/after flowering). writes to STDOUT, if no filename "
               "is given."))
+    parser.add_argument(
+        '--chunk-size', type=int, default=CHUNK_SIZE,
+        help=("number of input lines that are processed together "
+              "(default: {})".format(CHUNK_SIZE)))
+    parser.add_argument(
+        '--prefetch', type=int, default=None,
+        help=("number of input lines whose data is fetched from the database "
+              "in the background, while the previous lines are computed. "
+              "0 disables prefetching (default: the chunk size)"))
+    parser.add_argument(
+        '--format', choices=FORMATS, default='tsv',
+        help=("output format: tab-separated text, a NumPy structured array "
+              "(.npy), Apache Parquet or Arrow (the latter two need pyarrow) "
+              "(default: tsv)"))
+    parser.add_argument(
+        '--results-table', default=None,
+        help=("also write the results into this database table (keyed by "
+              "run ID, culture ID, flowering date and soil volume)"))
+    parser.add_argument(
+        '--run-id', default=None,
+        help=("identifies the run in the results table (default: the "
+              "current date and time)"))
+    parser.add_argument(
+        '--incremental', metavar='STATE_FILE', default=None,
+        help=("only recompute the lines whose culture got new source data "
+              "(weather, precipitation, irrigation, trial dates) since the "
+              "last run with this state file, take the other results from "
+              "the state file (can't be combined with --fill-gaps)"))
+    parser.add_argument(
+        '--run-metrics', action='store_true',
+        help=("add the longest drought stress runs, the maximum heat stress "
+              "sum of {} consecutive days and the number of heat waves (at "
+              "least {} consecutive heat stress days) of each trial to the "
+              "output").format(HEAT_LOAD_DAYS, HEAT_WAVE_DAYS))
+    parser.add_argument(
+        '--degree-hours', action='store_true',
+        help=("add the hours with a temperature above/below the temperature "
+              "bounds and the degree hours above/below them (before/after "
+              "flowering) to the output"))
+    parser.add_argument(
+        '--stress-index', metavar='INDEX_FILE', default=None,
+        help=("write an index of the daily cold, heat and drought stress "
+              "flags of all lines (.npz) for fast cross-trial queries (cf. "
+              "climax_stress_index). With --incremental, the index is "
+              "updated."))
+    parser.add_argument(
+        '--fill-gaps', action='store_true',
+        help=("fill gaps in the hourly weather data of each culture with the "
+              "distance-weighted data of the nearest weather stations"))
+    parser.add_argument(
+        '--stations-table', default=STATIONS_TABLE,
+        help=("the table of the weather stations with their coordinates "
+              "(columns station_id, latitude and longitude), used by "
+              "--fill-gaps (default: {})".format(STATIONS_TABLE)))
+    parser.add_argument(
+        '--prepared-statements', action='store_true',
+        help=("run the queries as server-side prepared statements (cf. "
+              "benchmarks/prepared.py, whether this is faster for your "
+              "database)"))
+    parser.add_argument(
+        '--shared-data', action='store_true',
+        help=("with more than one worker, fetch the hourly weather data of "
+              "each weather station only once and share it with all workers "
+              "(in a memory-mapped file) instead of fetching it per culture "
+              "in each worker"))
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help=("number of worker processes. With more than one worker, the "
+              "cost of each input line is estimated first and the lines are "
+              "distributed longest-first over the workers (default: 1)"))
     args = parser.parse_args(sys.argv[1:])
+    if args.prefetch is None:
+        args.prefetch = args.chunk_size
 
     if not args.input_file:
         sys.exit(1)
+    if args.format in SEEKABLE_FORMATS and not is_seekable(args.output_file):
+        parser.error("the {} format can't be written to a pipe, please give "
+                     "an output file".format(args.format))
+    if args.incremental and args.fill_gaps:
+        # the results would also depend on the data of the neighbouring
+        # stations, which isn't part of the fingerprints
+        parser.error("--incremental can't be combined with --fill-gaps")
 
-    database = login.get_db()
-    cursor = database.cursor()
-
-    args.output_file.write(
-        ('culture-id\tdrought-before\tdrought-after\tcontrol-drought-before'
-         '\tcontrol-drought-after\tstress-drought-before\tstress-drought-after'
-         '\tcold-before\tcold-after\theat-before\theat-after'
-         '\tlight-before\tlight-after\n'))
+    # repeated cultures are grouped (cf. group_lines()), so no cache is needed
+    session = ClimateSession(cache_size=0, prepared=args.prepared_statements,
+                             fill_gaps=args.fill_gaps,
+                             stations_table=args.stations_table)
+    # the connections of the session, the output and the results table
+    # are closed, even if processing the lines fails
+    try:
+        if args.fill_gaps:
+            # the station index is built once, before any culture is processed
+            # (and copied into the worker processes)
+            try:
+                session.gap_filler
+            except ValueError as error:
+                parser.error(str(error))
 
-    for i, line in enumerate(args.input_file, 1):
+        columns = (RESULT_COLUMNS + (RUN_COLUMNS if args.run_metrics else ()) +
+                   (DEGREE_HOUR_COLUMNS if args.degree_hours else ()))
+        writer = get_writer(args.output_file, args.format, columns)
+        db_writer = None
         try:
-            climate_data = get_climate_data_from_str(cursor, line)
-            args.output_file.write(format_climate_data(climate_data))
-        except Exception as e:
-            sys.stderr.write('line {} in file {} caused trouble: {}'.format(i, args.input_file.name, line))
-            sys.stderr.write(traceback.format_exc())
+            if args.results_table:
+                run_id = (args.run_id or
+                          datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
+                db_writer = DatabaseWriter(session.pool, run_id, args.results_table)
+
+            # the lines of the same culture are processed together, so that its
+            # data is only fetched and aggregated once
+            lines = [line for group in group_lines(enumerate(args.input_file, 1))
+                     for line in group]
+            cached = []
+            if args.incremental:
+                state = IncrementalState(args.incremental, columns)
+                lines, cached = state.select_lines(
+                    session.cursor(),
+                    [(i, line, parse_culture_id(line)) for i, line in lines])
+            stress_flags = args.stress_index is not None
+            if stress_flags:
+                builder = StressIndexBuilder(args.stress_index,
+                                             update=args.incremental is not None)
+            if args.workers > 1:
+                results = process_lines_in_parallel(session, lines, args.workers,
+                                                    args.chunk_size, args.run_metrics,
+                                                    args.degree_hours, stress_flags,
+                                                    args.shared_data)
+            else:
+                # the session is only used by fetch_lines(), i.e. by the background
+                # thread, if prefetching is enabled
+                fetched_lines = fetch_lines(session, lines)
+                if args.prefetch > 0:
+                    fetched_lines = prefetch(fetched_lines, args.prefetch)
+                results = in_input_order(
+                    (result for chunk in chunks(fetched_lines, args.chunk_size)
+                     for result in compute_lines(chunk, args.run_metrics,
+                                                 args.degree_hours, stress_flags)),
+                    [i for i, _ in lines])
+
+            if stress_flags:
+                results = index_results(builder, results)
+            results = ((i, line,
+                        None if climate_data is None
+                        else climate_result(climate_data, columns),
+                        error) for i, line, climate_data, error in results)
+            if args.incremental:
+                results = heapq.merge(
+                    record_results(state, results),
+                    ((i, line, result, None) for i, line, result in cached))
+
+            for i, line, result, error in results:
+                if error is None:
+                    writer.write(result)
+                    if db_writer is not None:
+                        _, date, soil_volume = parse_parameter_line(line)
+                        db_writer.write(result, date, soil_volume)
+                else:
+                    sys.stderr.write('line {} in file {} caused trouble: {}'.format(i, args.input_file.name, line))
+                    sys.stderr.write(error)
+        finally:
+            try:
+                writer.close()
+            finally:
+                if db_writer is not None:
+                    db_writer.close()
+        if args.incremental:
+            state.save()
+        if stress_flags:
+            builder.save(session.cursor())
+    finally:
+        session.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+"""
+This module calculates the climate data (temperature stress days, drought
+stress days and light intensity) of many cultures at once.
+
+The daily data of all cultures is stacked into (culture x trial day)
+matrices, which are aligned by trial day (day 0 is the first day of each
+trial) and masked beyond the end of each trial. The soil water model, the
+temperature stress sums and the light sums are then calculated for all
+cultures with one set of array operations, i.e. the Python overhead no
+longer grows with the number of cultures.
+"""
+
+import numpy as np
+
+from climax.climate_data import (CONTROL, STRESS, SHELTER_CULTURES,
+                                 UNSPLIT_CULTURES, INITIAL_DAYS)
+from climax.metrics import compute_metrics, HOUR_METRICS, DEGREE_HOUR_METRICS
+from climax.series import ClimateSeries
+from climax.runs import longest_run, count_runs, max_window_sum
+
+# the heat load of a trial is the maximum heat stress sum of this many
+# consecutive days
+HEAT_LOAD_DAYS = 7
+
+# a heat wave is a run of at least this many consecutive heat stress days
+HEAT_WAVE_DAYS = 3
+
+
+def stack_series(series_list, first_days, stride):
+    """
+    concatenates the series of several cultures into one series, in which
+    the timestamps are shifted so that day t of the trial of culture c
+    becomes day c * stride + t. Values outside of a trial are dropped.
+
+    Daily metrics calculated from the stacked series (cf.
+    climax.metrics.compute_metrics()) can be mapped back to (culture,
+    trial day) with divmod(day, stride).
+    """
+    shifted = []
+    for c, (series, first_day) in enumerate(zip(series_list, first_days)):
+        trial_days = series.days - first_day
+        in_trial = (trial_days >= 0) & (trial_days < stride)
+        series = series.select(in_trial)
+        series.hours = series.hours + 24 * (c * stride - first_day)
+        shifted.append(series)
+    return ClimateSeries.concatenate(shifted)
+
+
+def last_value_per_day(days, values):
+    """
+    returns the unique days and the last value given for each of them (like
+    building a dict from (day, value) pairs).
+    """
+    # np.unique returns the first occurrence, so we search the reversed arrays
+    unique_days, last = np.unique(days[::-1], return_index=True)
+    return unique_days, values[::-1][last]
+
+
+def positive_sums(values, mask):
+    """
+    sums up the positive values of each row of a matrix within the mask.
+    Like the sum() of an empty list, a row without positive values sums up
+    to the int 0.
+    """
+    selected = mask & (values > 0.0)
+    sums = np.where(selected, values, 0.0).sum(axis=1).tolist()
+    counts = selected.sum(axis=1).tolist()
+    return [total if count else 0 for total, count in zip(sums, counts)]
+
+
+class CultureMatrix(object):
+    """
+    the daily data of many cultures, stacked into (culture x trial day)
+    matrices. A culture may occur several times (e.g. to evaluate different
+    flowering dates or soil volumes).
+
+    Attributes
+    ----------
+    culture_ids : np.ndarray of int
+        culture ID of each row
+    first_days : np.ndarray of int
+        first trial day (days since 1970-01-01) of each row
+    num_days : np.ndarray of int
+        number of trial days of each row
+    valid : np.ndarray of bool, shape (cultures, days)
+        True for all trial days of each row
+    has_evaporation : np.ndarray of bool
+        True, iff evaporation could be calculated for at least one day of
+        the trial (cf. climate_data.get_drought_stress_days())
+    hourly : dict or None
+        maps from the name of a degree hour metric (cf.
+        metrics.DEGREE_HOUR_METRICS) to a (culture x trial day) matrix of
+        its daily sums, if the matrix was built with degree_hours=True
+    """
+    def __init__(self, cultures, tub=30.0, tlb=8.0, degree_hours=False):
+        """
+        Parameters
+        ----------
+        cultures : list of climate_data.CultureData
+            the data of each culture (with ClimateSeries for its precipitation,
+            irrigation, climate and light data)
+        tub : float
+            temperature upper bound
+        tlb : float
+            temperature lower bound
+        degree_hours : bool
+            If True, the hours and degree hours beyond the temperature
+            bounds are aggregated, too (in the same pass over the hourly
+            data, cf. degree_hours())
+        """
+        assert cultures, "Can't build a CultureMatrix without cultures"
+        self.culture_ids = np.array([c.culture_id for c in cultures], dtype=np.int64)
+        self.first_days = np.array(
+            [c.trial_dates[0] for c in cultures], dtype='datetime64[D]').astype(np.int64)
+        self.num_days = np.array([len(c.trial_dates) for c in cultures], dtype=np.int64)
+        self.stride = int(self.num_days.max())
+        shape = (len(cultures), self.stride)
+        self.valid = np.arange(self.stride) < self.num_days[:, np.newaxis]
+
+        self.has_irrigation = np.array([len(c.irrigation) > 0 for c in cultures])
+        self.shelter = np.in1d(self.culture_ids, SHELTER_CULTURES)
+        self.split = self.has_irrigation & ~np.in1d(self.culture_ids, UNSPLIT_CULTURES)
+
+        # a single pass of the metric engine over the stacked hourly data of
+        # all cultures
+        names = ['cold_stress', 'heat_stress', 'evaporation', 'light']
+        if degree_hours:
+            names.extend(DEGREE_HOUR_METRICS)
+        metrics = compute_metrics(
+            {'climate': stack_series([c.climate_data for c in cultures],
+                                     self.first_days, self.stride),
+             'light': stack_series([c.light_data for c in cultures],
+                                   self.first_days, self.stride)},
+            names, tub=tub, tlb=tlb)
+        self.cold = self._scatter(shape, *metrics['cold_stress'])
+        self.heat = self._scatter(shape, *metrics['heat_stress'])
+        self.light = self._scatter(shape, *metrics['light'])
+        self.evaporation = self._scatter(shape, *metrics['evaporation'])
+        self.has_evaporation = np.zeros(len(cultures), dtype=bool)
+        self.has_evaporation[metrics['evaporation'][0] // self.stride] = True
+        self.hourly = None
+        if degree_hours:
+            self.hourly = {name: self._scatter(shape, *metrics[name])
+                           for name in DEGREE_HOUR_METRICS}
+
+        precipitation = stack_series([c.precipitation for c in cultures],
+                                     self.first_days, self.stride)
+        self.precipitation = self._scatter(
+            shape, *last_value_per_day(precipitation.days, precipitation['amount']))
+        self._stack_irrigation(cultures, shape)
+
+    def _scatter(self, shape, days, values):
+        """
+        converts a daily metric of the stacked cultures into a (culture x
+        trial day) matrix (days without a value are 0.0).
+        """
+        matrix = np.zeros(shape)
+        rows, trial_days = np.divmod(days, self.stride)
+        matrix[rows, trial_days] = values
+        return matrix
+
+    def _stack_irrigation(self, cultures, shape):
+        """
+        stacks the irrigation data into matrices. Like the dict-based soil
+        water model, only the last irrigation amount of a treatment on a day
+        counts and a treatment without irrigation on a day on which the other
+        treatment was irrigated has no soil water on that day.
+        """
+        irrigation = stack_series([c.irrigation for c in cultures],
+                                  self.first_days, self.stride)
+        treatment_ids = irrigation['treatment_id']
+        unknown = ~np.in1d(treatment_ids, CONTROL + (STRESS,))
+        if unknown.any():
+            raise ValueError('Unexpected treatment ID: {}'.format(
+                treatment_ids[unknown][0]))
+
+        self.irrigated = np.zeros(shape, dtype=bool)
+        rows, trial_days = np.divmod(irrigation.days, self.stride)
+        self.irrigated[rows, trial_days] = True
+
+        # maps from a treatment name to (irrigation amounts, irrigated) matrices
+        self.irrigation = {}
+        for treatment, is_treatment in (
+                ('control', np.in1d(treatment_ids, CONTROL)),
+                ('stress', treatment_ids == STRESS)):
+            days, amounts = last_value_per_day(irrigation.days[is_treatment],
+                                               irrigation['amount'][is_treatment])
+            irrigated = self._scatter(shape, days, np.ones(days.size)) > 0
+            self.irrigation[treatment] = self._scatter(shape, days, amounts), irrigated
+
+    def select_rows(self, rows):
+        """
+        returns a CultureMatrix containing the given rows of this one (in
+        the given order, rows may be repeated). This is much cheaper than
+        building a new matrix, e.g. to evaluate several flowering dates or
+        soil volumes of the same culture.
+
+        Parameters
+        ----------
+        rows : array-like of int
+            indices of the rows to select
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        selected = object.__new__(CultureMatrix)
+        for name, value in self.__dict__.items():
+            if isinstance(value, np.ndarray):
+                value = value[rows]
+            selected.__dict__[name] = value
+        selected.irrigation = {treatment: (amounts[rows], irrigated[rows])
+                               for treatment, (amounts, irrigated)
+                               in self.irrigation.items()}
+        if self.hourly is not None:
+            selected.hourly = {name: sums[rows]
+                               for name, sums in self.hourly.items()}
+        return selected
+
+    def flowering_offsets(self, floweringDates):
+        """
+        converts one flowering date per row into trial days (clipped to the
+        range of each trial).
+        """
+        flowering_days = np.array(floweringDates, dtype='datetime64[D]').astype(np.int64)
+        return np.clip(flowering_days - self.first_days, 0, self.num_days)
+
+    def soil_water(self, soilVolumes):
+        """
+        calculates the soil water values of all trial days of all rows for
+        both treatments (cf. climate_data.get_soil_water() and
+        climate_data.get_shelter_soil_water()). The recurrence is stepped
+        through the trial days once, with all cultures in each step.
+
+        Parameters
+        ----------
+        soilVolumes : array-like of float
+            soil volume of each row
+
+        Returns
+        -------
+        soil_water : dict, key = str, value = np.ndarray
+            maps from a treatment ('control', 'stress') to a (culture x
+            trial day) matrix of soil water values
+        """
+        volumes = np.asarray(soilVolumes, dtype=float)
+        soil_water = {treatment: np.zeros(self.valid.shape)
+                      for treatment in ('control', 'stress')}
+        for treatment, water in soil_water.items():
+            amounts, irrigated = self.irrigation[treatment]
+            # the shelter keeps the rain off the stress treatment during the
+            # initial days
+            sheltered = self.shelter if treatment == 'stress' \
+                else np.zeros_like(self.shelter)
+            yesterday = np.zeros(len(volumes))
+            for day in range(self.stride):
+                precipitation = self.precipitation[:, day]
+                if day < INITIAL_DAYS:
+                    water_gain = np.where(sheltered, 0.0, precipitation)
+                    irri_gain = np.where(sheltered, amounts[:, day],
+                                         precipitation + amounts[:, day])
+                    today = np.minimum(volumes, water_gain + yesterday)
+                    irrigated_today = np.minimum(volumes, irri_gain + yesterday)
+                else:
+                    evaporation = self.evaporation[:, day]
+                    today = np.maximum(np.minimum(
+                        yesterday - evaporation + precipitation, volumes), 0.0)
+                    irrigated_today = np.maximum(np.minimum(
+                        yesterday - evaporation + (precipitation + amounts[:, day]),
+                        volumes), 0.0)
+                today = np.where(self.irrigated[:, day],
+                                 np.where(irrigated[:, day], irrigated_today, 0.0),
+                                 today)
+                water[:, day] = yesterday = np.where(self.valid[:, day], today, 0.0)
+        return soil_water
+
+    def drought_flags(self, soilVolumes, stress_factor=0.2):
+        """
+        flags the drought stress days of all rows for both treatments.
+
+        Returns
+        -------
+        flags : dict, key = str, value = np.ndarray of bool
+            maps from a treatment ('control', 'stress') to a (culture x
+            trial day) matrix, which is True for the trial days whose soil
+            water lies below the stress threshold
+        """
+        thresholds = np.asarray(soilVolumes, dtype=float)[:, np.newaxis] * stress_factor
+        return {treatment: (water < thresholds) & self.valid
+                for treatment, water in self.soil_water(soilVolumes).items()}
+
+    def daily_flags(self, drought_flags):
+        """
+        flags the cold, heat and drought stress days of all rows.
+
+        Parameters
+        ----------
+        drought_flags : dict
+            the drought stress days of the rows (cf. drought_flags())
+
+        Returns
+        -------
+        flags : dict, key = str, value = np.ndarray of bool
+            maps from 'cold', 'heat', 'drought' (the control treatment resp.
+            the only treatment) and 'stress_drought' (the stress treatment,
+            never set for rows without a treatment split) to a (culture x
+            trial day) matrix
+        """
+        return {'cold': (self.cold > 0.0) & self.valid,
+                'heat': (self.heat > 0.0) & self.valid,
+                'drought': drought_flags['control'],
+                'stress_drought': drought_flags['stress'] & self.split[:, np.newaxis]}
+
+    def drought_stress_days(self, soilVolumes, floweringDates, stress_factor=0.2,
+                            drought_flags=None):
+        """
+        calculates the number of drought stress days before and after the
+        flowering date of each row (cf.
+        climate_data.get_drought_stress_days()).
+
+        Parameters
+        ----------
+        drought_flags : dict or None
+            the drought stress days of the rows, if they are already known
+            (cf. drought_flags())
+
+        Returns
+        -------
+        droughtStressDays : list
+            one (before, after) tuple per row or, iff the row distinguishes
+            control and stress, a ((control before, control after),
+            (stress before, stress after)) tuple
+        """
+        if drought_flags is None:
+            drought_flags = self.drought_flags(soilVolumes, stress_factor)
+        flowering = self.flowering_offsets(floweringDates)
+        rows = np.arange(len(flowering))
+        counts = {}
+        for treatment, flags in drought_flags.items():
+            stress_days = np.cumsum(flags, axis=1)
+            total = stress_days[:, -1]
+            before = np.where(flowering > 0, stress_days[rows, flowering - 1], 0)
+            counts[treatment] = zip(before.tolist(), (total - before).tolist())
+
+        return [(counts['control'][i], counts['stress'][i]) if self.split[i]
+                else counts['control'][i]
+                for i in rows]
+
+    def temp_stress_days(self, floweringDates):
+        """
+        calculates the sums of cold stress and heat stress before and after
+        the flowering date of each row (cf. climate_data.get_temp_stress_days()).
+
+        Returns
+        -------
+        tempStressDays : list of 4-tuples of float
+            one (cold before, cold after, heat before, heat after) tuple per row
+        """
+        before, after = self._flowering_masks(floweringDates)
+        return zip(positive_sums(self.cold, before), positive_sums(self.cold, after),
+                   positive_sums(self.heat, before), positive_sums(self.heat, after))
+
+    def light_intensity(self, floweringDates):
+        """
+        calculates the light intensity before and after the flowering date
+        of each row (cf. climate_data.get_light_intensity()).
+
+        Returns
+        -------
+        lightIntensity : list of 2-tuples of float
+        """
+        before, after = self._flowering_masks(floweringDates)
+        return zip(positive_sums(self.light, before),
+                   positive_sums(self.light, after))
+
+    def degree_hours(self, floweringDates):
+        """
+        calculates the hours and degree hours beyond the temperature bounds
+        before and after the flowering date of each row (cf.
+        climate_data.get_degree_hours()). The matrix has to be built with
+        degree_hours=True.
+
+        Returns
+        -------
+        degreeHours : list of 8-tuples
+            one (heat hours before, heat hours after, cold hours before,
+            cold hours after, heat degree hours before, heat degree hours
+            after, cold degree hours before, cold degree hours after) tuple
+            per row. The hours are ints.
+        """
+        assert self.hourly is not None, \
+            "The CultureMatrix was built without degree_hours"
+        before, after = self._flowering_masks(floweringDates)
+        columns = []
+        for name in DEGREE_HOUR_METRICS:
+            for mask in (before, after):
+                sums = positive_sums(self.hourly[name], mask)
+                if name in HOUR_METRICS:
+                    sums = [int(hours) for hours in sums]
+                columns.append(sums)
+        return zip(*columns)
+
+    def _flowering_masks(self, floweringDates):
+        """masks of the trial days before/after the flowering date of each row"""
+        before = (np.arange(self.stride) <
+                  self.flowering_offsets(floweringDates)[:, np.newaxis])
+        return before & self.valid, ~before & self.valid
+
+    def run_metrics(self, drought_flags, heat_load_days=HEAT_LOAD_DAYS,
+                    heat_wave_days=HEAT_WAVE_DAYS):
+        """
+        calculates the run-length and sliding-window metrics of the whole
+        trial of each row (cf. climax.runs).
+
+        Parameters
+        ----------
+        drought_flags : dict
+            the drought stress days of the rows (cf. drought_flags())
+        heat_load_days : int
+            number of consecutive days, whose heat stress sum is the heat load
+        heat_wave_days : int
+            minimum number of consecutive heat stress days of a heat wave
+
+        Returns
+        -------
+        run_metrics : list of 5-tuples
+            one (longest drought run, longest control drought run, longest
+            stress drought run, heat load, number of heat waves) tuple per
+            row. Like the drought stress days, the longest drought run is
+            None for rows that distinguish control and stress, the
+            control/stress runs are None for the other rows.
+        """
+        control = longest_run(drought_flags['control']).tolist()
+        stress = longest_run(drought_flags['stress']).tolist()
+        heat_load = max_window_sum(self.heat, heat_load_days).tolist()
+        heat_waves = count_runs((self.heat > 0.0) & self.valid,
+                                heat_wave_days).tolist()
+        return [((None, control[i], stress[i]) if self.split[i]
+                 else (control[i], None, None)) + (heat_load[i], heat_waves[i])
+                for i in range(len(self.culture_ids))]
+
+    def climate_data(self, floweringDates, soilVolumes, stress_factor=0.2,
+                     drought_flags=None):
+        """
+        calculates the climate data of all rows.
+
+        Parameters
+        ----------
+        floweringDates : list of str
+            flowering date of each row in YYYY-MM-DD format
+        soilVolumes : list of float
+            soil volume of each row
+        stress_factor : float
+            stress threshold = stress factor * soil volume
+        drought_flags : dict or None
+            the drought stress days of the rows, if they are already known
+            (cf. drought_flags())
+
+        Returns
+        -------
+        climate_data : list of tuples
+            one (has_irrigation, tempStressDays, droughtStressDays,
+            lightIntensity) tuple per row (cf. climate_data.get_climate_data())
+        """
+        return zip(self.has_irrigation.tolist(),
+                   self.temp_stress_days(floweringDates),
+                   self.drought_stress_days(soilVolumes, floweringDates,
+                                            stress_factor, drought_flags),
+                   self.light_intensity(floweringDates))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+This module provides a per-culture index of daily values (e.g. light sums,
+temperature stress degrees, drought stress flags) over a contiguous range of
+days. The index stores prefix sums, so that the total of any value over any
+date interval (e.g. before/after a flowering date) is answered in O(1) and
+many dates can be queried at once.
+"""
+
+import numpy as np
+
+from climax.resample import epoch_days
+
+
+class DayIndex(object):
+    """
+    prefix sums of named daily series over the days first_day ... last_day
+    (both inclusive, given as days since 1970-01-01). Days without a value
+    count as 0.
+
+    Example
+    -------
+    >>> index = DayIndex(first_day, last_day)
+    >>> index.add('light', days, daily_light)
+    >>> before, after = index.split('light', ['2012-06-25', '2012-07-01'])
+    """
+    def __init__(self, first_day, last_day):
+        self.first_day = int(epoch_days(first_day))
+        self.num_days = int(epoch_days(last_day)) - self.first_day + 1
+        assert self.num_days > 0, "last_day can't be before first_day"
+        self.prefix_sums = {}
+
+    def __contains__(self, name):
+        return name in self.prefix_sums
+
+    @property
+    def names(self):
+        return sorted(self.prefix_sums)
+
+    def add(self, name, days, values):
+        """
+        adds a daily series to the index.
+
+        Parameters
+        ----------
+        name : str
+            name of the series, e.g. 'light'
+        days : array-like
+            days of the values (cf. resample.epoch_days()), each day
+            must occur at most once and lie within the range of the index
+        values : array-like of float or int
+            the value of each day
+        """
+        positions = epoch_days(days) - self.first_day
+        assert np.all((positions >= 0) & (positions < self.num_days)), \
+            "Can't index days outside of the range of the index"
+        values = np.asarray(values)
+        dense = np.zeros(self.num_days, dtype=values.dtype if values.size else float)
+        dense[positions] = values
+        self.prefix_sums[name] = np.concatenate(([0], np.cumsum(dense)))
+
+    def _positions(self, days):
+        """position of each day in the prefix sum arrays"""
+        return np.clip(epoch_days(days) - self.first_day, 0, self.num_days)
+
+    def before(self, name, days):
+        """
+        returns the total of the named series over all days before each of
+        the given days.
+        """
+        return self.prefix_sums[name][self._positions(days)]
+
+    def total(self, name):
+        """returns the total of the named series over all days"""
+        return self.prefix_sums[name][-1]
+
+    def interval(self, name, start, end):
+        """
+        returns the total of the named series over the days start (inclusive)
+        to end (exclusive). start and end may be arrays of days.
+        """
+        prefix_sums = self.prefix_sums[name]
+        return (prefix_sums[self._positions(end)] -
+                prefix_sums[self._positions(start)])
+
+    def split(self, name, flowering_dates):
+        """
+        splits the total of the named series around each flowering date.
+
+        Parameters
+        ----------
+        name : str
+            name of the series
+        flowering_dates : array-like
+            one or more flowering dates (cf. resample.epoch_days(), e.g.
+            'YYYY-MM-DD' strings or datetime.date instances)
+
+        Returns
+        -------
+        before : np.ndarray
+            total over all days before each flowering date
+        after : np.ndarray
+            total over all days on or after each flowering date
+        """
+        before = self.before(name, np.atleast_1d(flowering_dates))
+        return before, self.total(name) - before
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+This module supports incremental batch runs, which only recompute the
+cultures whose source data changed since the last run.
+
+The climate data of a culture depends on its trial dates, the irrigation
+of the culture, the precipitation and solar radiation at its location and
+the hourly data of the weather stations used at its location (cf.
+usesWeatherStation). Each of these sources is summarized per culture by
+a cheap fingerprint, which only covers the rows during the trial of the
+culture (the number of valid rows and a checksum of their contents, resp.
+the trial dates), so changed rows are detected without fetching them and
+new rows at a station don't invalidate the cultures whose trials ended
+before.
+
+The fingerprints and the results of the last run are kept in a state file
+(JSON). A line of the batch input is recomputed, iff it has no result in
+the state file or a source of its culture has a new fingerprint.
+
+Incremental runs don't fill gaps in the weather data (cf. climax.stations),
+because the data of the neighbouring stations isn't fingerprinted.
+"""
+
+import os
+import json
+
+from climax.output import RESULT_COLUMNS, result_type
+from climax.prepared import expand_list_parameters
+from climax.queries import (CULTURE_STATE_QUERY, STATION_STATE_QUERY, PRECIPITATION_STATE_QUERY,
+                            SOLAR_STATE_QUERY, IRRIGATION_STATE_QUERY)
+
+# maps from the stationData of a weather station to its table
+STATION_TABLES = {'FFHM': 'dwd_hourlyMeanWindspeed_FFHM',
+                  'TAHV': 'dwd_hourlyAirTemperature_TAHV',
+                  'UUHV': 'dwd_hourlyRelHumidity_UUHV'}
+
+
+def run_list_query(cursor, query, name, values):
+    """runs a query with a list parameter and returns all result rows"""
+    if not values:
+        return []
+    cursor.execute(*expand_list_parameters(query, {name: sorted(values)}))
+    return cursor.fetchall()
+
+
+def source_fingerprints(cursor, culture_ids):
+    """
+    calculates the fingerprints of the data sources of cultures (one query
+    per kind of source).
+
+    Returns
+    -------
+    fingerprints : dict, key = str, value = str
+        maps from a source key (kind of source and culture ID, e.g.
+        'culture:56878', 'irrigation:56878', 'precipitation:56878',
+        'solar:56878', 'TAHV:56878') to its fingerprint. Sources without
+        any rows during the trial have no fingerprint.
+    """
+    queries = [('culture', CULTURE_STATE_QUERY),
+               ('irrigation', IRRIGATION_STATE_QUERY),
+               ('precipitation', PRECIPITATION_STATE_QUERY),
+               ('solar', SOLAR_STATE_QUERY)]
+    queries.extend((station_data, STATION_STATE_QUERY.format(
+                        station_data=station_data, table=table))
+                   for station_data, table in sorted(STATION_TABLES.items()))
+
+    fingerprints = {}
+    for kind, query in queries:
+        for row in run_list_query(cursor, query, 'CULTURE_IDS', culture_ids):
+            fingerprints['{}:{}'.format(kind, row[0])] = \
+                '/'.join(str(value) for value in row[1:])
+    return fingerprints
+
+
+def source_keys(culture_id):
+    """returns the keys of the sources of a culture (cf. source_fingerprints())"""
+    return ['{}:{}'.format(kind, culture_id)
+            for kind in ['culture', 'irrigation', 'precipitation', 'solar'] +
+            sorted(STATION_TABLES)]
+
+
+class IncrementalState(object):
+    """
+    the fingerprints of the data sources and the results of the last
+    incremental run, stored in a JSON file. Stored results with other
+    columns than the current ones (e.g. without run or degree hour
+    metrics) are recomputed.
+    """
+    def __init__(self, path, columns=RESULT_COLUMNS):
+        self.path = path
+        self.columns = tuple(columns)
+        self.result_type = result_type(self.columns)
+        self.fingerprints = {}
+        self.results = {}  # maps from an input line to its result
+        if os.path.exists(path):
+            with open(path, 'r') as state_file:
+                state = json.load(state_file)
+            self.fingerprints = state['fingerprints']
+            self.results = state['results']
+
+    def select_lines(self, cursor, lines):
+        """
+        splits the input lines into those that have to be recomputed and
+        those whose results can be taken from the last run.
+
+        Parameters
+        ----------
+        cursor : MySQLdb.cursors.Cursor
+            a cursor to the (running) database
+        lines : list of (int, str, int or None) tuples
+            (line number, line, culture ID) tuples. The culture ID is None,
+            if the line can't be parsed.
+
+        Returns
+        -------
+        stale_lines : list of (int, str) tuples
+            the lines to recompute
+        cached : list of (int, str, ClimateResult) tuples
+            the lines with up-to-date results (in input order)
+        """
+        culture_ids = set(culture_id for _, _, culture_id in lines
+                          if culture_id is not None)
+        new_fingerprints = source_fingerprints(cursor, culture_ids)
+        changed = set(culture_id for culture_id in culture_ids
+                      if any(self.fingerprints.get(key) != new_fingerprints.get(key)
+                             for key in source_keys(culture_id)))
+        for culture_id in culture_ids:
+            for key in source_keys(culture_id):
+                if key in new_fingerprints:
+                    self.fingerprints[key] = new_fingerprints[key]
+                else:
+                    self.fingerprints.pop(key, None)
+
+        stale_lines, cached = [], []
+        for line_number, line, culture_id in lines:
+            result = self.results.get(line.strip())
+            if (culture_id is None or result is None or
+                    len(result) != len(self.columns) or
+                    culture_id in changed):
+                stale_lines.append((line_number, line))
+            else:
+                cached.append((line_number, line, self.result_type(*result)))
+        return stale_lines, sorted(cached)
+
+    def record(self, line, result):
+        """stores the result of an input line (None, if it caused trouble)"""
+        if result is None:
+            self.results.pop(line.strip(), None)
+        else:
+            self.results[line.strip()] = list(result)
+
+    def save(self):
+        """writes the state file (atomically)"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump({'fingerprints': self.fingerprints,
+                       'results': self.results}, state_file)
+        os.rename(temp_path, self.path)
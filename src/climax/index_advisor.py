@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""
+This script checks whether the database has the indexes the queries in
+climax.queries rely on. It runs EXPLAIN on every query (cf.
+advised_queries()) for some sample cultures, reports full table scans,
+writes a migration that adds the missing covering indexes (and optionally
+applies it) and reports the times of the read-only queries before and
+after the migration.
+
+Usage: climax_index_advisor [--apply] [--migration FILE] [culture_id ...]
+"""
+
+import sys
+import time
+import argparse
+import datetime
+
+from climax import login, queries
+from climax.prepared import expand_list_parameters
+from climax.stations import COLUMN_STATIONS, STATIONS_TABLE
+
+# the queries in climax.queries that aren't checked: the DDL of the results
+# table and the query that reads the (small) table of the weather stations
+# as a whole, once per session
+EXCLUDED_QUERIES = ('CREATE_RESULTS_TABLE_QUERY', 'STATION_COORDINATES_QUERY')
+
+# the values of the {table} placeholder of the queries, which don't run on
+# the dwd_hourly* tables (cf. station_queries())
+TABLES = {'UPSERT_RESULT_QUERY': queries.RESULTS_TABLE,
+          'STATION_COORDINATES_QUERY': STATIONS_TABLE}
+
+
+def station_queries(name, query):
+    """
+    yields a (name, query, station data) tuple for each table a query runs
+    on: the {table} (and {station_data}) placeholder of a query on the
+    weather station data is replaced with each dwd_hourly* table (and its
+    station data, e.g. 'TAHV'), the name gets the station data appended.
+    """
+    if '{table}' not in query:
+        yield name, query, None
+    elif name in TABLES:
+        yield name, query.format(table=TABLES[name]), None
+    else:
+        for station_data, table in sorted(COLUMN_STATIONS.values()):
+            yield ('{}[{}]'.format(name, station_data),
+                   query.format(table=table, station_data=station_data),
+                   station_data)
+
+
+def advised_queries():
+    """
+    returns the queries in climax.queries (i.e. all the *_QUERY names
+    except EXCLUDED_QUERIES) as a list of (name, query, station data)
+    tuples (cf. station_queries()).
+    """
+    return [advised
+            for name in sorted(dir(queries))
+            if name.endswith('_QUERY') and name not in EXCLUDED_QUERIES
+            for advised in station_queries(name, getattr(queries, name))]
+
+
+# the checked queries (name, query, station data)
+QUERIES = advised_queries()
+
+# the indexes the queries rely on: (table, index name, columns). The
+# filtered columns come first, the selected columns last, so that the
+# queries can be answered from the index alone.
+INDEXES = (
+    ('dwd_hourlyMeanWindspeed_FFHM', 'climax_station_datum',
+     ('station_id', 'datum', 'invalid', 'amount')),
+    ('dwd_hourlyAirTemperature_TAHV', 'climax_station_datum',
+     ('station_id', 'datum', 'invalid', 'amount')),
+    ('dwd_hourlyRelHumidity_UUHV', 'climax_station_datum',
+     ('station_id', 'datum', 'invalid', 'amount')),
+    ('usesWeatherStation', 'climax_location_data',
+     ('location_id', 'stationData', 'station_id')),
+    ('usesWeatherStation', 'climax_station_data',
+     ('station_id', 'stationData', 'location_id')),
+    ('cultures', 'climax_location',
+     ('location_id', 'id', 'planted', 'terminated')),
+    ('precipitation', 'climax_location_datum',
+     ('location_id', 'invalid', 'datum', 'amount')),
+    ('irrigation', 'climax_culture_treatment',
+     ('culture_id', 'invalid', 'treatment_id', 'datum', 'amount')),
+    ('solarCalc_hourlySolarRadiation', 'climax_location_datum',
+     ('location_id', 'datum', 'invalid', 'amount')),
+)
+
+EXISTING_INDEXES_QUERY = """
+SELECT TABLE_NAME, INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX)
+FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE()
+GROUP BY TABLE_NAME, INDEX_NAME;
+""".strip().replace('\n', ' ')
+# results in three columns: table name, index name, comma-separated columns
+
+CREATE_INDEX_STATEMENT = 'ALTER TABLE {table} ADD INDEX {name} ({columns});'
+
+# replaces an index of the same name with other columns (e.g. one added by
+# an older version of this script)
+REPLACE_INDEX_STATEMENT = \
+    'ALTER TABLE {table} DROP INDEX {name}, ADD INDEX {name} ({columns});'
+
+
+def sample_parameters(cursor, culture_id):
+    """
+    finds the parameters of the queries for a sample culture.
+
+    Returns
+    -------
+    params : dict
+        the named parameters of the queries (the culture, its location and
+        its trial window)
+    station_ids : dict, key = str, value = int
+        maps from the station data (e.g. 'TAHV') to the ID of the weather
+        station used at the location of the culture
+    """
+    culture_ids = {'CULTURE_IDS': [culture_id]}
+    cursor.execute(*expand_list_parameters(queries.CULTURE_SOURCES_QUERY,
+                                           culture_ids))
+    location_id, station_ids = None, {}
+    for _, location_id, station_data, station_id in cursor.fetchall():
+        if station_data is not None:
+            station_ids.setdefault(station_data, station_id)
+    cursor.execute(*expand_list_parameters(queries.CULTURE_STATE_QUERY,
+                                           culture_ids))
+    rows = cursor.fetchall()
+    if location_id is None or not rows:
+        raise ValueError("Culture {} doesn't exist".format(culture_id))
+    _, planted, terminated = rows[0]
+    params = {'CULTURE_ID': culture_id, 'CULTURE_IDS': [culture_id],
+              'LOCATION_ID': location_id, 'LOCATION_IDS': [location_id],
+              # the trial window (cf. queries.TRIAL_DATES_QUERY)
+              'START': planted + datetime.timedelta(days=14),
+              'END': terminated}
+    return params, station_ids
+
+
+def query_parameters(name, station_data, sample):
+    """
+    returns the parameters of a query (cf. advised_queries()) for a sample
+    culture (cf. sample_parameters()) or None, if no weather station for
+    the query's station data is used at the culture's location.
+    """
+    params, station_ids = sample
+    if name == 'UPSERT_RESULT_QUERY':
+        # a result row (run ID, culture, flowering date, soil volume, six
+        # drought stress day counts and six temperature/light sums)
+        return (('climax_index_advisor', params['CULTURE_ID'], params['END'],
+                 42.0) + (0,) * 6 + (0.0,) * 6)
+    if station_data is None:
+        return params
+    if station_data not in station_ids:
+        return None
+    return dict(params, STATION_ID=station_ids[station_data])
+
+
+def bind(query, params):
+    """expands the list parameters of a query with named parameters"""
+    if isinstance(params, dict):
+        return expand_list_parameters(query, params)
+    return query, params
+
+
+def explain(cursor, query, params):
+    """
+    runs EXPLAIN on a query.
+
+    Returns
+    -------
+    plan : list of dicts
+        one dict per row of the query plan (keys are the column names of
+        the EXPLAIN output, e.g. 'table', 'type', 'key', 'rows')
+    """
+    cursor.execute(*bind('EXPLAIN ' + query, params))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """returns the steps of a query plan that read a whole table"""
+    return [step for step in plan if step.get('type') == 'ALL']
+
+
+def is_read_only(query):
+    """returns True, iff the query only reads (i.e. can be timed)"""
+    return query.lstrip().upper().startswith('SELECT')
+
+
+def time_query(cursor, query, params):
+    """returns the time (in seconds) it takes to run a query and fetch its results"""
+    start = time.time()
+    cursor.execute(*bind(query, params))
+    cursor.fetchall()
+    return time.time() - start
+
+
+def time_queries(cursor, samples):
+    """
+    times the read-only queries for the sample cultures. Each query is run
+    once for each culture before it's timed, so that the timings before and
+    after a migration are measured with the same (warm) caches.
+
+    Parameters
+    ----------
+    samples : list of (dict, dict) tuples
+        the parameters of the sample cultures (cf. sample_parameters())
+
+    Returns
+    -------
+    timings : dict, key = str, value = float
+        maps from the name of a query to its total time (in seconds) for
+        all the given cultures
+    """
+    timings = {}
+    for name, query, station_data in QUERIES:
+        if not is_read_only(query):
+            continue
+        runs = [params for params in (query_parameters(name, station_data, sample)
+                                      for sample in samples)
+                if params is not None]
+        for params in runs:
+            time_query(cursor, query, params)  # warms up the caches
+        timings[name] = sum(time_query(cursor, query, params)
+                            for params in runs)
+    return timings
+
+
+def existing_indexes(cursor):
+    """
+    Returns
+    -------
+    indexes : dict, key = str, value = dict
+        maps from a table name to a dict, which maps from the name of each
+        of its indexes to its columns (tuple of str)
+    """
+    cursor.execute(EXISTING_INDEXES_QUERY)
+    indexes = {}
+    for table, name, columns in cursor.fetchall():
+        indexes.setdefault(table, {})[name] = tuple(columns.split(','))
+    return indexes
+
+
+def missing_indexes(cursor):
+    """
+    returns the indexes in INDEXES, which aren't covered by an existing
+    index (i.e. no index of the table starts with the same columns), as
+    (table, index name, columns, replace) tuples. replace is True, iff the
+    table has an index of that name (with other columns).
+    """
+    indexes = existing_indexes(cursor)
+    missing = []
+    for table, name, columns in INDEXES:
+        existing = indexes.get(table, {})
+        if not any(other[:len(columns)] == columns
+                   for other in existing.values()):
+            missing.append((table, name, columns, name in existing))
+    return missing
+
+
+def migration(indexes):
+    """returns the SQL statements that add (or replace) the given indexes"""
+    return [(REPLACE_INDEX_STATEMENT if replace else CREATE_INDEX_STATEMENT)
+            .format(table=table, name=name, columns=', '.join(columns))
+            for table, name, columns, replace in indexes]
+
+
+def main(args=None):
+    """explains the queries, writes/applies the migration, reports timings"""
+    parser = argparse.ArgumentParser(
+        description="checks the indexes the climaX queries rely on")
+    parser.add_argument('culture_ids', nargs='*', type=int,
+                        default=[56878, 44443],
+                        help='sample cultures (default: 56878 44443)')
+    parser.add_argument('--migration', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='writes the migration to this file (default: STDOUT)')
+    parser.add_argument('--apply', action='store_true',
+                        help='adds the missing indexes to the database')
+    args = parser.parse_args(args)
+
+    connection = login.get_db()
+    cursor = connection.cursor()
+    try:
+        samples = [sample_parameters(cursor, culture_id)
+                   for culture_id in args.culture_ids]
+    except ValueError as error:
+        parser.error(str(error))
+
+    for name, query, station_data in QUERIES:
+        for culture_id, sample in zip(args.culture_ids, samples):
+            params = query_parameters(name, station_data, sample)
+            if params is None:
+                continue
+            try:
+                plan = explain(cursor, query, params)
+            except Exception as error:
+                # e.g. the results table doesn't exist (yet)
+                sys.stderr.write("{} (culture {}): can't explain: {}\n".format(
+                    name, culture_id, error))
+                continue
+            for step in full_scans(plan):
+                sys.stderr.write(
+                    '{} (culture {}): full scan of table {} ({} rows)\n'.format(
+                        name, culture_id, step.get('table'), step.get('rows')))
+
+    statements = migration(missing_indexes(cursor))
+    for statement in statements:
+        args.migration.write(statement + '\n')
+    if not statements:
+        sys.stderr.write('All indexes exist.\n')
+
+    before = time_queries(cursor, samples)
+    if args.apply and statements:
+        for statement in statements:
+            sys.stderr.write('applying: {}\n'.format(statement))
+            cursor.execute(statement)
+        connection.commit()
+        after = time_queries(cursor, samples)
+    else:
+        after = None
+
+    sys.stderr.write('{:<36}{:>12}{:>12}\n'.format('query', 'before [s]',
+                                                   'after [s]'))
+    for name in sorted(before):
+        sys.stderr.write('{:<36}{:>12.3f}{:>12}\n'.format(
+            name, before[name],
+            'NA' if after is None else '{:.3f}'.format(after[name])))
+    cursor.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -10,16 +10,130 @@ credentials called 'login.yaml'. In case you don't have one, see
 """
 
 import os
+import sys
+import threading
+import Queue
+from contextlib import contextmanager
 
-import MySQLdb
-import yaml
+CONFIG_PATH = os.path.expanduser('~/.climax.yaml')
 
-CONFIG_FILE = open(os.path.expanduser('~/.climax.yaml'), 'r')
-CONFIG = yaml.load(CONFIG_FILE)
+# the login credentials, which are only read when the first connection is
+# opened (cf. get_config())
+CONFIG = None
 
-def get_db(host=CONFIG['host'], user=CONFIG['user'],
-           passwd=CONFIG['passwd'], db=CONFIG['db']):
+
+def get_config(path=CONFIG_PATH):
+    """
+    returns the login credentials (a dict with the keys host, user, passwd
+    and db), which are read from the config file on the first call.
+    """
+    global CONFIG
+    if CONFIG is None:
+        import yaml
+        with open(path, 'r') as config_file:
+            CONFIG = yaml.load(config_file)
+    return CONFIG
+
+
+def get_db(host=None, user=None, passwd=None, db=None):
+    """
+    opens a connection to the MySQL database. Missing login credentials are
+    taken from the config file (cf. get_config()).
+    """
+    # the database driver is only imported when it's actually needed
+    import MySQLdb
+    if None in (host, user, passwd, db):
+        config = get_config()
+        host = config['host'] if host is None else host
+        user = config['user'] if user is None else user
+        passwd = config['passwd'] if passwd is None else passwd
+        db = config['db'] if db is None else db
     return MySQLdb.connect(host, user, passwd, db)
 
+
+class ConnectionPool(object):
+    """
+    a pool of up to ``size`` database connections, which are opened lazily.
+    Several threads can use the pool at the same time, each connection is
+    only used by one thread at a time.
+
+    Example
+    -------
+    >>> pool = ConnectionPool(size=5)
+    >>> with pool.connection() as connection:
+    ...     cursor = connection.cursor()
+    """
+    def __init__(self, size=5, connect=None, release=None):
+        """
+        Parameters
+        ----------
+        size : int
+            maximum number of open connections
+        connect : function or None
+            opens a new connection (default: get_db)
+        release : function or None
+            is called with each connection before it is closed
+        """
+        self.size = size
+        self.connect = connect or get_db
+        self.release = release
+        self.idle = Queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        borrows a connection from the pool (waiting for one to become idle,
+        if all connections are in use) and returns it afterwards.
+        """
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self.lock:
+            can_open = self.opened < self.size
+            if can_open:
+                self.opened += 1
+        if not can_open:
+            return self.idle.get()
+        try:
+            return self.connect()
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def close(self):
+        """
+        closes all idle connections. If closing a connection fails, the
+        remaining ones are closed before the (first) error is raised.
+        """
+        error = None
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            with self.lock:
+                self.opened -= 1
+            try:
+                try:
+                    if self.release is not None:
+                        self.release(connection)
+                finally:
+                    connection.close()
+            except Exception:
+                error = error or sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
 if __name__ == '__main__':
     print get_db()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+"""
+This module calculates daily climate metrics (e.g. temperature stress,
+evaporation, light sums) in a single pass over the hourly data.
+
+Each metric declares the per-day accumulators it needs, i.e. a statistic
+('sum', 'count', 'mean', 'min' or 'max') of a column of a data source
+('climate': hourly temperature, windspeed, relative humidity (and the VPD
+derived from them); 'light': hourly solar radiation). The rows of each
+source are converted into columns and grouped by day only once, every
+accumulator needed by any of the requested metrics is then filled by
+one grouped reduction, so that adding a metric doesn't add another pass
+over the rows.
+
+New metrics are added with the ``register_metric`` decorator:
+
+>>> @register_metric('max_windspeed', Accumulator('climate', 'windspeed', 'max'))
+... def max_windspeed(daily, params):
+...     return daily['climate', 'windspeed', 'max']
+"""
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from climax.vpd_heatsum import calc_VPD
+from climax.series import as_series, CLIMATE_COLUMNS, LIGHT_COLUMNS
+
+STATS = ('sum', 'count', 'mean', 'min', 'max')
+
+# the columns of each data source
+SOURCES = {'climate': CLIMATE_COLUMNS, 'light': LIGHT_COLUMNS}
+
+Accumulator = namedtuple('Accumulator', ['source', 'column', 'stat'])
+Metric = namedtuple('Metric', ['name', 'accumulators', 'compute'])
+
+# maps from the name of a metric to a Metric
+METRICS = OrderedDict()
+
+# maps from the name of a derived column to (source, function), where
+# function calculates the derived column from the (raw) columns of the source
+DERIVED_COLUMNS = {}
+
+
+def register_metric(name, *accumulators):
+    """
+    decorator that registers a function as a daily metric.
+
+    The function is called with a DailyAccumulators instance and a dict of
+    parameters (e.g. {'tub': 30.0, 'tlb': 8.0}) and has to return a
+    (days, values) tuple of arrays (days since 1970-01-01, one value per day).
+
+    Parameters
+    ----------
+    name : str
+        name of the metric
+    accumulators : Accumulator
+        the per-day accumulators the metric needs
+    """
+    for accumulator in accumulators:
+        assert accumulator.stat in STATS, \
+            "Unknown statistic: {}".format(accumulator.stat)
+
+    def decorator(func):
+        METRICS[name] = Metric(name, accumulators, func)
+        return func
+    return decorator
+
+
+def register_column(source, name):
+    """
+    decorator that registers a function as a derived column of a data
+    source. The function is called with a dict mapping from column names to
+    arrays (missing values are NaN, cf. source_columns()) and the dict of
+    parameters of the metrics (cf. register_metric()) and returns the
+    derived column.
+    """
+    def decorator(func):
+        DERIVED_COLUMNS[name] = (source, func)
+        return func
+    return decorator
+
+
+def present(values):
+    """
+    converts a column of hourly values into a float array, in which all
+    values that evaluate to False (i.e. None and 0.0) are missing (NaN).
+    This is the way the metrics have always treated missing values.
+    """
+    values = np.array(values, dtype=float)
+    values[values == 0.0] = np.nan
+    return values
+
+
+def measured(values):
+    """
+    converts a column of hourly values into a float array, in which only
+    the values that weren't measured (None resp. NaN) are missing, i.e. a
+    value of 0.0 is kept (cf. present()).
+    """
+    return np.asarray(values, dtype=float)
+
+
+@register_column('climate', 'vpd')
+def vpd_column(columns, params):
+    """hourly Vapour Pressure Deficit (where temperature and humidity are given)"""
+    # rel. humidity is coming in as percentage, needs to be fraction
+    return calc_VPD(columns['temperature'], columns['humidity'] / 100.0)
+
+
+@register_column('light', 'positive_radiation')
+def positive_radiation_column(columns, params):
+    """hourly solar radiation, where it is positive"""
+    radiation = columns['radiation']
+    with np.errstate(invalid='ignore'):  # NaN (missing) isn't positive
+        return np.where(radiation > 0.0, radiation, np.nan)
+
+
+class DailyAccumulators(object):
+    """
+    the per-day accumulators of one or more data sources. Accumulators are
+    accessed as ``daily[source, column, stat]`` and returned as a (days,
+    values) tuple of arrays, which only contains the days on which the
+    column has at least one value.
+    """
+    def __init__(self):
+        self.accumulators = {}
+
+    def __getitem__(self, key):
+        return self.accumulators[Accumulator(*key)]
+
+    def __contains__(self, key):
+        return Accumulator(*key) in self.accumulators
+
+
+def source_columns(source, data):
+    """
+    returns the columns of a data source.
+
+    Parameters
+    ----------
+    source : str
+        name of the data source ('climate' or 'light')
+    data : ClimateSeries or list of tuples
+        the hourly data of the source
+
+    Returns
+    -------
+    days : np.ndarray of int
+        the day (since 1970-01-01) of each hourly value
+    columns : dict, key = str, value = np.ndarray of float
+        maps from a column name to its values (missing values are NaN, cf.
+        present()) and from 'measured_' + column name to its values with
+        only the unmeasured values missing (cf. measured())
+    """
+    series = as_series(data, SOURCES[source])
+    columns = {column: present(series[column]) for column in SOURCES[source]}
+    columns.update(('measured_' + column, measured(series[column]))
+                   for column in SOURCES[source])
+    return series.days, columns
+
+
+def accumulate(sources, accumulators, params=None):
+    """
+    fills the given per-day accumulators with a single grouping pass over
+    the rows of each data source.
+
+    Parameters
+    ----------
+    sources : dict, key = str, value = ClimateSeries or list of tuples
+        maps from a source name ('climate', 'light') to its hourly data
+    accumulators : iterable of Accumulator
+    params : dict or None
+        parameters of the derived columns, e.g. {'tub': 30.0}
+
+    Returns
+    -------
+    daily : DailyAccumulators
+    """
+    needed = OrderedDict()  # (source, column) -> set of stats
+    for accumulator in accumulators:
+        needed.setdefault((accumulator.source, accumulator.column),
+                          set()).add(accumulator.stat)
+
+    daily = DailyAccumulators()
+    for source in sorted(set(source for source, _ in needed)):
+        days, columns = source_columns(source, sources[source])
+        days, day_codes = np.unique(days, return_inverse=True)
+        for (column_source, column), stats in needed.items():
+            if column_source != source:
+                continue
+            if column not in columns:
+                columns[column] = DERIVED_COLUMNS[column][1](columns,
+                                                             params or {})
+            values = columns[column]
+            mask = ~np.isnan(values)
+            codes, values = day_codes[mask], values[mask]
+
+            # bincount adds up the values of each day in row order
+            counts = np.bincount(codes, minlength=days.size)
+            has_values = counts > 0
+            results = {'count': counts}
+            if stats & set(['sum', 'mean']):
+                results['sum'] = np.bincount(codes, weights=values,
+                                             minlength=days.size)
+                results['mean'] = results['sum'] / np.maximum(counts, 1)
+            if 'min' in stats:
+                results['min'] = np.full(days.size, np.inf)
+                np.minimum.at(results['min'], codes, values)
+            if 'max' in stats:
+                results['max'] = np.full(days.size, -np.inf)
+                np.maximum.at(results['max'], codes, values)
+            for stat in stats:
+                daily.accumulators[Accumulator(source, column, stat)] = \
+                    days[has_values], results[stat][has_values]
+    return daily
+
+
+def compute_metrics(sources, metrics=None, **params):
+    """
+    calculates daily metrics with a single pass over the rows of each data
+    source.
+
+    Parameters
+    ----------
+    sources : dict, key = str, value = ClimateSeries or list of tuples
+        maps from a source name ('climate', 'light') to its hourly data
+    metrics : list of str or None
+        names of registered metrics. By default, all metrics whose data
+        sources are given will be calculated.
+    params : dict
+        parameters of the metrics, e.g. tub=30.0, tlb=8.0
+
+    Returns
+    -------
+    results : dict, key = str, value = (np.ndarray, np.ndarray)
+        maps from the name of a metric to a (days, values) tuple of arrays
+    """
+    if metrics is None:
+        metrics = [name for name, metric in METRICS.items()
+                   if all(acc.source in sources for acc in metric.accumulators)]
+    accumulators = set()
+    for name in metrics:
+        accumulators.update(METRICS[name].accumulators)
+    daily = accumulate(sources, accumulators, params)
+    return {name: METRICS[name].compute(daily, params) for name in metrics}
+
+
+def penman_evaporation(vpd, windspeed):
+    """
+    Calculates evaporation in mm/day from
+    vapour pressure deficit and windspeed.
+    Formula from Principles of Environmental Physics (Penman 1948)
+
+    ATT: Windspeed is coming in as m/s, needs to be mph
+
+    Parameters
+    ----------
+    vpd : float or np.ndarray of float
+        Vapour Pressure Deficit
+    windspeed : float or np.ndarray of float
+        wind in m/s
+
+    Returns
+    -------
+    evaporation : float or np.ndarray of float
+        evaporation occurring in a day
+    """
+    ms_to_mph = 2.23693629205
+    windspeed_in_mph = windspeed * ms_to_mph
+    return 0.376 * vpd * (windspeed_in_mph ** 0.76)
+
+
+@register_metric('cold_stress', Accumulator('climate', 'temperature', 'min'))
+def cold_stress(daily, params):
+    """degrees the daily minimum temperature lies below tlb (default: 8.0)"""
+    tlb = params.get('tlb', 8.0)
+    days, tmin = daily['climate', 'temperature', 'min']
+    return days, np.where(tmin < tlb, tlb - tmin, 0.0)
+
+
+@register_metric('heat_stress', Accumulator('climate', 'temperature', 'max'))
+def heat_stress(daily, params):
+    """degrees the daily maximum temperature lies above tub (default: 30.0)"""
+    tub = params.get('tub', 30.0)
+    days, tmax = daily['climate', 'temperature', 'max']
+    return days, np.where(tmax > tub, tmax - tub, 0.0)
+
+
+@register_metric('evaporation', Accumulator('climate', 'vpd', 'mean'),
+                 Accumulator('climate', 'windspeed', 'mean'))
+def evaporation(daily, params):
+    """
+    daily Penman evaporation in mm/day (only for days with both VPD and
+    windspeed data)
+    """
+    vpd_days, vpd = daily['climate', 'vpd', 'mean']
+    wind_days, windspeed = daily['climate', 'windspeed', 'mean']
+    days = np.intersect1d(vpd_days, wind_days, assume_unique=True)
+    return days, penman_evaporation(vpd[np.searchsorted(vpd_days, days)],
+                                    windspeed[np.searchsorted(wind_days, days)])
+
+
+@register_metric('light', Accumulator('light', 'positive_radiation', 'sum'))
+def light(daily, params):
+    """daily sum of the (positive) hourly solar radiation"""
+    return daily['light', 'positive_radiation', 'sum']
+
+
+# the hours and degree hours beyond the temperature bounds are calculated
+# from the measured temperatures, i.e. an hour at 0.0 degrees counts (unlike
+# in the daily minimum and maximum temperature, cf. present())
+
+
+def _with_missing(values, temperature):
+    """marks the hourly values without a temperature as missing (NaN)"""
+    return np.where(np.isnan(temperature), np.nan, values)
+
+
+@register_column('climate', 'heat_excess')
+def heat_excess_column(columns, params):
+    """degrees the hourly temperature lies above tub (default: 30.0)"""
+    temperature, tub = columns['measured_temperature'], params.get('tub', 30.0)
+    with np.errstate(invalid='ignore'):  # NaN (missing) isn't above tub
+        return _with_missing(np.where(temperature > tub, temperature - tub, 0.0),
+                             temperature)
+
+
+@register_column('climate', 'cold_excess')
+def cold_excess_column(columns, params):
+    """degrees the hourly temperature lies below tlb (default: 8.0)"""
+    temperature, tlb = columns['measured_temperature'], params.get('tlb', 8.0)
+    with np.errstate(invalid='ignore'):
+        return _with_missing(np.where(temperature < tlb, tlb - temperature, 0.0),
+                             temperature)
+
+
+@register_column('climate', 'above_tub')
+def above_tub_column(columns, params):
+    """1.0 for the hours with a temperature above tub, else 0.0"""
+    temperature, tub = columns['measured_temperature'], params.get('tub', 30.0)
+    with np.errstate(invalid='ignore'):
+        return _with_missing((temperature > tub).astype(float), temperature)
+
+
+@register_column('climate', 'below_tlb')
+def below_tlb_column(columns, params):
+    """1.0 for the hours with a temperature below tlb, else 0.0"""
+    temperature, tlb = columns['measured_temperature'], params.get('tlb', 8.0)
+    with np.errstate(invalid='ignore'):
+        return _with_missing((temperature < tlb).astype(float), temperature)
+
+
+@register_metric('heat_degree_hours', Accumulator('climate', 'heat_excess', 'sum'))
+def heat_degree_hours(daily, params):
+    """daily sum of the degrees the hourly temperature lies above tub"""
+    return daily['climate', 'heat_excess', 'sum']
+
+
+@register_metric('cold_degree_hours', Accumulator('climate', 'cold_excess', 'sum'))
+def cold_degree_hours(daily, params):
+    """daily sum of the degrees the hourly temperature lies below tlb"""
+    return daily['climate', 'cold_excess', 'sum']
+
+
+@register_metric('heat_hours', Accumulator('climate', 'above_tub', 'sum'))
+def heat_hours(daily, params):
+    """daily number of hours with a temperature above tub"""
+    return daily['climate', 'above_tub', 'sum']
+
+
+@register_metric('cold_hours', Accumulator('climate', 'below_tlb', 'sum'))
+def cold_hours(daily, params):
+    """daily number of hours with a temperature below tlb"""
+    return daily['climate', 'below_tlb', 'sum']
+
+
+# the metrics that count hours (resp. sum up degree hours) beyond the
+# temperature bounds, in the order of output.DEGREE_HOUR_COLUMNS
+HOUR_METRICS = ('heat_hours', 'cold_hours')
+DEGREE_HOUR_METRICS = HOUR_METRICS + ('heat_degree_hours', 'cold_degree_hours')
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+"""
+This module converts the climate data of a culture into a flat, typed
+result row (ClimateResult) and writes result rows as tab-separated text
+(the default), as a NumPy structured array (.npy) or as an Apache
+Parquet/Arrow file.
+
+All writers are streaming writers, i.e. they only keep a small batch of
+rows in memory. The columnar formats store the drought stress days of the
+control/stress treatments (resp. of cultures without a treatment split)
+as nullable integer columns instead of 'NA' strings: Parquet/Arrow use
+real nulls, the .npy format uses NULL_DAYS.
+
+Parquet/Arrow output needs the (optional) pyarrow package.
+
+Results can also be written into a database table (DatabaseWriter), in
+which they are keyed by run ID, culture ID, flowering date and soil volume.
+
+The run-length and sliding-window metrics of the trials (cf.
+CultureMatrix.run_metrics()) and the hours and degree hours beyond the
+temperature bounds (cf. CultureMatrix.degree_hours()) are optional columns
+(RUN_COLUMNS, DEGREE_HOUR_COLUMNS) of the file formats.
+"""
+
+import sys
+import struct
+import threading
+import Queue
+from collections import namedtuple
+
+import numpy as np
+
+from climax.climate_data import has_treatment_split
+from climax.queries import (RESULTS_TABLE, CREATE_RESULTS_TABLE_QUERY,
+                            UPSERT_RESULT_QUERY)
+
+RESULT_COLUMNS = ('culture_id',
+                  'drought_before', 'drought_after',
+                  'control_drought_before', 'control_drought_after',
+                  'stress_drought_before', 'stress_drought_after',
+                  'cold_before', 'cold_after', 'heat_before', 'heat_after',
+                  'light_before', 'light_after')
+
+# the climate data of one culture as a flat row. Drought fields that don't
+# apply to the culture are None.
+ClimateResult = namedtuple('ClimateResult', RESULT_COLUMNS)
+
+DROUGHT_COLUMNS = RESULT_COLUMNS[1:7]
+
+# the optional run metrics of a culture (cf. CultureMatrix.run_metrics())
+RUN_COLUMNS = ('drought_run', 'control_drought_run', 'stress_drought_run',
+               'heat_load', 'heat_waves')
+
+# a ClimateResult with run metrics
+ClimateRunResult = namedtuple('ClimateRunResult', RESULT_COLUMNS + RUN_COLUMNS)
+
+# the optional degree hour metrics of a culture (cf.
+# CultureMatrix.degree_hours())
+DEGREE_HOUR_COLUMNS = ('heat_hours_before', 'heat_hours_after',
+                       'cold_hours_before', 'cold_hours_after',
+                       'heat_degree_hours_before', 'heat_degree_hours_after',
+                       'cold_degree_hours_before', 'cold_degree_hours_after')
+
+# the integer columns, which may be missing (None)
+NULLABLE_COLUMNS = DROUGHT_COLUMNS + RUN_COLUMNS[:3]
+
+# the type of each column
+COLUMN_TYPES = dict([('culture_id', np.int64), ('heat_load', np.float64),
+                     ('heat_waves', np.int32)] +
+                    [(name, np.int32) for name in NULLABLE_COLUMNS] +
+                    [(name, np.int32) for name in DEGREE_HOUR_COLUMNS[:4]] +
+                    [(name, np.float64) for name in
+                     RESULT_COLUMNS[7:] + DEGREE_HOUR_COLUMNS[4:]])
+
+# maps from the columns of a result to its namedtuple (cf. result_type())
+RESULT_TYPES = {RESULT_COLUMNS: ClimateResult,
+                RESULT_COLUMNS + RUN_COLUMNS: ClimateRunResult}
+
+
+def result_type(columns=RESULT_COLUMNS):
+    """returns the namedtuple of results with the given columns"""
+    columns = tuple(columns)
+    if columns not in RESULT_TYPES:
+        RESULT_TYPES[columns] = namedtuple('ClimateResult', columns)
+    return RESULT_TYPES[columns]
+
+
+def result_dtype(columns=RESULT_COLUMNS):
+    """returns the NumPy structured dtype of results with the given columns"""
+    return np.dtype([(name, COLUMN_TYPES[name]) for name in columns])
+
+# the columns of a result as a NumPy structured dtype
+RESULT_DTYPE = result_dtype(RESULT_COLUMNS)
+
+# marks a missing number of drought stress days in .npy files
+NULL_DAYS = -1
+
+# number of rows that the columnar writers write at once
+BATCH_SIZE = 10000
+
+# number of rows that are inserted into the database per transaction
+DB_BATCH_SIZE = 500
+
+FORMATS = ('tsv', 'npy', 'parquet', 'arrow')
+
+
+def climate_result(climate_data, columns=None):
+    """
+    converts climate data (culture_id, (irrigation, temp_stress_days,
+    drought_stress_days, light_intensity)) into a ClimateResult. Further
+    elements of the climate data (e.g. the run metrics of the culture, cf.
+    CultureMatrix.run_metrics()) are appended to the result.
+
+    Parameters
+    ----------
+    climate_data : tuple
+        (culture_id, climate data, extra metrics...)
+    columns : tuple of str or None
+        the columns of the result (cf. result_type()). By default, the
+        third element of the climate data are the run metrics (i.e. a
+        ClimateRunResult is returned), if there is one.
+    """
+    culture_id, (irrigation, temp_stress_days, drought_stress_days,
+                 light_intensity) = climate_data[:2]
+    # WARNING: WORKAROUND for clusterfuck in database management, cf. issue #6
+    if has_treatment_split(culture_id, irrigation):
+        (control_before, control_after), (stress_before, stress_after) = \
+            drought_stress_days
+        drought = (None, None, control_before, control_after,
+                   stress_before, stress_after)
+    else:
+        drought = tuple(drought_stress_days) + (None,) * 4
+    values = drought + tuple(temp_stress_days) + tuple(light_intensity)
+    for extra in climate_data[2:]:
+        values += tuple(extra)
+    if columns is None:
+        columns = RESULT_COLUMNS + (RUN_COLUMNS if len(climate_data) > 2 else ())
+    return result_type(columns)(culture_id, *values)
+
+
+def format_result(result):
+    """formats a ClimateResult as a tab-separated line ('NA' for None)"""
+    return '\t'.join('NA' if value is None else '{}'.format(value)
+                     for value in result) + '\n'
+
+
+def results_to_array(results, dtype=RESULT_DTYPE):
+    """
+    converts a list of ClimateResults (or ClimateRunResults) into a NumPy
+    structured array (with NULL_DAYS for missing drought stress days).
+    """
+    array = np.zeros(len(results), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        values = [result[i] for result in results]
+        if name in NULLABLE_COLUMNS:
+            values = [NULL_DAYS if value is None else value for value in values]
+        array[name] = values
+    return array
+
+
+class TSVWriter(object):
+    """writes ClimateResults as tab-separated lines (with a header)"""
+    def __init__(self, output_file, columns=RESULT_COLUMNS):
+        self.output_file = output_file
+        self.output_file.write('\t'.join(name.replace('_', '-')
+                                         for name in columns) + '\n')
+
+    def write(self, result):
+        self.output_file.write(format_result(result))
+
+    def close(self):
+        self.output_file.flush()
+
+
+class BatchWriter(object):
+    """
+    base class of the columnar writers, which collect ClimateResults and
+    write them in batches of batch_size rows (cf. write_batch()).
+    """
+    def __init__(self, output_file, batch_size=BATCH_SIZE,
+                 columns=RESULT_COLUMNS):
+        self.output_file = output_file
+        self.batch_size = batch_size
+        self.dtype = result_dtype(columns)
+        self.batch = []
+
+    def write(self, result):
+        self.batch.append(result)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.write_batch(results_to_array(self.batch, self.dtype))
+            self.batch = []
+
+    def write_batch(self, array):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+        self.output_file.flush()
+
+
+class NPYWriter(BatchWriter):
+    """
+    writes ClimateResults into a .npy file containing a one-dimensional
+    structured array (cf. RESULT_DTYPE), which can be loaded with
+    numpy.load(). The output file has to be seekable, because the number of
+    rows is only known at the end.
+    """
+    # the header is padded to this length, so that it can be rewritten
+    # with the final number of rows
+    HEADER_LENGTH = 1024
+
+    def __init__(self, output_file, batch_size=BATCH_SIZE,
+                 columns=RESULT_COLUMNS):
+        super(NPYWriter, self).__init__(output_file, batch_size, columns)
+        self.start = output_file.tell()
+        self.num_rows = 0
+        self.output_file.write(self._header())
+
+    def _header(self):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype),
+                       'fortran_order': False,
+                       'shape': (self.num_rows,)})
+        # magic string, version 1.0, header length, padded header
+        prefix_length = 10
+        header = header.ljust(self.HEADER_LENGTH - prefix_length - 1) + '\n'
+        return ('\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header)
+
+    def write_batch(self, array):
+        self.output_file.write(array.tostring())
+        self.num_rows += len(array)
+
+    def close(self):
+        self.flush()
+        end = self.output_file.tell()
+        self.output_file.seek(self.start)
+        self.output_file.write(self._header())
+        self.output_file.seek(end)
+        self.output_file.flush()
+
+
+def arrow_schema(columns=RESULT_COLUMNS):
+    """the pyarrow schema of the results (with nullable drought columns)"""
+    import pyarrow as pa
+    types = {np.int64: pa.int64(), np.int32: pa.int32(),
+             np.float64: pa.float64()}
+    return pa.schema([pa.field(name, types[COLUMN_TYPES[name]],
+                               nullable=name in NULLABLE_COLUMNS)
+                      for name in columns])
+
+
+def array_to_arrow(array):
+    """converts a structured result array into a pyarrow.RecordBatch"""
+    import pyarrow as pa
+    columns = []
+    for name in array.dtype.names:
+        values = array[name]
+        mask = values == NULL_DAYS if name in NULLABLE_COLUMNS else None
+        columns.append(pa.array(values, mask=mask))
+    return pa.RecordBatch.from_arrays(columns,
+                                      schema=arrow_schema(array.dtype.names))
+
+
+class ParquetWriter(BatchWriter):
+    """writes ClimateResults into an Apache Parquet file (needs pyarrow)"""
+    def __init__(self, output_file, batch_size=BATCH_SIZE,
+                 columns=RESULT_COLUMNS):
+        import pyarrow.parquet as pq
+        super(ParquetWriter, self).__init__(output_file, batch_size, columns)
+        self.writer = pq.ParquetWriter(output_file, arrow_schema(columns))
+
+    def write_batch(self, array):
+        import pyarrow as pa
+        self.writer.write_table(pa.Table.from_batches([array_to_arrow(array)]))
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ArrowWriter(BatchWriter):
+    """writes ClimateResults into an Apache Arrow IPC file (needs pyarrow)"""
+    def __init__(self, output_file, batch_size=BATCH_SIZE,
+                 columns=RESULT_COLUMNS):
+        import pyarrow as pa
+        super(ArrowWriter, self).__init__(output_file, batch_size, columns)
+        self.writer = pa.RecordBatchFileWriter(output_file, arrow_schema(columns))
+
+    def write_batch(self, array):
+        self.writer.write_batch(array_to_arrow(array))
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# the formats whose writers need a seekable output file (i.e. not a pipe)
+SEEKABLE_FORMATS = ('npy',)
+
+
+def is_seekable(output_file):
+    """returns True, iff the position within the file can be changed"""
+    try:
+        output_file.seek(output_file.tell())
+    except IOError:  # e.g. [Errno 29] Illegal seek on a pipe
+        return False
+    return True
+
+
+WRITERS = {'tsv': TSVWriter, 'npy': NPYWriter,
+           'parquet': ParquetWriter, 'arrow': ArrowWriter}
+
+
+def get_writer(output_file, output_format='tsv', columns=RESULT_COLUMNS):
+    """
+    returns a writer for ClimateResults in the given format.
+
+    Parameters
+    ----------
+    output_file : file
+        the (writable) output file. The SEEKABLE_FORMATS need a seekable
+        file (cf. is_seekable()).
+    output_format : str
+        one of FORMATS
+    columns : tuple of str
+        the columns of the results, i.e. RESULT_COLUMNS, optionally
+        followed by RUN_COLUMNS and/or DEGREE_HOUR_COLUMNS
+
+    Raises
+    ------
+    ImportError
+        if the parquet or arrow format is requested, but pyarrow isn't
+        installed
+    """
+    assert output_format in FORMATS, \
+        "Unknown output format: {}".format(output_format)
+    if output_format == 'tsv':
+        return TSVWriter(output_file, columns)
+    return WRITERS[output_format](output_file, columns=columns)
+
+
+class DatabaseWriter(object):
+    """
+    writes ClimateResults into a database table (cf.
+    queries.CREATE_RESULTS_TABLE_QUERY). The rows are upserted in batches
+    of batch_size rows with executemany(), each batch in its own
+    transaction. The inserts run in a background thread on a pooled
+    connection, so the load overlaps with the calculation of the next
+    results.
+
+    Example
+    -------
+    >>> writer = DatabaseWriter(session.pool, run_id='2014-season')
+    >>> writer.write(climate_result(climate_data), '2012-07-01', 42.0)
+    >>> writer.close()  # waits until all rows are committed
+    """
+    def __init__(self, pool, run_id, table=RESULTS_TABLE,
+                 batch_size=DB_BATCH_SIZE):
+        """
+        Parameters
+        ----------
+        pool : login.ConnectionPool
+            the pool of database connections to use
+        run_id : str
+            identifies the batch run (e.g. a timestamp)
+        table : str
+            name of the results table (it is created, if it doesn't exist)
+        batch_size : int
+            number of rows per transaction
+        """
+        self.pool = pool
+        self.run_id = run_id
+        self.query = UPSERT_RESULT_QUERY.format(table=table)
+        self.batch_size = batch_size
+        self.batch = []
+        self.error = None
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(CREATE_RESULTS_TABLE_QUERY.format(table=table))
+            cursor.close()
+            connection.commit()
+
+        # a full batch can wait while the previous one is inserted
+        self.batches = Queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._insert_batches,
+                                       name='climax-db-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _insert_batches(self):
+        """inserts the queued batches (until None is queued)"""
+        while True:
+            rows = self.batches.get()
+            if rows is None:
+                return
+            if self.error is not None:
+                continue  # drain the queue, cf. _raise_error()
+            try:
+                with self.pool.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.executemany(self.query, rows)
+                    cursor.close()
+                    connection.commit()
+            except Exception:
+                self.error = sys.exc_info()
+
+    def _raise_error(self):
+        """
+        raises the error of a failed insert. The error is kept, i.e. no
+        further rows are inserted after a failed batch.
+        """
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def write(self, result, flowering_date, soil_volume):
+        """
+        Parameters
+        ----------
+        result : ClimateResult
+            the climate data of a culture
+        flowering_date : str
+            date string in YYYY-MM-DD format
+        soil_volume : float
+            soil volume
+        """
+        self._raise_error()
+        # the results table has no columns for the run (or degree hour) metrics
+        self.batch.append((self.run_id, result.culture_id, flowering_date,
+                           soil_volume) + tuple(result[1:len(RESULT_COLUMNS)]))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """queues the current batch for insertion"""
+        if self.batch:
+            self.batches.put(self.batch)
+            self.batch = []
+
+    def close(self):
+        """
+        inserts the remaining rows (unless an insert has failed) and waits
+        until all rows are committed. The error of a failed insert is raised.
+        """
+        if self.error is None:
+            self.flush()
+        self.batches.put(None)
+        self.thread.join()
+        self._raise_error()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+This module provides a bounded producer/consumer pipeline, which overlaps
+fetching data from the database with the computations on the data fetched
+before, and a helper to run independent queries concurrently.
+"""
+
+import sys
+import threading
+import Queue
+
+# marks the end of the items produced by the background thread
+_DONE = object()
+
+
+def prefetch(iterable, size=8):
+    """
+    iterates over an iterable (e.g. a generator fetching culture data from
+    the database) in a background thread and yields its items. At most
+    ``size`` items are fetched ahead of the consumer, i.e. the producer
+    blocks when the queue is full (backpressure) and memory use stays
+    bounded.
+
+    Exceptions raised by the iterable are re-raised in the consumer. If the
+    consumer stops early, the background thread stops as well after its
+    current item.
+
+    Parameters
+    ----------
+    iterable : iterable
+        the items to produce. The iterable is only used from the background
+        thread, so it may own resources that aren't thread-safe (e.g. a
+        database cursor), as long as the consumer doesn't use them, too.
+    size : int
+        maximum number of items to keep ahead of the consumer
+
+    Yields
+    ------
+    item : object
+        the items of the iterable (in their original order)
+    """
+    items = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        """puts an item into the queue, unless the consumer stopped"""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((None, sys.exc_info()))
+        put((_DONE, None))
+
+    producer = threading.Thread(target=produce, name='climax-prefetch')
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            item, exc_info = items.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def run_concurrently(functions):
+    """
+    calls the given functions (without arguments) in separate threads and
+    waits for all of them to finish.
+
+    Returns
+    -------
+    results : list
+        the return value of each function (in the given order)
+
+    Raises
+    ------
+    the first exception raised by any of the functions (in the given order)
+    """
+    results = [None] * len(functions)
+    errors = [None] * len(functions)
+
+    def run(i, function):
+        try:
+            results[i] = function()
+        except Exception:
+            errors[i] = sys.exc_info()
+
+    threads = [threading.Thread(target=run, args=(i, function))
+               for i, function in enumerate(functions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for exc_info in errors:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
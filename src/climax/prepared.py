@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+This module runs the queries in climax.queries as server-side prepared
+statements. The queries contain named parameters (e.g. ``%(CULTURE_ID)s``),
+which are bound by the database driver, when a query is run with
+``cursor.execute(query, params)``. A PreparedCursor instead prepares each
+query only once per connection and then executes the prepared statement
+with new parameter values:
+
+    PREPARE climax_0 FROM 'SELECT ... WHERE C.id = ?'
+    SET @climax_culture_id = 56878
+    EXECUTE climax_0 USING @climax_culture_id
+
+This only saves parsing the query: MySQL still optimizes the statement on
+each EXECUTE, and each execution takes two round trips (SET and EXECUTE)
+instead of one. Whether it pays off depends on the queries and the network,
+so sessions don't use prepared statements by default (cf.
+benchmarks/prepared.py to measure it against a database).
+
+List parameters (e.g. ``C.id IN %(CULTURE_IDS)s``) are expanded into one
+placeholder per list element (cf. expand_list_parameters()), i.e. one
+statement is prepared per list length. At most MAX_STATEMENTS statements
+are kept per connection (the least recently used one is deallocated), so
+that the server's limit (max_prepared_stmt_count) isn't exhausted. The
+statements of a connection have to be deallocated before it is closed
+(cf. deallocate_statements()).
+"""
+
+import re
+from collections import OrderedDict
+
+# a named parameter of a query, e.g. %(CULTURE_ID)s
+PARAMETER = re.compile(r'%\((\w+)\)s')
+
+# maximum number of prepared statements per connection
+MAX_STATEMENTS = 32
+
+
+def expand_list_parameters(query, params):
+    """
+    replaces each list (or tuple) parameter of a query with a parenthesized
+    list of scalar parameters, e.g. 'IN %(IDS)s' with {'IDS': [1, 2]}
+    becomes 'IN (%(IDS_0)s, %(IDS_1)s)' with {'IDS_0': 1, 'IDS_1': 2}.
+
+    Returns
+    -------
+    query : str
+        the query with scalar parameters only
+    params : dict
+        the (expanded) parameter values
+    """
+    expanded = {}
+
+    def expand(match):
+        name = match.group(1)
+        value = params[name]
+        if not isinstance(value, (list, tuple)):
+            expanded[name] = value
+            return match.group(0)
+        assert value, "List parameter {} is empty".format(name)
+        names = ['{}_{}'.format(name, i) for i in range(len(value))]
+        expanded.update(zip(names, value))
+        return '(' + ', '.join('%({})s'.format(n) for n in names) + ')'
+
+    return PARAMETER.sub(expand, query), expanded
+
+
+def to_prepared_statement(query):
+    """
+    converts a query with named parameters into the text of a prepared
+    statement with positional (?) placeholders.
+
+    Returns
+    -------
+    statement : str
+        the statement text (without a trailing semicolon)
+    names : list of str
+        the name of the parameter of each placeholder (in order)
+    """
+    names = PARAMETER.findall(query)
+    return PARAMETER.sub('?', query).strip().rstrip(';'), names
+
+
+def deallocate_statements(connection):
+    """
+    deallocates the statements prepared on a connection (cf.
+    PreparedCursor), e.g. before it is closed.
+    """
+    statements = getattr(connection, 'climax_statements', None)
+    if not statements:
+        return
+    cursor = connection.cursor()
+    try:
+        for statement_name in statements.values():
+            cursor.execute('DEALLOCATE PREPARE {}'.format(statement_name))
+    finally:
+        statements.clear()
+        cursor.close()
+
+
+class PreparedCursor(object):
+    """
+    wraps a database cursor, so that queries are run as server-side
+    prepared statements. The statements are prepared once per connection,
+    the other cursor methods (fetchone(), fetchmany(), ...) are passed
+    through.
+    """
+    def __init__(self, cursor, connection):
+        """
+        Parameters
+        ----------
+        cursor : MySQLdb.cursors.Cursor
+            a cursor of the connection
+        connection : MySQLdb.connections.Connection
+            the connection, which keeps track of its prepared statements
+        """
+        self.cursor = cursor
+        self.connection = connection
+        if not hasattr(connection, 'climax_statements'):
+            # maps from the text of a statement to its name (in the order
+            # of their last use)
+            connection.climax_statements = OrderedDict()
+            connection.climax_prepared_count = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, query, params=None):
+        """
+        runs a query (with named parameters, which may be lists) as a
+        prepared statement.
+        """
+        if not params:
+            return self.cursor.execute(query)
+        query, params = expand_list_parameters(query, params)
+        statement, names = to_prepared_statement(query)
+        statements = self.connection.climax_statements
+        if statement in statements:
+            statements[statement] = statements.pop(statement)  # recently used
+        else:
+            if len(statements) >= MAX_STATEMENTS:
+                _, oldest_name = statements.popitem(last=False)
+                self.cursor.execute('DEALLOCATE PREPARE {}'.format(oldest_name))
+            statement_name = 'climax_{}'.format(
+                self.connection.climax_prepared_count)
+            self.cursor.execute(
+                'PREPARE {} FROM %(statement)s'.format(statement_name),
+                {'statement': statement})
+            self.connection.climax_prepared_count += 1
+            statements[statement] = statement_name
+
+        variables = {name: '@climax_' + name.lower() for name in set(names)}
+        self.cursor.execute(
+            'SET ' + ', '.join('{} = %({})s'.format(variable, name)
+                               for name, variable in sorted(variables.items())),
+            params)
+        return self.cursor.execute('EXECUTE {} USING {}'.format(
+            statements[statement], ', '.join(variables[name] for name in names)))
+
+    def executemany(self, query, seq_of_params):
+        """runs a query for each set of parameters (cf. execute())"""
+        for params in seq_of_params:
+            self.execute(query, params)
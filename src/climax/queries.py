@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 
+# The parameters of the queries (e.g. %(CULTURE_ID)s) are bound by the
+# database driver, i.e. run them with cursor.execute(QUERY, {'CULTURE_ID': 56878})
+# or as prepared statements (cf. climax.prepared). List parameters (e.g.
+# %(CULTURE_IDS)s) have to be expanded first (cf.
+# climax.prepared.expand_list_parameters()).
+
 TRIAL_DATES_QUERY = """
 select
 C.planted + interval 14 day,
 C.terminated
 from cultures C
-where C.id = %(CULTURE_ID)i;
+where C.id = %(CULTURE_ID)s;
 """.strip().replace('\n', ' ')
 # returns one row with two columns: trial start date (YYYY-MM-DD),
 # trial end date (YYYY-MM-DD)
@@ -17,7 +23,7 @@ DATE(P.datum),
 P.amount
 FROM precipitation P
 JOIN cultures C ON P.location_id = C.location_id
-WHERE C.id = %(CULTURE_ID)i
+WHERE C.id = %(CULTURE_ID)s
 AND P.invalid = 0
 ORDER BY P.datum;
 """.strip().replace('\n', ' ')
@@ -30,7 +36,7 @@ DATE(I.datum),
 I.amount,
 I.treatment_id
 FROM irrigation I
-WHERE I.culture_id = %(CULTURE_ID)i
+WHERE I.culture_id = %(CULTURE_ID)s
 AND I.invalid = 0
 AND I.treatment_id in (169, 170, 171)
 ORDER BY I.datum;
@@ -49,7 +55,7 @@ inner join
 from dwd_hourlyMeanWindspeed_FFHM FFHM
 left join usesWeatherStation uWS on uWS.station_id = FFHM.station_id and uWS.stationData = 'FFHM'
 left join cultures C on C.location_id = uWS.location_id
-where C.id = %(CULTURE_ID)i
+where C.id = %(CULTURE_ID)s
 and (FFHM.datum >= C.planted + interval 14 day)
 and FFHM.datum < C.terminated
 and FFHM.invalid is NULL
@@ -60,7 +66,7 @@ left join
 from dwd_hourlyAirTemperature_TAHV TAHV
 left join usesWeatherStation uWS on uWS.station_id = TAHV.station_id and uWS.stationData = 'TAHV'
 left join cultures C on C.location_id = uWS.location_id
-where C.id = %(CULTURE_ID)i
+where C.id = %(CULTURE_ID)s
 and (TAHV.datum >= C.planted + interval 14 day)
 and TAHV.datum < C.terminated
 and TAHV.invalid is NULL
@@ -71,7 +77,7 @@ left join
 from dwd_hourlyRelHumidity_UUHV UUHV
 left join usesWeatherStation uWS on uWS.station_id = UUHV.station_id and uWS.stationData = 'UUHV'
 left join cultures C on C.location_id = uWS.location_id
-where C.id = %(CULTURE_ID)i
+where C.id = %(CULTURE_ID)s
 and (UUHV.datum >= C.planted + interval 14 day)
 and UUHV.datum < C.terminated
 and UUHV.invalid is NULL
@@ -88,7 +94,7 @@ sC.datum,
 sC.amount
 FROM solarCalc_hourlySolarRadiation sC
 JOIN cultures C ON C.location_id = sC.location_id
-WHERE C.id = %(CULTURE_ID)i
+WHERE C.id = %(CULTURE_ID)s
 AND (sC.datum >= C.planted + interval 14 day)
 AND (sC.datum < C.terminated)
 AND sC.invalid IS NULL
@@ -96,3 +102,261 @@ ORDER BY sC.datum
 """.strip().replace('\n', ' ')
 # results in two columns: date-time (YYYY-MM-DD hh:mm:ss), hourly solar radiation (float)
 
+
+
+TRIAL_COST_QUERY = """
+SELECT
+C.id,
+DATEDIFF(C.terminated, C.planted + interval 14 day),
+COUNT(FFHM.datum)
+FROM cultures C
+left join usesWeatherStation uWS on uWS.location_id = C.location_id and uWS.stationData = 'FFHM'
+left join dwd_hourlyMeanWindspeed_FFHM FFHM on FFHM.station_id = uWS.station_id
+and FFHM.datum >= C.planted + interval 14 day
+and FFHM.datum < C.terminated
+and FFHM.invalid is NULL
+WHERE C.id IN %(CULTURE_IDS)s
+GROUP BY C.id;
+""".strip().replace('\n', ' ')
+# returns one row per culture with three columns: culture ID (int), number
+# of trial days (int), number of hourly station rows during the trial (int).
+# Used to estimate how long it takes to calculate the climate data of a
+# culture.
+
+
+RESULTS_TABLE = 'climax_results'
+
+CREATE_RESULTS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS {table} (
+run_id VARCHAR(64) NOT NULL,
+culture_id INT NOT NULL,
+flowering_date DATE NOT NULL,
+soil_volume DOUBLE NOT NULL,
+drought_before INT NULL,
+drought_after INT NULL,
+control_drought_before INT NULL,
+control_drought_after INT NULL,
+stress_drought_before INT NULL,
+stress_drought_after INT NULL,
+cold_before DOUBLE NOT NULL,
+cold_after DOUBLE NOT NULL,
+heat_before DOUBLE NOT NULL,
+heat_after DOUBLE NOT NULL,
+light_before DOUBLE NOT NULL,
+light_after DOUBLE NOT NULL,
+PRIMARY KEY (run_id, culture_id, flowering_date, soil_volume)
+);
+""".strip().replace('\n', ' ')
+# creates the table of batch results (cf. climax.output.DatabaseWriter).
+# {table} is replaced with the name of the table.
+
+
+UPSERT_RESULT_QUERY = """
+INSERT INTO {table} (
+run_id, culture_id, flowering_date, soil_volume,
+drought_before, drought_after,
+control_drought_before, control_drought_after,
+stress_drought_before, stress_drought_after,
+cold_before, cold_after, heat_before, heat_after,
+light_before, light_after)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+drought_before = VALUES(drought_before),
+drought_after = VALUES(drought_after),
+control_drought_before = VALUES(control_drought_before),
+control_drought_after = VALUES(control_drought_after),
+stress_drought_before = VALUES(stress_drought_before),
+stress_drought_after = VALUES(stress_drought_after),
+cold_before = VALUES(cold_before),
+cold_after = VALUES(cold_after),
+heat_before = VALUES(heat_before),
+heat_after = VALUES(heat_after),
+light_before = VALUES(light_before),
+light_after = VALUES(light_after);
+""".strip().replace('\n', ' ')
+# inserts (or replaces) the result of a culture for one set of parameters
+# in one run. The values are bound by the driver (cf. cursor.executemany()).
+
+
+CULTURE_SOURCES_QUERY = """
+SELECT
+C.id,
+C.location_id,
+uWS.stationData,
+uWS.station_id
+FROM cultures C
+LEFT JOIN usesWeatherStation uWS ON uWS.location_id = C.location_id
+WHERE C.id IN %(CULTURE_IDS)s;
+""".strip().replace('\n', ' ')
+# results in four columns: culture ID (int), location ID (int), station
+# data (e.g. 'FFHM', 'TAHV', 'UUHV'), station ID (int). One row per weather
+# station used at the location of the culture.
+
+
+CULTURE_STATE_QUERY = """
+SELECT
+C.id,
+C.planted,
+C.terminated
+FROM cultures C
+WHERE C.id IN %(CULTURE_IDS)s;
+""".strip().replace('\n', ' ')
+# results in three columns: culture ID (int), planted (date), terminated (date)
+
+
+STATION_STATE_QUERY = """
+SELECT
+C.id,
+COUNT(*),
+BIT_XOR(CRC32(CONCAT_WS('/', S.station_id, S.datum, S.amount)))
+FROM cultures C
+JOIN usesWeatherStation uWS ON uWS.location_id = C.location_id
+AND uWS.stationData = '{station_data}'
+JOIN {table} S ON S.station_id = uWS.station_id
+AND S.datum >= C.planted + interval 14 day
+AND S.datum < C.terminated
+AND S.invalid IS NULL
+WHERE C.id IN %(CULTURE_IDS)s
+GROUP BY C.id;
+""".strip().replace('\n', ' ')
+# results in three columns: culture ID (int), number of valid rows during
+# the trial (int), checksum of the rows (int). {station_data} is replaced
+# with the stationData (e.g. 'TAHV') and {table} with the name of its
+# dwd_hourly* table.
+
+
+PRECIPITATION_STATE_QUERY = """
+SELECT
+C.id,
+COUNT(*),
+BIT_XOR(CRC32(CONCAT_WS('/', P.datum, P.amount)))
+FROM cultures C
+JOIN precipitation P ON P.location_id = C.location_id
+AND P.datum >= C.planted + interval 14 day
+AND P.datum < C.terminated + interval 1 day
+AND P.invalid = 0
+WHERE C.id IN %(CULTURE_IDS)s
+GROUP BY C.id;
+""".strip().replace('\n', ' ')
+# results in three columns: culture ID (int), number of valid rows during
+# the trial (int), checksum of the rows (int)
+
+
+SOLAR_STATE_QUERY = """
+SELECT
+C.id,
+COUNT(*),
+BIT_XOR(CRC32(CONCAT_WS('/', sC.datum, sC.amount)))
+FROM cultures C
+JOIN solarCalc_hourlySolarRadiation sC ON sC.location_id = C.location_id
+AND sC.datum >= C.planted + interval 14 day
+AND sC.datum < C.terminated
+AND sC.invalid IS NULL
+WHERE C.id IN %(CULTURE_IDS)s
+GROUP BY C.id;
+""".strip().replace('\n', ' ')
+# results in three columns: culture ID (int), number of valid rows during
+# the trial (int), checksum of the rows (int)
+
+
+IRRIGATION_STATE_QUERY = """
+SELECT
+I.culture_id,
+COUNT(*),
+BIT_XOR(CRC32(CONCAT_WS('/', I.datum, I.amount, I.treatment_id)))
+FROM irrigation I
+WHERE I.culture_id IN %(CULTURE_IDS)s
+AND I.invalid = 0
+AND I.treatment_id in (169, 170, 171)
+GROUP BY I.culture_id;
+""".strip().replace('\n', ' ')
+# results in three columns: culture ID (int), number of valid rows (int),
+# checksum of the rows (int)
+
+
+STATION_HISTORY_QUERY = """
+SELECT
+S.datum,
+S.amount
+FROM {table} S
+WHERE S.station_id = %(STATION_ID)s
+AND S.invalid IS NULL
+ORDER BY S.datum;
+""".strip().replace('\n', ' ')
+# results in two columns: date-time (YYYY-MM-DD hh:mm:ss), hourly value
+# (float). All the (historical) rows of a weather station, used to build
+# climatology baselines (cf. climax.climatology). {table} is replaced with
+# the name of a dwd_hourly* table.
+
+
+SOLAR_HISTORY_QUERY = """
+SELECT
+sC.datum,
+sC.amount
+FROM solarCalc_hourlySolarRadiation sC
+WHERE sC.location_id = %(LOCATION_ID)s
+AND sC.invalid IS NULL
+ORDER BY sC.datum;
+""".strip().replace('\n', ' ')
+# results in two columns: date-time (YYYY-MM-DD hh:mm:ss), hourly solar
+# radiation (float). All the (historical) rows of a location.
+
+
+LOCATION_STATIONS_QUERY = """
+SELECT
+uWS.location_id,
+uWS.station_id
+FROM usesWeatherStation uWS
+WHERE uWS.location_id IN %(LOCATION_IDS)s
+AND uWS.stationData = 'TAHV';
+""".strip().replace('\n', ' ')
+# results in two columns: location ID (int), ID of the station that
+# measures the air temperature at the location (int)
+
+
+STATION_COORDINATES_QUERY = """
+SELECT
+S.station_id,
+S.latitude,
+S.longitude
+FROM {table} S
+WHERE S.latitude IS NOT NULL
+AND S.longitude IS NOT NULL;
+""".strip().replace('\n', ' ')
+# results in three columns: station ID (int), latitude and longitude of the
+# weather station in degrees (float). Used to find the nearest stations
+# (cf. climax.stations). {table} is replaced with the name of the table of
+# the weather stations (cf. stations.STATIONS_TABLE), which needs the
+# columns station_id, latitude and longitude.
+
+
+STATION_WINDOW_QUERY = """
+SELECT
+S.datum,
+S.amount
+FROM {table} S
+WHERE S.station_id = %(STATION_ID)s
+AND S.datum >= %(START)s
+AND S.datum < %(END)s
+AND S.invalid IS NULL
+ORDER BY S.datum;
+""".strip().replace('\n', ' ')
+# results in two columns: date-time (YYYY-MM-DD hh:mm:ss), hourly value
+# (float). The rows of a weather station within a time window. {table} is
+# replaced with the name of a dwd_hourly* table.
+
+
+LOCATION_SOLAR_WINDOW_QUERY = """
+SELECT
+sC.datum,
+sC.amount
+FROM solarCalc_hourlySolarRadiation sC
+WHERE sC.location_id = %(LOCATION_ID)s
+AND sC.datum >= %(START)s
+AND sC.datum < %(END)s
+AND sC.invalid IS NULL
+ORDER BY sC.datum;
+""".strip().replace('\n', ' ')
+# results in two columns: date-time (YYYY-MM-DD hh:mm:ss), hourly solar
+# radiation (float). The rows of a location within a time window (cf.
+# DAYLIGHT_QUERY).
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+This module aggregates hourly or daily climate data into arbitrary buckets
+(calendar days, weeks or user-given growth stages).
+
+All aggregates (sum, mean, median, min, max, count) of all buckets are
+computed in one grouped pass: the values are sorted once by (bucket, value)
+and then reduced with ``np.add.reduceat``, so that adding a new reporting
+granularity only means writing a new bucket function.
+"""
+
+import numpy as np
+
+STATISTICS = ('sum', 'mean', 'median', 'min', 'max', 'count')
+
+
+def epoch_days(timestamps, unit='D'):
+    """
+    converts datetime64 timestamps, datetime.date(time) instances or
+    'YYYY-MM-DD' strings into an int64 array of days since 1970-01-01.
+
+    Parameters
+    ----------
+    timestamps : array-like
+    unit : str
+        the unit of integer timestamps, i.e. 'D' for days since 1970-01-01
+        or 'h' for hours since 1970-01-01 00:00 (e.g. ClimateSeries.hours)
+    """
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind in 'iu':
+        timestamps = timestamps.astype(np.int64).astype(
+            'datetime64[{}]'.format(unit))
+    return timestamps.astype('datetime64[D]').astype(np.int64)
+
+
+def year_week(days):
+    """
+    computes the year and the week of the year of each day with integer
+    arithmetic. Weeks start on Monday and all days before the first Monday
+    of a year belong to week 0, i.e. the result is identical to
+    strftime('%Y-%W').
+
+    Parameters
+    ----------
+    days : np.ndarray of int
+        days since 1970-01-01
+
+    Returns
+    -------
+    years : np.ndarray of int
+    weeks : np.ndarray of int
+    """
+    days = np.asarray(days, dtype=np.int64)
+    years = days.astype('datetime64[D]').astype('datetime64[Y]')
+    day_of_year = days - years.astype('datetime64[D]').astype(np.int64)
+    weekday = (days + 3) % 7  # Monday = 0; 1970-01-01 was a Thursday
+    return years.astype(np.int64) + 1970, (day_of_year + 7 - weekday) // 7
+
+
+def day_buckets(days):
+    """returns one bucket per calendar day (days since 1970-01-01)"""
+    return epoch_days(days)
+
+
+def week_buckets(days):
+    """
+    returns one bucket per week (encoded as year * 100 + week, weeks
+    as in strftime('%Y-%W')).
+    """
+    years, weeks = year_week(epoch_days(days))
+    return years * 100 + weeks
+
+
+def stage_buckets(days, boundaries):
+    """
+    assigns each day to a growth stage. Stage 0 contains all days before
+    the first boundary, stage i all days on or after boundary i-1 (and
+    before boundary i), e.g. a single flowering date as boundary splits
+    the days into before (0) and after (1) flowering.
+
+    Parameters
+    ----------
+    days : array-like
+        days (cf. epoch_days())
+    boundaries : array-like
+        sorted first days of stages 1, 2, ... (cf. epoch_days())
+    """
+    return np.searchsorted(epoch_days(boundaries), epoch_days(days),
+                           side='right').astype(np.int64)
+
+
+BUCKETS = {'day': day_buckets, 'week': week_buckets}
+
+
+def bucket_keys(timestamps, by='day', unit='D'):
+    """
+    assigns each timestamp to a bucket.
+
+    Parameters
+    ----------
+    timestamps : array-like
+        timestamps or days (cf. epoch_days())
+    by : str or array-like
+        'day', 'week' or the sorted boundaries of growth stages (cf.
+        stage_buckets())
+    unit : str
+        the unit of integer timestamps (cf. epoch_days())
+
+    Returns
+    -------
+    keys : np.ndarray of int
+        bucket key of each timestamp
+    """
+    days = epoch_days(timestamps, unit)
+    if isinstance(by, basestring):
+        try:
+            return BUCKETS[by](days)
+        except KeyError:
+            raise ValueError('Unknown bucket definition: {}'.format(by))
+    return stage_buckets(days, by)
+
+
+def grouped_stats(keys, values, how=STATISTICS):
+    """
+    computes aggregate statistics of the values of each bucket in a single
+    grouped pass. Missing values (NaN) are ignored, buckets without any
+    values are not included in the results.
+
+    Parameters
+    ----------
+    keys : np.ndarray of int
+        bucket key of each value
+    values : np.ndarray of float
+    how : tuple of str
+        the statistics to compute (any of 'sum', 'mean', 'median', 'min',
+        'max', 'count')
+
+    Returns
+    -------
+    buckets : np.ndarray of int
+        sorted unique bucket keys
+    stats : dict, key = str, value = np.ndarray
+        maps from the name of a statistic to its value for each bucket
+    """
+    unknown = set(how) - set(STATISTICS)
+    if unknown:
+        raise ValueError('Unknown statistics: {}'.format(sorted(unknown)))
+
+    keys = np.asarray(keys, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    present = ~np.isnan(values)
+    keys, values = keys[present], values[present]
+
+    # sorting by (key, value) puts each bucket's minimum first, its maximum
+    # last and its median in the middle
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    if keys.size:
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    else:
+        starts = np.zeros(0, dtype=np.int64)
+    counts = np.diff(np.append(starts, keys.size))
+
+    stats = {}
+    if 'count' in how:
+        stats['count'] = counts
+    if 'sum' in how or 'mean' in how:
+        sums = np.add.reduceat(values, starts) if keys.size else values[:0]
+        if 'sum' in how:
+            stats['sum'] = sums
+        if 'mean' in how:
+            stats['mean'] = sums / counts
+    if 'min' in how:
+        stats['min'] = values[starts]
+    if 'max' in how:
+        stats['max'] = values[starts + counts - 1]
+    if 'median' in how:
+        stats['median'] = (values[starts + (counts - 1) // 2] +
+                           values[starts + counts // 2]) / 2.0
+    return keys[starts], stats
+
+
+def resample(timestamps, values, by='day', how=STATISTICS, unit='D'):
+    """
+    aggregates hourly or daily values into buckets.
+
+    Parameters
+    ----------
+    timestamps : array-like
+        timestamps or days (cf. epoch_days())
+    values : array-like of float
+        the values to aggregate (NaN = missing)
+    by : str or array-like
+        'day', 'week' or the sorted boundaries of growth stages (cf.
+        bucket_keys())
+    how : tuple of str
+        the statistics to compute (cf. grouped_stats())
+    unit : str
+        the unit of integer timestamps (cf. epoch_days())
+
+    Returns
+    -------
+    buckets : np.ndarray of int
+        sorted unique bucket keys
+    stats : dict, key = str, value = np.ndarray
+        maps from the name of a statistic to its value for each bucket
+
+    Example
+    -------
+    >>> days, stats = resample(timestamps, temperatures, how=('min', 'max'))
+    >>> stages, stats = resample(days, stats['max'], by=['2012-07-01'])
+    >>> days, stats = resample(series.hours, series['temperature'], unit='h')
+    """
+    return grouped_stats(bucket_keys(timestamps, by, unit), values, how)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+This module calculates run-length and sliding-window metrics of daily
+series, e.g. the longest run of consecutive drought stress days or the
+maximum heat load of any N consecutive days.
+
+All functions work on (culture x day) matrices, i.e. they are vectorized
+across cultures, and need time linear in the number of days: run lengths
+are derived from a running maximum of the positions of the last reset and
+window sums from prefix sums (so the maximum window sum doesn't need a
+monotonic deque of its own).
+"""
+
+import numpy as np
+
+
+def run_lengths(flags):
+    """
+    calculates the length of the run of consecutive True values, which
+    ends at each position.
+
+    Parameters
+    ----------
+    flags : np.ndarray of bool, shape (rows, days)
+
+    Returns
+    -------
+    lengths : np.ndarray of int, shape (rows, days)
+        0 where flags is False, otherwise the number of consecutive True
+        values up to and including this day
+
+    Example
+    -------
+    >>> run_lengths(np.array([[True, True, False, True]]))
+    array([[1, 2, 0, 1]])
+    """
+    flags = np.asarray(flags, dtype=bool)
+    positions = np.arange(flags.shape[1])
+    resets = np.where(flags, -1, positions)  # days that interrupt a run
+    last_reset = np.maximum.accumulate(resets, axis=1)
+    return np.where(flags, positions - last_reset, 0)
+
+
+def longest_run(flags):
+    """returns the length of the longest run of True values of each row"""
+    flags = np.asarray(flags, dtype=bool)
+    if flags.shape[1] == 0:
+        return np.zeros(flags.shape[0], dtype=np.int64)
+    return run_lengths(flags).max(axis=1)
+
+
+def count_runs(flags, min_length=1):
+    """
+    counts the runs of at least min_length consecutive True values of each
+    row.
+    """
+    flags = np.asarray(flags, dtype=bool)
+    lengths = run_lengths(flags)
+    # a run ends at a True value that isn't followed by another one
+    ends = flags & ~np.concatenate(
+        (flags[:, 1:], np.zeros((flags.shape[0], 1), dtype=bool)), axis=1)
+    return (ends & (lengths >= min_length)).sum(axis=1)
+
+
+def max_window_sum(values, window):
+    """
+    returns the maximum sum of any window of consecutive values of each
+    row. Windows are clipped at the end of a row, i.e. a row shorter than
+    the window is summed up completely.
+
+    Parameters
+    ----------
+    values : np.ndarray of float, shape (rows, days)
+        the daily values (0.0 for days outside of a trial)
+    window : int
+        number of days of a window
+    """
+    values = np.asarray(values, dtype=float)
+    rows, days = values.shape
+    if days == 0:
+        return np.zeros(rows)
+    prefix_sums = np.zeros((rows, days + 1))
+    np.cumsum(values, axis=1, out=prefix_sums[:, 1:])
+    starts = np.arange(days)
+    ends = np.minimum(starts + window, days)
+    return (prefix_sums[:, ends] - prefix_sums[:, starts]).max(axis=1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+This module plans parallel batch runs. The time needed to calculate the
+climate data of a culture mostly depends on the length of its trial and on
+the number of hourly rows its weather station delivered, which both vary
+a lot between cultures. A naive split of the input into equally sized
+parts leaves workers idle, while another one is still busy with a
+multi-year trial.
+
+The cost of each culture is therefore estimated with a cheap query
+(cf. queries.TRIAL_COST_QUERY) first, and the work is then distributed
+longest-first over the workers (i.e. each culture goes to the worker with
+the least work so far, starting with the most expensive cultures).
+"""
+
+import heapq
+
+from climax.queries import TRIAL_COST_QUERY
+from climax.prepared import expand_list_parameters
+
+# the soil water model and the light sums are calculated per trial day,
+# the other metrics per hourly row. A trial day costs about as much as this
+# many hourly rows.
+DAY_COST = 24
+
+# maximum number of cultures whose costs are estimated with one query
+COST_QUERY_SIZE = 500
+
+
+def estimate_cost(culture_id, db_cursor):
+    """
+    estimates how long it takes to calculate the climate data of a culture.
+
+    Parameters
+    ----------
+    culture_id : int
+        ID of the culture, e.g. 56878
+    db_cursor : MySQLdb.cursors.Cursor
+        a cursor to the (running) database
+
+    Returns
+    -------
+    cost : int
+        the estimated cost (in hourly rows) or 0, if the culture is unknown
+    """
+    return estimate_costs([culture_id], db_cursor)[culture_id]
+
+
+def estimate_costs(culture_ids, db_cursor):
+    """
+    estimates the costs of several cultures (cf. estimate_cost()) with one
+    query per COST_QUERY_SIZE cultures.
+
+    Returns
+    -------
+    costs : dict, key = int, value = int
+        maps from a culture ID to its estimated cost (0 for unknown
+        cultures)
+    """
+    culture_ids = sorted(set(culture_ids))
+    costs = dict.fromkeys(culture_ids, 0)
+    for start in range(0, len(culture_ids), COST_QUERY_SIZE):
+        db_cursor.execute(*expand_list_parameters(
+            TRIAL_COST_QUERY,
+            {'CULTURE_IDS': culture_ids[start:start + COST_QUERY_SIZE]}))
+        for culture_id, trial_days, hourly_rows in db_cursor.fetchall():
+            costs[culture_id] = \
+                max(trial_days or 0, 0) * DAY_COST + (hourly_rows or 0)
+    return costs
+
+
+def longest_first(costs, num_bins):
+    """
+    distributes items over bins, so that the largest total cost of a bin
+    (i.e. the time until the last worker finishes) is small: the items are
+    assigned in order of decreasing cost, each to the bin with the smallest
+    total cost so far.
+
+    Parameters
+    ----------
+    costs : list of int or float
+        the cost of each item
+    num_bins : int
+        the number of bins (i.e. workers)
+
+    Returns
+    -------
+    bins : list of lists of int
+        the indices of the items in each bin, in order of decreasing cost.
+        Empty bins are omitted.
+    """
+    bins = [[] for _ in range(num_bins)]
+    totals = [(0, i) for i in range(num_bins)]  # heap of (total cost, bin)
+    for item in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        total, i = heapq.heappop(totals)
+        bins[i].append(item)
+        heapq.heappush(totals, (total + costs[item], i))
+    return [items for items in bins if items]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+This module provides ClimateSeries, a compact struct-of-arrays
+representation of hourly or daily climate data.
+
+Instead of a list of (datetime.datetime, float or None, ...) tuples (several
+boxed Python objects and 200+ bytes per hour), a ClimateSeries stores one
+int64 array of timestamps (hours since 1970-01-01 00:00) and one numpy
+array per column. Missing values are NaN.
+"""
+
+import numpy as np
+
+# the columns of the series returned by the queries in climax.queries
+CLIMATE_COLUMNS = ('temperature', 'windspeed', 'humidity')
+LIGHT_COLUMNS = ('radiation',)
+PRECIPITATION_COLUMNS = ('amount',)
+IRRIGATION_COLUMNS = ('amount', 'treatment_id')
+
+
+class ClimateSeries(object):
+    """
+    a series of hourly or daily values with one or more named columns.
+    Daily values are stored with the timestamp of midnight.
+
+    Attributes
+    ----------
+    hours : np.ndarray of int64
+        the point of time of each value in hours since 1970-01-01 00:00
+    columns : tuple of str
+        the names of the columns (in row order)
+    """
+    def __init__(self, hours, columns, arrays):
+        self.hours = np.asarray(hours, dtype=np.int64)
+        self.columns = tuple(columns)
+        self.arrays = dict(zip(self.columns, arrays))
+        for name in self.columns:
+            assert len(self.arrays[name]) == len(self.hours), \
+                "Column '{}' doesn't have one value per timestamp".format(name)
+
+    @classmethod
+    def from_rows(cls, rows, columns, dtypes=None):
+        """
+        creates a ClimateSeries from a list of (datetime.datetime or
+        datetime.date, value, value, ...) tuples, e.g. cursor.fetchall()
+        results.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            the first element of a row is its point of time, the following
+            ones are its values (None = missing)
+        columns : tuple of str
+            the names of the value columns
+        dtypes : dict or None
+            maps from a column name to its numpy dtype (default: float64).
+            Use float32 to halve the memory of a column, if its values don't
+            need double precision.
+        """
+        dtypes = dtypes or {}
+        hours = np.array([row[0] for row in rows], dtype='datetime64[h]')
+        arrays = [np.array([row[i] for row in rows],
+                           dtype=dtypes.get(name, np.float64))
+                  for i, name in enumerate(columns, 1)]
+        return cls(hours.astype(np.int64), columns, arrays)
+
+    @classmethod
+    def from_cursor(cls, cursor, columns, dtypes=None, chunk_size=10000):
+        """
+        creates a ClimateSeries from the results of an executed query.
+        The results are converted in chunks, so that there's never more than
+        chunk_size rows of Python objects at a time (when using a server-side
+        cursor).
+
+        Parameters
+        ----------
+        cursor : MySQLdb.cursors.Cursor
+            a cursor on which a query was executed
+        columns : tuple of str
+            the names of the value columns (the first column of the
+            results has to be a date or datetime)
+        dtypes : dict or None
+            maps from a column name to its numpy dtype (cf. from_rows())
+        chunk_size : int
+            number of rows to convert at a time
+        """
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(cls.from_rows(rows, columns, dtypes))
+        if not chunks:
+            return cls.from_rows([], columns, dtypes)
+        return cls.concatenate(chunks)
+
+    @classmethod
+    def concatenate(cls, series):
+        """concatenates several series with the same columns"""
+        columns = series[0].columns
+        return cls(np.concatenate([s.hours for s in series]), columns,
+                   [np.concatenate([s[name] for s in series])
+                    for name in columns])
+
+    def __len__(self):
+        return len(self.hours)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __iter__(self):
+        """
+        yields the series as (datetime.datetime, value, ...) tuples (missing
+        values are None), i.e. in the row format of the queries.
+        """
+        timestamps = self.hours.astype('datetime64[h]').astype(object)
+        columns = [[None if value != value else value  # NaN != NaN
+                    for value in self.arrays[name].tolist()]
+                   for name in self.columns]
+        return iter(zip(timestamps.tolist(), *columns))
+
+    @property
+    def days(self):
+        """the day of each value in days since 1970-01-01"""
+        return self.hours // 24
+
+    @property
+    def nbytes(self):
+        """the number of bytes used by the arrays of the series"""
+        return self.hours.nbytes + sum(array.nbytes
+                                       for array in self.arrays.values())
+
+    def select(self, mask):
+        """returns a new series containing only the selected values"""
+        return ClimateSeries(self.hours[mask], self.columns,
+                             [self.arrays[name][mask] for name in self.columns])
+
+    def window(self, first_hour, end_hour):
+        """
+        returns the values from first_hour (inclusive) to end_hour
+        (exclusive) as a new series, whose arrays are views of the arrays
+        of this one (i.e. nothing is copied). The series has to be ordered
+        by time.
+        """
+        start, end = np.searchsorted(self.hours, [first_hour, end_hour])
+        return ClimateSeries(self.hours[start:end], self.columns,
+                             [self.arrays[name][start:end]
+                              for name in self.columns])
+
+
+def as_series(data, columns):
+    """
+    returns the given data as a ClimateSeries, converting it from a list of
+    rows (cf. ClimateSeries.from_rows()), if necessary.
+    """
+    if isinstance(data, ClimateSeries):
+        return data
+    return ClimateSeries.from_rows(data, columns)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+This module provides ClimateSession, which owns the database connection(s),
+the cache of fetched culture data and the configuration (database login,
+temperature bounds, stress factor) used to calculate climate data.
+
+Sessions don't share any state, so several sessions can be used in
+different threads or processes. A session can also be used from several
+threads at once: each thread gets its own database connection and the
+cache is guarded by a lock. Sessions can be pickled (e.g. to send them to
+a worker process), in which case the copy opens its own connections.
+
+>>> with ClimateSession(tub=32.0) as session:
+...     session.get_climate_data(56878, '2012-07-01', 42)
+"""
+
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+
+from climax.climate_data import (fetch_culture_data,
+                                 fetch_culture_data_concurrently,
+                                 culture_climate_data,
+                                 culture_climate_data_for_dates,
+                                 get_temp_stress_grid, CULTURE_FETCHERS)
+from climax.prepared import PreparedCursor, deallocate_statements
+from climax.stations import StationIndex, GapFiller, STATIONS_TABLE
+from climax import login
+
+# the session used by the module-level functions of climax.climate_data
+DEFAULT_SESSION = None
+DEFAULT_SESSION_LOCK = threading.Lock()
+
+
+class ClimateSession(object):
+    """
+    a session for calculating the climate data of cultures.
+
+    Attributes
+    ----------
+    db_config : dict
+        keyword arguments of login.get_db() (default: the login credentials
+        from ~/.climax.yaml)
+    concurrent : bool
+        If True, the queries of a culture are run concurrently on separate
+        pooled connections (cf. climate_data.fetch_culture_data_concurrently())
+    cache_size : int
+        maximum number of cultures whose data is kept in memory
+    prepared : bool
+        If True, the queries are run as server-side prepared statements,
+        which are prepared once per connection (cf. climax.prepared; this
+        isn't necessarily faster, cf. benchmarks/prepared.py)
+    tub : float
+        temperature upper bound
+    tlb : float
+        temperature lower bound
+    stress_factor : float
+        stress threshold = stress factor * soil volume
+    fill_gaps : bool
+        If True, gaps in the hourly climate data of each fetched culture are
+        filled with the data of the nearest weather stations (cf.
+        climax.stations). The station index is built once per session and
+        copied into pickled copies of the session (e.g. in worker
+        processes).
+    stations_table : str
+        the table of the weather stations and their coordinates (cf.
+        stations.STATIONS_TABLE)
+    shared_data : shared_data.SharedWeatherData or None
+        If given, the hourly climate and light data of the cultures it
+        contains is taken from there instead of the database (e.g. in the
+        worker processes of a batch run, cf. climax.shared_data)
+    """
+    def __init__(self, db_config=None, concurrent=False, cache_size=32,
+                 prepared=False, tub=30.0, tlb=8.0, stress_factor=0.2,
+                 fill_gaps=False, shared_data=None,
+                 stations_table=STATIONS_TABLE):
+        self.db_config = db_config or {}
+        self.concurrent = concurrent
+        self.cache_size = cache_size
+        self.prepared = prepared
+        self.tub = tub
+        self.tlb = tlb
+        self.stress_factor = stress_factor
+        self.fill_gaps = fill_gaps
+        self.shared_data = shared_data
+        self.stations_table = stations_table
+        self.station_index = None
+        self._reset()
+
+    def _reset(self):
+        """initializes the connection and cache state of the session"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pool = None
+        self._gap_filler = None
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        """connections, locks and caches aren't copied into other processes"""
+        return {key: value for key, value in self.__dict__.items()
+                if not key.startswith('_')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        """opens a new database connection"""
+        return login.get_db(**self.db_config)
+
+    def cursor(self):
+        """
+        returns the cursor of the (lazily opened) database connection of the
+        calling thread.
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            connection = self.connect()
+            with self._lock:
+                self._connections.append(connection)
+            cursor = connection.cursor()
+            if self.prepared:
+                cursor = PreparedCursor(cursor, connection)
+            self._local.cursor = cursor
+        return cursor
+
+    @property
+    def pool(self):
+        """the (lazily created) pool of connections for concurrent queries"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = login.ConnectionPool(size=len(CULTURE_FETCHERS),
+                                                  connect=self.connect,
+                                                  release=deallocate_statements)
+            return self._pool
+
+    @property
+    def gap_filler(self):
+        """
+        the (lazily created) GapFiller with the index of all stations. A
+        ValueError is raised, if the index can't be built (cf.
+        StationIndex.from_cursor()).
+        """
+        cursor = self.cursor()  # outside of the lock, cf. cursor()
+        with self._lock:
+            if self._gap_filler is None:
+                if self.station_index is None:
+                    self.station_index = StationIndex.from_cursor(
+                        cursor, self.stations_table)
+                self._gap_filler = GapFiller(self.station_index)
+            return self._gap_filler
+
+    def close(self):
+        """closes all connections of the session and empties its cache"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            pool, self._pool = self._pool, None
+            self._cache.clear()
+        self._local = threading.local()
+        # a failing connection doesn't keep the others (and the pool) open,
+        # the first error is raised once all of them are closed
+        error = None
+        try:
+            for connection in connections:
+                try:
+                    try:
+                        deallocate_statements(connection)
+                    finally:
+                        connection.close()
+                except Exception:
+                    sys.stderr.write("can't close a database connection:\n" +
+                                     traceback.format_exc())
+                    error = error or sys.exc_info()
+        finally:
+            if pool is not None:
+                pool.close()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def fetch_culture(self, culture_id, concurrent=None):
+        """
+        returns the data of a culture (cf. climate_data.fetch_culture_data()),
+        which is only fetched from the database, if it isn't cached.
+
+        Parameters
+        ----------
+        culture_id : int
+            ID of the culture, e.g. 56878
+        concurrent : bool or None
+            overrides the concurrent attribute of the session
+        """
+        with self._lock:
+            if culture_id in self._cache:
+                culture = self._cache.pop(culture_id)
+                self._cache[culture_id] = culture  # most recently used
+                return culture
+
+        if concurrent is None:
+            concurrent = self.concurrent
+        if self.shared_data is not None and culture_id in self.shared_data:
+            culture = self.shared_data.fetch_culture(culture_id, self.cursor())
+        elif concurrent:
+            culture = fetch_culture_data_concurrently(culture_id, self.pool,
+                                                      self.prepared)
+        else:
+            culture = fetch_culture_data(culture_id, self.cursor())
+        if self.fill_gaps:
+            culture = self.gap_filler.fill(culture, self.cursor())
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[culture_id] = culture
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return culture
+
+    def get_climate_data(self, culture_id=56878, floweringDate='2012-07-01',
+                         soilVolume=42):
+        """
+        calculates the climate data (temperature stress days, drought stress
+        days and light intensity) of a culture (cf.
+        climate_data.get_climate_data()).
+        """
+        return culture_climate_data(
+            self.fetch_culture(culture_id), floweringDate, soilVolume,
+            self.tub, self.tlb, self.stress_factor)
+
+    def get_climate_data_for_dates(self, culture_id=56878,
+                                   floweringDates=('2012-07-01',),
+                                   soilVolume=42):
+        """
+        calculates the climate data of a culture for several candidate
+        flowering dates (cf. climate_data.get_climate_data_for_dates()).
+        """
+        return culture_climate_data_for_dates(
+            self.fetch_culture(culture_id), floweringDates, soilVolume,
+            self.tub, self.tlb, self.stress_factor)
+
+    def get_temp_stress_grid(self, culture_id, tubs, tlbs,
+                             floweringDate='2012-07-01'):
+        """
+        calculates the cold and heat stress sums of a culture for whole
+        grids of temperature bounds (cf. climate_data.get_temp_stress_grid()).
+        """
+        return get_temp_stress_grid(self.fetch_culture(culture_id).climate_data,
+                                    tubs, tlbs, floweringDate)
+
+
+def get_default_session():
+    """
+    returns the (lazily created) session used by the module-level functions
+    of climax.climate_data.
+    """
+    global DEFAULT_SESSION
+    with DEFAULT_SESSION_LOCK:
+        if DEFAULT_SESSION is None:
+            # the module-level functions have always refetched the data
+            DEFAULT_SESSION = ClimateSession(cache_size=0)
+        return DEFAULT_SESSION
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+
+"""
+This module shares the hourly weather data of a batch run between the
+worker processes (cf. climax_batch.process_lines_in_parallel()).
+
+Without it, each worker fetches the hourly climate and light data of each
+of its cultures (cf. climate_data.fetch_climate()), i.e. the rows of a
+weather station are fetched (and held in memory) once per culture at the
+station's location and worker. Instead, the coordinator (the parent
+process) fetches the rows of each weather station once per batch, over the
+union of the trial windows of all cultures at the locations using it, and
+joins them into the hourly climate data of each location like
+queries.FAST_CLIMATE_QUERY does (the windspeed rows determine the hours,
+cf. join_climate()). The climate and light data of all locations is
+written into one file, which every worker maps into its memory
+(numpy.memmap). The series of a culture are views of its trial
+window, so the data isn't copied into the workers: their memory doesn't
+grow with the number of workers, the operating system keeps a single copy
+in its page cache. The file is created in SHARED_DIR (shared memory on
+Linux) and removed at the end of the batch (or when building it fails). It
+can't be unlinked as soon as the workers are started: each worker maps it
+only when it reads its first shared culture, i.e. it has to be reachable by
+its path until the workers are done.
+
+Locations with more than one weather station for the same data (or
+without a windspeed station) aren't shared, the cultures there are
+fetched as before.
+"""
+
+import os
+import tempfile
+import datetime
+
+import numpy as np
+
+from climax.climate_data import (CultureData, get_trial_daterange,
+                                 fetch_precipitation, fetch_irrigation)
+from climax.series import ClimateSeries, CLIMATE_COLUMNS, LIGHT_COLUMNS
+from climax.stations import COLUMN_STATIONS
+from climax.prepared import expand_list_parameters
+from climax.queries import (CULTURE_SOURCES_QUERY, CULTURE_STATE_QUERY,
+                            STATION_WINDOW_QUERY, LOCATION_SOLAR_WINDOW_QUERY)
+
+# the directory of the shared file (a RAM-backed file system, if available)
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# the offset of the trial start from the planting date (cf.
+# queries.TRIAL_DATES_QUERY)
+TRIAL_OFFSET = datetime.timedelta(days=14)
+
+
+def to_hours(day):
+    """converts a datetime.date into hours since 1970-01-01 00:00"""
+    return int(np.datetime64(day, 'D').astype('datetime64[h]').astype(np.int64))
+
+
+def to_datetime(hours):
+    """converts hours since 1970-01-01 00:00 into a datetime.datetime"""
+    return np.datetime64(int(hours), 'h').astype(object)
+
+
+def join_hours(hours, other_hours, other_values):
+    """
+    returns the values of another (time-ordered) series at the given hours
+    (NaN, where it has no value), i.e. a left join on the hour.
+    """
+    values = np.full(len(hours), np.nan)
+    if len(other_hours) == 0:
+        return values
+    positions = np.minimum(np.searchsorted(other_hours, hours),
+                           len(other_hours) - 1)
+    found = other_hours[positions] == hours
+    values[found] = other_values[positions[found]]
+    return values
+
+
+def join_climate(columns):
+    """
+    joins the series of the weather stations of a location into its hourly
+    climate data like queries.FAST_CLIMATE_QUERY: there is one row per
+    windspeed value, the temperature is matched by hour. The query joins
+    the humidity on the hour of the temperature row, i.e. there is no
+    humidity in the hours without a temperature row (but in those with a
+    NULL temperature).
+
+    Parameters
+    ----------
+    columns : dict, key = str, value = ClimateSeries
+        maps from a column of the climate data (cf. CLIMATE_COLUMNS) to the
+        ('amount') series of its station. The windspeed is mandatory.
+    """
+    wind = columns['windspeed']
+    if 'temperature' in columns:
+        has_temperature = np.in1d(wind.hours, columns['temperature'].hours)
+    else:
+        has_temperature = np.zeros(len(wind), dtype=bool)
+    arrays = []
+    for column in CLIMATE_COLUMNS:
+        if column == 'windspeed':
+            arrays.append(wind['amount'])
+        elif column in columns:
+            values = join_hours(wind.hours, columns[column].hours,
+                                columns[column]['amount'])
+            if column == 'humidity':
+                values[~has_temperature] = np.nan
+            arrays.append(values)
+        else:
+            arrays.append(np.full(len(wind), np.nan))
+    return ClimateSeries(wind.hours, CLIMATE_COLUMNS, arrays)
+
+
+class SharedSeries(object):
+    """
+    a read-only collection of named ClimateSeries in a file, which is
+    mapped into the memory of each process that reads it. Instances only
+    pickle the path and the layout of the file, so they can be sent to
+    worker processes cheaply.
+    """
+    def __init__(self, path, layout):
+        """
+        Parameters
+        ----------
+        path : str
+            the file (cf. SharedSeriesWriter)
+        layout : dict, key = str, value = (int, int, tuple of str)
+            maps from the name of a series to the offset (in items of 8
+            bytes) and the length of its arrays and its columns
+        """
+        self.path = path
+        self.layout = layout
+        self._memmap = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'layout': self.layout}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['layout'])
+
+    def __contains__(self, name):
+        return name in self.layout
+
+    def __getitem__(self, name):
+        """returns a series, whose arrays are views of the mapped file"""
+        if self._memmap is None:
+            self._memmap = np.memmap(self.path, dtype=np.float64, mode='r')
+        offset, length, columns = self.layout[name]
+        arrays = [self._memmap[offset + i * length:offset + (i + 1) * length]
+                  for i in range(len(columns) + 1)]
+        return ClimateSeries(arrays[0].view(np.int64), columns, arrays[1:])
+
+
+class SharedSeriesWriter(object):
+    """
+    writes ClimateSeries (with float64 columns) into a file for a
+    SharedSeries: the hours and the columns of each series are stored one
+    after another as arrays of 8 byte items.
+
+    Example
+    -------
+    >>> writer = SharedSeriesWriter(path)
+    >>> writer.add('climate:12', series)
+    >>> shared = writer.close()
+    """
+    def __init__(self, path):
+        self.path = path
+        self.layout = {}
+        self.offset = 0
+        self.output_file = open(path, 'wb')
+
+    def add(self, name, series):
+        self.layout[name] = (self.offset, len(series), series.columns)
+        self.output_file.write(series.hours.astype(np.int64).tostring())
+        for column in series.columns:
+            self.output_file.write(series[column].astype(np.float64).tostring())
+        self.offset += len(series) * (len(series.columns) + 1)
+
+    def close(self):
+        """closes the file and returns the SharedSeries"""
+        if self.offset == 0:
+            # an empty file can't be mapped into memory
+            self.output_file.write(np.zeros(1).tostring())
+        self.output_file.close()
+        return SharedSeries(self.path, self.layout)
+
+
+def location_windows(cursor, culture_ids):
+    """
+    finds the location and the weather stations of each culture and the
+    time window of the hourly data of each location.
+
+    Returns
+    -------
+    locations : dict, key = int, value = int
+        maps from a culture ID to its location ID
+    stations : dict, key = int, value = dict
+        maps from a location ID to a dict, which maps from the station data
+        (e.g. 'TAHV') to the set of IDs of the stations used at the location
+    windows : dict, key = int, value = (int, int)
+        maps from a location ID to the (first hour, end hour) of the union
+        of the trial windows of its cultures
+    """
+    cursor.execute(*expand_list_parameters(
+        CULTURE_SOURCES_QUERY, {'CULTURE_IDS': culture_ids}))
+    locations, stations = {}, {}
+    for culture_id, location_id, station_data, station_id in cursor.fetchall():
+        locations[culture_id] = location_id
+        if station_data is not None:
+            stations.setdefault(location_id, {}).setdefault(
+                station_data, set()).add(station_id)
+
+    cursor.execute(*expand_list_parameters(
+        CULTURE_STATE_QUERY, {'CULTURE_IDS': culture_ids}))
+    windows = {}
+    for culture_id, planted, terminated in cursor.fetchall():
+        if culture_id not in locations:
+            continue
+        first_hour = to_hours(planted + TRIAL_OFFSET)
+        end_hour = to_hours(terminated)
+        location_id = locations[culture_id]
+        if location_id in windows:
+            first_hour = min(first_hour, windows[location_id][0])
+            end_hour = max(end_hour, windows[location_id][1])
+        windows[location_id] = first_hour, end_hour
+    return locations, stations, windows
+
+
+class SharedWeatherData(object):
+    """
+    the hourly climate and light data of the locations of a batch run in a
+    SharedSeries (cf. module docstring).
+
+    Example
+    -------
+    >>> shared = SharedWeatherData.build(cursor, culture_ids)
+    >>> culture = shared.fetch_culture(56878, cursor)  # in a worker
+    >>> shared.close()  # in the coordinator
+    """
+    def __init__(self, series, locations):
+        """
+        Parameters
+        ----------
+        series : SharedSeries
+            the 'climate:{location ID}' and 'light:{location ID}' series
+        locations : dict, key = int, value = int
+            maps from the ID of a culture with shared data to its location ID
+        """
+        self.series = series
+        self.locations = locations
+
+    @classmethod
+    def build(cls, cursor, culture_ids, directory=SHARED_DIR):
+        """
+        fetches the rows of each weather station (and the light data of
+        each location) used by the given cultures once and writes the
+        hourly data of their locations into a new shared file.
+        """
+        culture_ids = sorted(set(culture_ids))
+        if not culture_ids:
+            return cls(SharedSeriesWriter(cls._new_path(directory)).close(), {})
+        locations, stations, windows = location_windows(cursor, culture_ids)
+
+        # the locations, whose climate data can be joined from one station
+        # per column (with a windspeed station, cf. FAST_CLIMATE_QUERY)
+        shared = sorted(
+            location_id for location_id in windows
+            if len(stations.get(location_id, {}).get('FFHM', ())) == 1 and
+            all(len(stations[location_id].get(station_data, ())) <= 1
+                for station_data, _ in COLUMN_STATIONS.values()))
+
+        # the union of the windows of the locations using each station
+        station_windows = {}
+        for location_id in shared:
+            for column in CLIMATE_COLUMNS:
+                station_data, table = COLUMN_STATIONS[column]
+                for station_id in stations[location_id].get(station_data, ()):
+                    first_hour, end_hour = windows[location_id]
+                    key = (table, station_id)
+                    if key in station_windows:
+                        first_hour = min(first_hour, station_windows[key][0])
+                        end_hour = max(end_hour, station_windows[key][1])
+                    station_windows[key] = first_hour, end_hour
+
+        station_series = {}
+        for (table, station_id), (first_hour, end_hour) in sorted(
+                station_windows.items()):
+            cursor.execute(STATION_WINDOW_QUERY.format(table=table),
+                           {'STATION_ID': station_id,
+                            'START': to_datetime(first_hour),
+                            'END': to_datetime(end_hour)})
+            station_series[table, station_id] = ClimateSeries.from_cursor(
+                cursor, ('amount',))
+
+        writer = SharedSeriesWriter(cls._new_path(directory))
+        try:
+            for location_id in shared:
+                first_hour, end_hour = windows[location_id]
+                columns = {}
+                for column in CLIMATE_COLUMNS:
+                    station_data, table = COLUMN_STATIONS[column]
+                    station_ids = stations[location_id].get(station_data)
+                    if station_ids:
+                        columns[column] = station_series[
+                            table, list(station_ids)[0]].window(first_hour, end_hour)
+                writer.add('climate:{}'.format(location_id),
+                           join_climate(columns))
+
+                cursor.execute(LOCATION_SOLAR_WINDOW_QUERY,
+                               {'LOCATION_ID': location_id,
+                                'START': to_datetime(first_hour),
+                                'END': to_datetime(end_hour)})
+                writer.add('light:{}'.format(location_id),
+                           ClimateSeries.from_cursor(cursor, LIGHT_COLUMNS))
+        except Exception:
+            # don't leave a partial file behind in shared memory
+            writer.output_file.close()
+            os.remove(writer.path)
+            raise
+        series = writer.close()
+        shared = set(shared)
+        return cls(series, {culture_id: location_id
+                            for culture_id, location_id in locations.items()
+                            if location_id in shared})
+
+    @staticmethod
+    def _new_path(directory):
+        handle, path = tempfile.mkstemp(prefix='climax_', suffix='.shared',
+                                        dir=directory)
+        os.close(handle)
+        return path
+
+    def __contains__(self, culture_id):
+        return culture_id in self.locations
+
+    def fetch_culture(self, culture_id, db_cursor):
+        """
+        fetches the data of a culture (cf. climate_data.fetch_culture_data()).
+        Only the trial dates, the precipitation and the irrigation are
+        fetched from the database, the hourly climate and light data are
+        views of the shared data of the culture's location.
+        """
+        trial_dates = get_trial_daterange(culture_id, db_cursor)
+        first_hour, end_hour = to_hours(trial_dates[0]), to_hours(trial_dates[-1])
+        location_id = self.locations[culture_id]
+        return CultureData(
+            culture_id, trial_dates,
+            fetch_precipitation(culture_id, db_cursor),
+            fetch_irrigation(culture_id, db_cursor),
+            self.series['climate:{}'.format(location_id)].window(first_hour, end_hour),
+            self.series['light:{}'.format(location_id)].window(first_hour, end_hour))
+
+    def close(self):
+        """removes the shared file (the workers must be done with it)"""
+        if os.path.exists(self.series.path):
+            os.remove(self.series.path)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+"""
+This module fills gaps in the hourly weather data of a culture with the
+data of the nearest weather stations.
+
+The hourly data of a culture comes from the one station per variable that
+usesWeatherStation assigns to its location (cf. queries.FAST_CLIMATE_QUERY).
+If that station has gaps, get_evaporation() silently drops days and the
+soil water model treats them as days without evaporation. A GapFiller
+instead puts the data of a culture on a complete hourly grid over its trial
+window and fills each missing value with the inverse distance weighted mean
+of the values of the nearest stations (at the same hour), which are found
+with a k-d tree over the station coordinates (StationIndex). The gap
+filling is vectorized over the whole trial window. The index is built only
+once per run (resp. per ClimateSession, whose copies in worker processes
+share it). The hourly data of the neighbouring stations is cached, so that
+the cultures of a location (or of nearby locations) don't fetch it again.
+"""
+
+import heapq
+from collections import OrderedDict
+
+import numpy as np
+
+from climax.series import ClimateSeries, CLIMATE_COLUMNS, as_series
+from climax.prepared import expand_list_parameters
+from climax.queries import (STATION_COORDINATES_QUERY, STATION_WINDOW_QUERY,
+                            CULTURE_SOURCES_QUERY)
+
+# the default table of the weather stations and their coordinates (cf.
+# queries.STATION_COORDINATES_QUERY)
+STATIONS_TABLE = 'dwd_stations'
+
+# maximum number of station series kept by a GapFiller
+STATION_CACHE_SIZE = 64
+
+# mean radius of the earth in km
+EARTH_RADIUS = 6371.0
+
+# number of stations whose values are used to fill a gap
+NEIGHBOURS = 3
+
+# stations that are farther away (in km) aren't used to fill gaps
+MAX_DISTANCE = 50.0
+
+# stations closer than this (in km) are weighted as if they were this far
+# away (to avoid infinite weights for co-located stations)
+MIN_DISTANCE = 0.1
+
+# maximum number of points in a leaf of the k-d tree
+LEAF_SIZE = 8
+
+# maps from a column of the hourly climate data to its station data
+# (cf. usesWeatherStation.stationData) and table
+COLUMN_STATIONS = {'temperature': ('TAHV', 'dwd_hourlyAirTemperature_TAHV'),
+                   'windspeed': ('FFHM', 'dwd_hourlyMeanWindspeed_FFHM'),
+                   'humidity': ('UUHV', 'dwd_hourlyRelHumidity_UUHV')}
+
+
+def unit_vectors(latitudes, longitudes):
+    """
+    converts coordinates (in degrees) into points on the unit sphere. The
+    euclidean (chord) distance of two points grows with their great-circle
+    distance, so nearest neighbours can be found in three dimensions.
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack((np.cos(latitudes) * np.cos(longitudes),
+                            np.cos(latitudes) * np.sin(longitudes),
+                            np.sin(latitudes)))
+
+
+def chord_to_km(chords):
+    """converts chord distances on the unit sphere into great-circle distances in km"""
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(np.asarray(chords) / 2, 1.0))
+
+
+class KDTree(object):
+    """
+    a static k-d tree over a set of points. Each node splits its points at
+    the median of the dimension with the largest spread.
+
+    Example
+    -------
+    >>> tree = KDTree(points)
+    >>> distances, indices = tree.query(point, k=3)
+    """
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.points = np.asarray(points, dtype=float)
+        self.order = np.arange(len(self.points))
+        # one (start, end, dimension, split value, left, right) list per
+        # node, leaves have no children (-1). Node 0 is the root.
+        self.nodes = []
+        if len(self.points):
+            self._build(0, len(self.points), leaf_size)
+
+    def _build(self, start, end, leaf_size):
+        node = len(self.nodes)
+        self.nodes.append([start, end, -1, 0.0, -1, -1])
+        if end - start <= leaf_size:
+            return node
+        points = self.points[self.order[start:end]]
+        dimension = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+        ranks = np.argsort(points[:, dimension], kind='mergesort')
+        self.order[start:end] = self.order[start:end][ranks]
+        middle = (start + end) // 2
+        split = self.points[self.order[middle], dimension]
+        self.nodes[node][2:4] = [dimension, split]
+        self.nodes[node][4] = self._build(start, middle, leaf_size)
+        self.nodes[node][5] = self._build(middle, end, leaf_size)
+        return node
+
+    def query(self, point, k=1):
+        """
+        finds the k nearest points.
+
+        Returns
+        -------
+        distances : np.ndarray of float
+            the euclidean distances of the nearest points (ascending)
+        indices : np.ndarray of int
+            the indices of the nearest points
+        """
+        point = np.asarray(point, dtype=float)
+        nearest = []  # heap of (-distance, index) of the k nearest points
+        stack = [(0.0, 0)] if self.nodes else []  # (lower bound, node)
+        while stack:
+            bound, node = stack.pop()
+            if len(nearest) == k and bound >= -nearest[0][0]:
+                continue
+            start, end, dimension, split, left, right = self.nodes[node]
+            if left < 0:
+                indices = self.order[start:end]
+                distances = np.sqrt(((self.points[indices] - point) ** 2).sum(axis=1))
+                for distance, index in zip(distances.tolist(), indices.tolist()):
+                    if len(nearest) < k:
+                        heapq.heappush(nearest, (-distance, index))
+                    elif distance < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-distance, index))
+                continue
+            offset = point[dimension] - split
+            near, far = (left, right) if offset < 0 else (right, left)
+            stack.append((max(bound, abs(offset)), far))
+            stack.append((bound, near))  # searched first
+        nearest = sorted((-distance, index) for distance, index in nearest)
+        return (np.array([distance for distance, _ in nearest]),
+                np.array([index for _, index in nearest], dtype=int))
+
+
+class StationIndex(object):
+    """
+    a spatial index over the coordinates of the weather stations.
+    """
+    def __init__(self, station_ids, latitudes, longitudes):
+        self.station_ids = np.asarray(station_ids)
+        self.points = unit_vectors(latitudes, longitudes)
+        self.positions = {station_id: i for i, station_id
+                          in enumerate(self.station_ids.tolist())}
+        self.tree = KDTree(self.points)
+
+    @classmethod
+    def from_cursor(cls, db_cursor, table=STATIONS_TABLE):
+        """
+        builds the index from the coordinates in the database.
+
+        Raises
+        ------
+        ValueError
+            if the coordinates can't be read from the table
+        """
+        try:
+            db_cursor.execute(STATION_COORDINATES_QUERY.format(table=table))
+            rows = db_cursor.fetchall()
+        except Exception as error:
+            raise ValueError(
+                "Can't read the coordinates of the weather stations from "
+                "table {} (station_id, latitude, longitude): {}".format(
+                    table, error))
+        return cls([row[0] for row in rows], [row[1] for row in rows],
+                   [row[2] for row in rows])
+
+    def neighbours(self, station_id, k=NEIGHBOURS, max_distance=MAX_DISTANCE):
+        """
+        returns the nearest other stations of a station.
+
+        Returns
+        -------
+        neighbours : list of (int, float) tuples
+            (station ID, distance in km) of up to k stations within
+            max_distance km, nearest first. Empty, if the station has no
+            known coordinates.
+        """
+        if station_id not in self.positions:
+            return []
+        chords, indices = self.tree.query(
+            self.points[self.positions[station_id]], k + 1)
+        return [(station, distance) for station, distance
+                in zip(self.station_ids[indices].tolist(),
+                       chord_to_km(chords).tolist())
+                if station != station_id and distance <= max_distance][:k]
+
+
+def hourly_grid(trial_dates):
+    """
+    returns the hours (since 1970-01-01 00:00) of a trial window, for which
+    hourly data is fetched (from the first trial day until the end date,
+    exclusive, cf. queries.FAST_CLIMATE_QUERY).
+    """
+    first_hour, end_hour = (np.array([trial_dates[0], trial_dates[-1]],
+                                     dtype='datetime64[D]')
+                            .astype('datetime64[h]').astype(np.int64))
+    return np.arange(first_hour, end_hour, dtype=np.int64)
+
+
+def align(hours, values, grid):
+    """
+    puts hourly values onto an hourly grid (missing hours are NaN). Hours
+    outside of the grid are dropped.
+    """
+    aligned = np.full(len(grid), np.nan)
+    if len(grid) == 0:
+        return aligned
+    positions = hours - grid[0]
+    inside = (positions >= 0) & (positions < len(grid))
+    aligned[positions[inside]] = values[inside]
+    return aligned
+
+
+def inverse_distance_fill(values, neighbour_values, distances, power=2):
+    """
+    fills the missing (NaN) values of an array with the inverse distance
+    weighted mean of the values of neighbouring stations. Each gap is only
+    filled from the neighbours which have a value at that position.
+
+    Parameters
+    ----------
+    values : np.ndarray of float
+        the values with gaps, shape (n,)
+    neighbour_values : np.ndarray of float
+        the values of the neighbours (NaN = missing), shape (k, n)
+    distances : array-like of float
+        the distance of each neighbour, shape (k,)
+
+    Returns
+    -------
+    filled : np.ndarray of float
+        the values, where each gap, for which at least one neighbour has a
+        value, is filled
+    """
+    weights = 1.0 / np.maximum(np.asarray(distances, dtype=float),
+                               MIN_DISTANCE) ** power
+    available = ~np.isnan(neighbour_values)
+    weights = np.where(available, weights[:, np.newaxis], 0.0)
+    total_weights = weights.sum(axis=0)
+    weighted_sums = np.where(available, neighbour_values, 0.0) * weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        estimates = weighted_sums.sum(axis=0) / total_weights
+    return np.where(np.isnan(values) & (total_weights > 0), estimates, values)
+
+
+class GapFiller(object):
+    """
+    fills the gaps in the hourly climate data of cultures with the data of
+    the nearest weather stations (cf. StationIndex).
+
+    Example
+    -------
+    >>> filler = GapFiller(StationIndex.from_cursor(cursor))
+    >>> culture = filler.fill(fetch_culture_data(56878, cursor), cursor)
+    """
+    def __init__(self, index, neighbours=NEIGHBOURS, max_distance=MAX_DISTANCE,
+                 cache_size=STATION_CACHE_SIZE):
+        self.index = index
+        self.neighbours = neighbours
+        self.max_distance = max_distance
+        self.cache_size = cache_size
+        # maps from (table, station ID) to the (first hour, end hour,
+        # ClimateSeries) of the last fetched window of a station, in the
+        # order of their last use
+        self.cache = OrderedDict()
+
+    def culture_stations(self, culture_id, db_cursor):
+        """
+        returns the stations of a culture's location.
+
+        Returns
+        -------
+        stations : dict, key = str, value = int
+            maps from the station data (e.g. 'TAHV') to the station ID
+        """
+        db_cursor.execute(*expand_list_parameters(
+            CULTURE_SOURCES_QUERY, {'CULTURE_IDS': [culture_id]}))
+        return {station_data: station_id
+                for _, _, station_data, station_id in db_cursor.fetchall()}
+
+    def station_values(self, table, station_id, grid, db_cursor):
+        """
+        returns the values of a station during a trial window (on the hourly
+        grid). They are only fetched, if the cached window of the station
+        doesn't cover the trial window. An overlapping cached window is
+        extended.
+        """
+        key = (table, station_id)
+        first_hour, end_hour = int(grid[0]), int(grid[-1]) + 1
+        cached = self.cache.pop(key, None)
+        if cached is not None and cached[0] <= first_hour and end_hour <= cached[1]:
+            series = cached[2]
+        else:
+            if cached is not None and cached[0] <= end_hour and first_hour <= cached[1]:
+                first_hour = min(first_hour, cached[0])
+                end_hour = max(end_hour, cached[1])
+            start, end = (np.array([first_hour, end_hour], dtype='datetime64[h]')
+                          .astype(object).tolist())
+            db_cursor.execute(STATION_WINDOW_QUERY.format(table=table),
+                              {'STATION_ID': station_id, 'START': start,
+                               'END': end})
+            series = ClimateSeries.from_cursor(db_cursor, ('amount',))
+            cached = (first_hour, end_hour, series)
+        self.cache[key] = cached
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return align(series.hours, series['amount'], grid)
+
+    def fill(self, culture, db_cursor):
+        """
+        fills the gaps in the hourly climate data of a culture.
+
+        Parameters
+        ----------
+        culture : climate_data.CultureData
+            the data of a culture (cf. climate_data.fetch_culture_data())
+        db_cursor : MySQLdb.cursors.Cursor
+            a cursor to the (running) database
+
+        Returns
+        -------
+        culture : climate_data.CultureData
+            the data of the culture, whose climate data is a ClimateSeries
+            on the complete hourly grid of the trial window (values that
+            couldn't be filled are NaN)
+        """
+        grid = hourly_grid(culture.trial_dates)
+        if len(grid) == 0:
+            return culture
+        climate = as_series(culture.climate_data, CLIMATE_COLUMNS)
+        stations = self.culture_stations(culture.culture_id, db_cursor)
+        columns = []
+        for column in CLIMATE_COLUMNS:
+            values = align(climate.hours, climate[column], grid)
+            station_data, table = COLUMN_STATIONS[column]
+            if np.isnan(values).any() and station_data in stations:
+                neighbours = self.index.neighbours(
+                    stations[station_data], self.neighbours, self.max_distance)
+                if neighbours:
+                    neighbour_values = np.array(
+                        [self.station_values(table, station_id, grid, db_cursor)
+                         for station_id, _ in neighbours])
+                    values = inverse_distance_fill(
+                        values, neighbour_values,
+                        [distance for _, distance in neighbours])
+            columns.append(values)
+        return culture._replace(
+            climate_data=ClimateSeries(grid, CLIMATE_COLUMNS, columns))
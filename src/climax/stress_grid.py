@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+This module calculates temperature stress sums for whole grids of
+temperature thresholds at once. The daily values are sorted only once,
+each threshold is then answered with a binary search and a lookup in the
+cumulative sums, i.e. the cost is O(days log days + thresholds log days)
+instead of O(days x thresholds).
+"""
+
+import numpy as np
+
+
+def sums_below(values, thresholds):
+    """
+    calculates sum(threshold - value) over all values below the threshold
+    for each of the given thresholds.
+
+    Parameters
+    ----------
+    values : array-like of float
+        e.g. daily minimum temperatures
+    thresholds : array-like of float
+        e.g. temperature lower bounds
+
+    Returns
+    -------
+    sums : np.ndarray of float
+        one sum per threshold
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    thresholds = np.asarray(thresholds, dtype=float)
+    prefix_sums = np.concatenate(([0.0], np.cumsum(values)))
+    counts = np.searchsorted(values, thresholds, side='left')
+    return counts * thresholds - prefix_sums[counts]
+
+
+def sums_above(values, thresholds):
+    """
+    calculates sum(value - threshold) over all values above the threshold
+    for each of the given thresholds.
+
+    Parameters
+    ----------
+    values : array-like of float
+        e.g. daily maximum temperatures
+    thresholds : array-like of float
+        e.g. temperature upper bounds
+
+    Returns
+    -------
+    sums : np.ndarray of float
+        one sum per threshold
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    thresholds = np.asarray(thresholds, dtype=float)
+    prefix_sums = np.concatenate(([0.0], np.cumsum(values)))
+    starts = np.searchsorted(values, thresholds, side='right')
+    counts = values.size - starts
+    return (prefix_sums[-1] - prefix_sums[starts]) - counts * thresholds
+
+
+def temp_stress_grid(days, tmin, tmax, tubs, tlbs, flowering_day):
+    """
+    calculates the cold and heat stress sums before and after flowering for
+    all the given temperature bounds. Cold stress only depends on the lower
+    bound and heat stress only on the upper bound, so each bound is
+    evaluated once: the results for a (tub, tlb) pair are the cold sums of
+    tlb and the heat sums of tub (there's no tub x tlb matrix).
+
+    Parameters
+    ----------
+    days : np.ndarray of int
+        days (since 1970-01-01) with temperature data
+    tmin, tmax : np.ndarray of float
+        minimum/maximum temperature of each day
+    tubs : array-like of float
+        temperature upper bounds
+    tlbs : array-like of float
+        temperature lower bounds
+    flowering_day : int
+        flowering date (days since 1970-01-01)
+
+    Returns
+    -------
+    cold_before, cold_after : np.ndarray of float
+        cold stress sums before/after flowering for each lower bound
+    heat_before, heat_after : np.ndarray of float
+        heat stress sums before/after flowering for each upper bound
+    """
+    before = np.asarray(days) < flowering_day
+    after = ~before
+    return (sums_below(tmin[before], tlbs), sums_below(tmin[after], tlbs),
+            sums_above(tmax[before], tubs), sums_above(tmax[after], tubs))
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+"""
+This module builds an index of the daily stress flags of many trials, which
+answers cross-trial questions (e.g. "which cultures had more than 5 heat
+stress days in the week after flowering?" or "which locations were in
+drought on 2012-07-01?") without calculating the climate data again.
+
+For each evaluated input line (culture, flowering date and soil volume) of
+a batch run, the index stores one bitset per flag (FLAGS) with one bit per
+day: the cold/heat stress days (i.e. the days with a positive cold resp.
+heat stress sum, cf. climax.metrics), the drought stress days of the
+control treatment (resp. of cultures without a treatment split) and the
+drought stress days of the stress treatment (cf.
+CultureMatrix.drought_flags()). The bitsets of all lines share one range of
+days and are packed into (lines x bytes) matrices (cf. numpy.packbits()).
+The bitsets of a location are the union of the bitsets of its lines.
+
+Queries are answered with vectorized bit operations over all lines at
+once: a window of days is a packed bit mask, which is ANDed with the
+bitsets, and the days within the window are counted with a lookup table of
+the number of set bits per byte.
+
+The index is built by climax_batch (--stress-index) and stored as a .npz
+file.
+
+Usage:
+    climax_stress_index on-day INDEX_FILE FLAG DATE [--level culture]
+    climax_stress_index after-flowering INDEX_FILE FLAG MIN_DAYS [--days 7]
+"""
+
+import os
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from climax.resample import epoch_days
+from climax.prepared import expand_list_parameters
+from climax.queries import CULTURE_SOURCES_QUERY
+
+# the daily flags of the index
+FLAGS = ('cold', 'heat', 'drought', 'stress_drought')
+
+LEVELS = ('culture', 'location')
+
+# number of set bits of each byte value
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)],
+                    dtype=np.uint8)
+
+# the daily flags of a trial: the first trial day (days since 1970-01-01),
+# the number of trial days and the packed flags (np.ndarray of uint8,
+# shape (len(FLAGS), bytes), one row of bits per flag, cf. numpy.packbits())
+TrialFlags = namedtuple('TrialFlags', ['first_day', 'num_days', 'packed'])
+
+
+def trial_flags(matrix, drought_flags):
+    """
+    packs the daily flags of all rows of a CultureMatrix.
+
+    Parameters
+    ----------
+    matrix : culture_matrix.CultureMatrix
+    drought_flags : dict
+        the drought stress days of the rows (cf. CultureMatrix.drought_flags())
+
+    Returns
+    -------
+    flags : list of TrialFlags
+        one TrialFlags per row
+    """
+    daily = matrix.daily_flags(drought_flags)
+    stacked = np.array([daily[flag] for flag in FLAGS])  # flag x row x day
+    return [TrialFlags(first_day, num_days,
+                       np.packbits(stacked[:, row, :num_days], axis=1))
+            for row, (first_day, num_days)
+            in enumerate(zip(matrix.first_days.tolist(),
+                             matrix.num_days.tolist()))]
+
+
+def window_mask(starts, ends, num_days):
+    """
+    returns the packed bit masks of the day windows [start, end), i.e. one
+    row of num_days bits per window (starts and ends are positions within
+    the range of the index and are clipped to it).
+    """
+    positions = np.arange(num_days)
+    starts = np.atleast_1d(starts)[:, np.newaxis]
+    ends = np.atleast_1d(ends)[:, np.newaxis]
+    return np.packbits((positions >= starts) & (positions < ends), axis=1)
+
+
+def culture_locations(cursor, culture_ids):
+    """returns a dict mapping from each culture ID to its location ID"""
+    if not culture_ids:
+        return {}
+    cursor.execute(*expand_list_parameters(
+        CULTURE_SOURCES_QUERY, {'CULTURE_IDS': sorted(set(culture_ids))}))
+    return {culture_id: location_id
+            for culture_id, location_id, _, _ in cursor.fetchall()}
+
+
+class StressIndex(object):
+    """
+    the packed daily stress flags of many trials (cf. module docstring).
+
+    Attributes
+    ----------
+    first_day : int
+        the first day (days since 1970-01-01) of the range of the index
+    num_days : int
+        number of days (i.e. bits per bitset) of the index
+    culture_ids, flowering_days, soil_volumes, location_ids : np.ndarray
+        the input line of each row (and the location of its culture)
+    bits : dict, key = str, value = np.ndarray of uint8
+        maps from a flag to its packed (rows x bytes) bitsets
+    locations : np.ndarray of int
+        the locations of the index (sorted)
+    location_bits : dict, key = str, value = np.ndarray of uint8
+        maps from a flag to the packed bitsets of the locations
+
+    Example
+    -------
+    >>> index = StressIndex.load('stress_index.npz')
+    >>> heat_days = index.count_after_flowering('heat', 7)
+    >>> index.culture_ids[heat_days > 5]
+    >>> index.flagged_on('drought', '2012-07-01', level='location')
+    """
+    def __init__(self, first_day, num_days, culture_ids, flowering_days,
+                 soil_volumes, location_ids, bits):
+        self.first_day = int(first_day)
+        self.num_days = int(num_days)
+        self.culture_ids = np.asarray(culture_ids, dtype=np.int64)
+        self.flowering_days = np.asarray(flowering_days, dtype=np.int64)
+        self.soil_volumes = np.asarray(soil_volumes, dtype=float)
+        self.location_ids = np.asarray(location_ids, dtype=np.int64)
+        self.bits = bits
+
+        # the union of the bitsets of the rows of each location
+        order = np.argsort(self.location_ids, kind='mergesort')
+        self.locations, starts = np.unique(self.location_ids[order],
+                                           return_index=True)
+        self.location_bits = {
+            flag: (np.bitwise_or.reduceat(bits[flag][order], starts, axis=0)
+                   if len(order) else bits[flag])
+            for flag in FLAGS}
+
+    def _level(self, flag, level):
+        """returns the IDs and the packed bitsets of a flag on a level"""
+        assert flag in FLAGS, "Unknown flag: {}".format(flag)
+        assert level in LEVELS, "Unknown level: {}".format(level)
+        if level == 'culture':
+            return self.culture_ids, self.bits[flag]
+        return self.locations, self.location_bits[flag]
+
+    def count_days(self, flag, start, end, level='culture'):
+        """
+        counts the flagged days of each row (resp. location) within the
+        days start (inclusive) ... end (exclusive).
+
+        Parameters
+        ----------
+        flag : str
+            one of FLAGS
+        start, end : day or array-like of days
+            the window (cf. resample.epoch_days()), either one for all rows
+            or one per row (resp. location)
+        level : str
+            'culture' (one count per row) or 'location'
+
+        Returns
+        -------
+        counts : np.ndarray of int
+        """
+        _, bits = self._level(flag, level)
+        mask = window_mask(epoch_days(start) - self.first_day,
+                           epoch_days(end) - self.first_day, self.num_days)
+        return POPCOUNT[bits & mask].sum(axis=1, dtype=np.int64)
+
+    def count_after_flowering(self, flag, days=7, offset=0):
+        """
+        counts the flagged days of each row within the given number of days
+        after its flowering date (starting offset days after it).
+        """
+        start = self.flowering_days + offset
+        return self.count_days(flag, start, start + days)
+
+    def flagged_on(self, flag, day, level='location'):
+        """returns the IDs of the cultures (resp. locations) flagged on a day"""
+        ids, bits = self._level(flag, level)
+        position = int(epoch_days(day)) - self.first_day
+        if not 0 <= position < self.num_days:
+            return ids[:0]
+        flagged = (bits[:, position // 8] >> (7 - position % 8)) & 1
+        return np.unique(ids[flagged.astype(bool)])
+
+    def save(self, path):
+        """stores the index as a .npz file"""
+        arrays = {'bits_' + flag: self.bits[flag] for flag in FLAGS}
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(temp_path, first_day=self.first_day,
+                            num_days=self.num_days,
+                            culture_ids=self.culture_ids,
+                            flowering_days=self.flowering_days,
+                            soil_volumes=self.soil_volumes,
+                            location_ids=self.location_ids, **arrays)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """loads an index from a .npz file (cf. save())"""
+        with np.load(path) as arrays:
+            return cls(arrays['first_day'], arrays['num_days'],
+                       arrays['culture_ids'], arrays['flowering_days'],
+                       arrays['soil_volumes'], arrays['location_ids'],
+                       {flag: arrays['bits_' + flag] for flag in FLAGS})
+
+    def trials(self):
+        """
+        returns the flags of each row as a dict mapping from (culture ID,
+        flowering day, soil volume) to TrialFlags
+        """
+        trials = {}
+        for row, key in enumerate(zip(self.culture_ids.tolist(),
+                                      self.flowering_days.tolist(),
+                                      self.soil_volumes.tolist())):
+            trials[key] = TrialFlags(self.first_day, self.num_days, np.array(
+                [self.bits[flag][row] for flag in FLAGS]))
+        return trials
+
+
+class StressIndexBuilder(object):
+    """
+    collects the daily flags of the input lines of a batch run and writes
+    them as a StressIndex.
+
+    Example
+    -------
+    >>> builder = StressIndexBuilder('stress_index.npz')
+    >>> builder.add(56878, '2012-07-01', 42, flags)
+    >>> builder.save(cursor)
+    """
+    def __init__(self, path, update=False):
+        """
+        Parameters
+        ----------
+        path : str
+            the .npz file of the index
+        update : bool
+            If True, the rows of an existing index are kept (unless they are
+            added again), e.g. for incremental runs, which only evaluate the
+            lines whose source data changed.
+        """
+        self.path = path
+        self.trials = {}  # maps from an input line to its TrialFlags
+        if update and os.path.exists(path):
+            self.trials = StressIndex.load(path).trials()
+
+    def add(self, culture_id, floweringDate, soilVolume, flags):
+        """
+        adds the flags (TrialFlags, cf. trial_flags()) of an input line.
+        """
+        key = (int(culture_id), int(epoch_days(floweringDate)), float(soilVolume))
+        self.trials[key] = flags
+
+    def build(self, cursor):
+        """
+        builds the StressIndex of all added lines. The locations of the
+        cultures are fetched from the database.
+        """
+        keys = sorted(self.trials)
+        trials = [self.trials[key] for key in keys]
+        first_day = min([t.first_day for t in trials] or [0])
+        num_days = max([t.first_day + t.num_days for t in trials] or [0]) - first_day
+        bits = {}
+        for i, flag in enumerate(FLAGS):
+            dense = np.zeros((len(keys), num_days), dtype=bool)
+            for row, t in enumerate(trials):
+                offset = t.first_day - first_day
+                dense[row, offset:offset + t.num_days] = \
+                    np.unpackbits(t.packed[i])[:t.num_days]
+            bits[flag] = np.packbits(dense, axis=1)
+        locations = culture_locations(cursor, [key[0] for key in keys])
+        return StressIndex(first_day, num_days,
+                           [key[0] for key in keys], [key[1] for key in keys],
+                           [key[2] for key in keys],
+                           [locations.get(key[0], -1) for key in keys], bits)
+
+    def save(self, cursor):
+        """builds the index (cf. build()) and stores it"""
+        self.build(cursor).save(self.path)
+
+
+def main(args=None):
+    """answers queries against a stress index"""
+    parser = argparse.ArgumentParser(
+        description="queries the daily stress flags of a batch run")
+    subparsers = parser.add_subparsers(dest='command')
+    on_day = subparsers.add_parser(
+        'on-day', help='lists the locations (or cultures) flagged on a day')
+    on_day.add_argument('index_file', help='.npz file of the index')
+    on_day.add_argument('flag', choices=FLAGS)
+    on_day.add_argument('date', help='date string in YYYY-MM-DD format')
+    on_day.add_argument('--level', choices=LEVELS, default='location',
+                        help='(default: location)')
+    after = subparsers.add_parser(
+        'after-flowering',
+        help='lists the cultures with more flagged days after flowering')
+    after.add_argument('index_file', help='.npz file of the index')
+    after.add_argument('flag', choices=FLAGS)
+    after.add_argument('min_days', type=int,
+                       help='list the cultures with more flagged days')
+    after.add_argument('--days', type=int, default=7,
+                       help='number of days after flowering (default: 7)')
+    args = parser.parse_args(args)
+
+    index = StressIndex.load(args.index_file)
+    if args.command == 'on-day':
+        for entity_id in index.flagged_on(args.flag, args.date, args.level).tolist():
+            print entity_id
+        return
+    counts = index.count_after_flowering(args.flag, args.days)
+    for row in np.flatnonzero(counts > args.min_days).tolist():
+        print '{}\t{}\t{}\t{}'.format(
+            index.culture_ids[row],
+            np.datetime64(int(index.flowering_days[row]), 'D'),
+            index.soil_volumes[row], counts[row])
@@ -14,7 +14,8 @@ import datetime
 from collections import defaultdict
 
 import numpy as np
-from lxml import etree
+
+from climax.resample import epoch_days, year_week, resample
 
 
 __author__ = 'Christian Schudoma'
@@ -22,6 +23,9 @@ __copyright__ = 'Copyright 2013-2014, Christian Schudoma'
 __license__ = 'MIT'
 __maintainer__ = 'Arne Neumann'
 
+# midday interval (10am - 2pm, both inclusive) in seconds since midnight
+MIDDAY_START, MIDDAY_END = 10 * 3600, 14 * 3600
+
 
 def trost2date(trost_date):
     """converts a 'YYYY-MM-DD' date string into a datetime.date instance"""
@@ -71,6 +75,7 @@ def read_dwd_climate_data(climate_file, start_date='2011-04-11',
     start, end = trost2date(start_date), trost2date(end_date)
     station_data = defaultdict(list)
 
+    from lxml import etree  # only needed for reading DWD files
     tree = etree.parse(climate_file)
     stations = list(tree.iterfind('{http://www.unidart.eu/xsd}stationname'))
     assert len(stations) == 1, "Can't handle multi-station file '{}'".format(dwd_file)
@@ -89,6 +94,45 @@ def read_dwd_climate_data(climate_file, start_date='2011-04-11',
     return station_data
 
 
+def read_dwd_climate_arrays(climate_file, start_date='2011-04-11',
+                            end_date='2011-09-02'):
+    """
+    Reads DWD Climate Data in the interval of (start_date (YYYY-MM-DD),
+    end_date (YYYY-MM-DD)) from a DWD XML file containing data from a single
+    weather station. This is the array-based counterpart of
+    read_dwd_climate_data().
+
+    Parameters
+    ----------
+    climate_file : str
+        file name of a DWD XML climate file
+    start_date : str
+        start date in YYYY-MM-DD format
+    end_date : str
+        end date in YYYY-MM-DD format
+
+    Returns
+    -------
+    timestamps : np.ndarray of datetime64[s]
+        points of time of the measurements (in file order)
+    values : np.ndarray of float
+        the measured values
+    """
+    from lxml import etree  # only needed for reading DWD files
+    tree = etree.parse(climate_file)
+    stations = list(tree.iterfind('{http://www.unidart.eu/xsd}stationname'))
+    assert len(stations) == 1, "Can't handle multi-station file '{}'".format(climate_file)
+    datapoints = list(stations[0].iterchildren())
+    # DWD dates look like '2011-04-11T10:00:00Z', datetime64 doesn't want the Z
+    timestamps = np.array([dp.attrib['date'].rstrip('Z') for dp in datapoints],
+                          dtype='datetime64[s]')
+    values = np.array([float(dp.text) for dp in datapoints], dtype=float)
+
+    days = timestamps.astype('datetime64[D]')
+    in_range = (days >= np.datetime64(start_date)) & (days <= np.datetime64(end_date))
+    return timestamps[in_range], values[in_range]
+
+
 def calc_VPD(t_celsius, rel_humidity):
     """
     calculates the Vapour Pressure Deficit (VPD) from temperature (degrees
@@ -97,15 +141,15 @@ def calc_VPD(t_celsius, rel_humidity):
 
     Parameters
     ----------
-    t_celsius : float
+    t_celsius : float or np.ndarray of float
         temperature in degrees celsius
-    rel_humidity : float
+    rel_humidity : float or np.ndarray of float
         relative humidity (represented as a fraction between 0.0 and 1.0)
 
     Returns
     -------
-    vpd : float
-        Vapour Pressure Deficit
+    vpd : float or np.ndarray of float
+        Vapour Pressure Deficit (an array, iff any of the inputs is an array)
 
     Other algorithms to calculate VPD include:
 
@@ -123,36 +167,70 @@ def calc_VPD(t_celsius, rel_humidity):
     # according to Licor LI-6400 manual pg 14-10
     # and Buck AL (1981). New equations for computing vapor pressure and
     # enhancement factor. J Appl Meteor 20:1527-1532
-    vp_sat = 0.61365 * math.exp((17.502 * t_celsius) / (240.97 + t_celsius))
+    if np.isscalar(t_celsius):
+        vp_sat = 0.61365 * math.exp((17.502 * t_celsius) / (240.97 + t_celsius))
+    else:
+        t_celsius = np.asarray(t_celsius, dtype=float)
+        vp_sat = 0.61365 * np.exp((17.502 * t_celsius) / (240.97 + t_celsius))
 
     vp_air = vp_sat * rel_humidity
     return vp_sat - vp_air  # or vp_sat * (1 - rel_humidity)
 
 
-def compute_weekly_midday_vpd(temperatures, relHumidity):
+def align_series(timestamps_a, values_a, timestamps_b, values_b):
     """
-    Computes the weekly midday (10am - 2pm) VPD.
-    Returns dictionary {week-index: average midday VPD}
+    aligns two measurement series on their common points of time. If a
+    series contains several values for the same point of time, only the
+    first one is used.
+
+    Returns
+    -------
+    timestamps : np.ndarray
+        sorted points of time present in both series
+    values_a, values_b : np.ndarray
+        the corresponding values of the two series
     """
-    hourly = {timepoint: calc_VPD(temperatures[timepoint][0], relHumidity[timepoint][0])
-              for timepoint in set(temperatures.keys()).intersection(set(relHumidity.keys()))}
-    daily = {}
-    midday = (datetime.datetime.strptime('10:00:00', '%H:%M:%S'),
-              datetime.datetime.strptime('14:00:00', '%H:%M:%S'))
-    for tp in hourly:
-        try:
-            hour = datetime.datetime.strptime(tp[1], '%H:%M:%S')
-        except:
-            hour = datetime.datetime.strptime(tp[1], '%H:%M')
-        if midday[0] <= hour <= midday[1]:
-            daily[tp[0]] = daily.get(tp[0], []) + [hourly[tp]]
+    # np.unique uses a stable sort when asked for indices, so we'll get the
+    # index of the first occurrence of each point of time
+    unique_a, first_a = np.unique(timestamps_a, return_index=True)
+    unique_b, first_b = np.unique(timestamps_b, return_index=True)
+    common = np.intersect1d(unique_a, unique_b, assume_unique=True)
+    pos_a = first_a[np.searchsorted(unique_a, common)]
+    pos_b = first_b[np.searchsorted(unique_b, common)]
+    return common, np.asarray(values_a)[pos_a], np.asarray(values_b)[pos_b]
 
-    weekly = {}
-    for k in sorted(daily):
-        week = tuple(map(int, datetime.datetime.strftime(datetime.datetime.strptime(k, '%Y-%m-%d'), '%Y-%W').split('-')))
-        weekly[week] = weekly.get(week, []) + [np.median(daily[k])]
 
-    return {week: sum(weekly[week])/len(weekly[week]) for week in weekly}
+def weekly_midday_vpd(timestamps, temperatures, rel_humidity):
+    """
+    Computes the weekly midday (10am - 2pm) VPD, i.e. the mean of the daily
+    medians of the hourly midday VPD values of each week.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray of datetime64
+        points of time (sorted, without duplicates)
+    temperatures : np.ndarray of float
+        temperature in degrees celsius at each point of time
+    rel_humidity : np.ndarray of float
+        relative humidity (as a fraction) at each point of time
+
+    Returns
+    -------
+    years, weeks : np.ndarray of int
+        year and week (cf. year_week()) of each week with midday data
+    vpd : np.ndarray of float
+        average midday VPD of each week
+    """
+    timestamps = np.asarray(timestamps).astype('datetime64[s]')
+    seconds = timestamps.astype(np.int64)
+    time_of_day = seconds % 86400
+    midday = (time_of_day >= MIDDAY_START) & (time_of_day <= MIDDAY_END)
+
+    hourly_vpd = calc_VPD(np.asarray(temperatures, dtype=float)[midday],
+                          np.asarray(rel_humidity, dtype=float)[midday])
+    days, daily = resample(seconds[midday] // 86400, hourly_vpd, how=('median',))
+    week_keys, weekly = resample(days, daily['median'], by='week', how=('mean',))
+    return week_keys // 100, week_keys % 100, weekly['mean']
 
 
 def calc_heat_sum(tmin, tmax, tbase=6.0):
@@ -162,21 +240,93 @@ def calc_heat_sum(tmin, tmax, tbase=6.0):
     heat_sum_d = max(tx - tbase, 0), with
     tx = (tmin + tmax)/2 and
     tmax = min(tmax_measured, 30.0)
+
+    tmin and tmax may also be arrays of daily temperatures.
+    """
+    if np.isscalar(tmin) and np.isscalar(tmax):
+        tmax = min(tmax, 30.0)
+        tx = (tmin + tmax) / 2.0
+        return max(tx - tbase, 0.0)
+    tmax = np.minimum(tmax, 30.0)
+    tx = (np.asarray(tmin, dtype=float) + tmax) / 2.0
+    return np.maximum(tx - tbase, 0.0)
+
+
+def daily_heatsums(tmin, tmax, tbase=6.0):
+    """
+    Computes the cumulative heat sum for each day of a sorted range of days.
+
+    Parameters
+    ----------
+    tmin, tmax : np.ndarray of float
+        daily minimum/maximum temperatures (sorted by day)
+
+    Returns
+    -------
+    heatsums : np.ndarray of float
+        heat sum accumulated up to (and including) each day
     """
-    tmax = min(tmax, 30.0)
-    tx = (tmin + tmax) / 2.0
-    return max(tx - tbase, 0.0)
+    return np.cumsum(calc_heat_sum(np.asarray(tmin, dtype=float),
+                                   np.asarray(tmax, dtype=float), tbase))
+
+
+def weekly_heatsums(days, heatsums, day=5):
+    """
+    Returns weekly heatsums from a representative day of the week
+    (day=5: Friday => end of weekly measuring interval for many DWD stations!)
+
+    Parameters
+    ----------
+    days : np.ndarray of int
+        days since 1970-01-01
+    heatsums : np.ndarray of float
+        cumulative heat sum of each day
+    day : int
+        representative day of the week (Sunday = 0, cf. strftime('%w'))
+
+    Returns
+    -------
+    years, weeks : np.ndarray of int
+        year and week (cf. year_week()) of each representative day
+    heatsums : np.ndarray of float
+        cumulative heat sum on each representative day
+    """
+    days = np.asarray(days, dtype=np.int64)
+    representative = (days + 4) % 7 == day  # 1970-01-01 was a Thursday
+    years, weeks = year_week(days[representative])
+    return years, weeks, np.asarray(heatsums)[representative]
+
+
+def _trost_dates(date_strings):
+    """converts a list of 'YYYY-MM-DD' date strings into datetime64[D]"""
+    return np.array(date_strings, dtype='datetime64[D]')
+
+
+def compute_weekly_midday_vpd(temperatures, relHumidity):
+    """
+    Computes the weekly midday (10am - 2pm) VPD.
+    Returns dictionary {week-index: average midday VPD}
+    """
+    timepoints = sorted(set(temperatures.keys()).intersection(set(relHumidity.keys())))
+    if not timepoints:
+        return {}
+    timestamps = np.array(['{}T{}'.format(day, time_) for day, time_ in timepoints],
+                          dtype='datetime64[s]')
+    temps = np.array([temperatures[tp][0] for tp in timepoints], dtype=float)
+    hums = np.array([relHumidity[tp][0] for tp in timepoints], dtype=float)
+    years, weeks, vpd = weekly_midday_vpd(timestamps, temps, hums)
+    return {(year, week): value
+            for year, week, value in zip(years.tolist(), weeks.tolist(), vpd.tolist())}
 
 
 def compute_heatsum_per_day(maxTemps, minTemps):
     """
     Computes daily heat sums based on min/max temperatures for a range of days
     """
-    heatsum, heatsum_day = 0, {}
-    for k in sorted(set(maxTemps.keys()).intersection(set(minTemps.keys()))):
-        heatsum += calc_heat_sum(minTemps[k], maxTemps[k])
-        heatsum_day[k] = heatsum
-    return heatsum_day
+    days = sorted(set(maxTemps.keys()).intersection(set(minTemps.keys())))
+    heatsums = daily_heatsums([minTemps[k] for k in days],
+                              [maxTemps[k] for k in days])
+    return dict(zip(days, heatsums.tolist()))
 
 
 def compute_heatsum_per_week(heatsum_day, day=5):
@@ -184,12 +334,13 @@ def compute_heatsum_per_week(heatsum_day, day=5):
     Returns weekly heatsums from a representative day of the week
     (day=5: Friday => end of weekly measuring interval for many DWD stations!)
     """
-    heatsum_week = {}
-    for k in heatsum_day:
-        year, week, weekday = map(int, datetime.datetime.strftime(datetime.datetime.strptime(k, '%Y-%m-%d'), '%Y %W %w').split())
-        if weekday == day:
-            heatsum_week[(year, week)] = heatsum_day[k]
-    return heatsum_week
+    if not heatsum_day:
+        return {}
+    keys = list(heatsum_day)
+    years, weeks, heatsums = weekly_heatsums(
+        epoch_days(_trost_dates(keys)), [heatsum_day[k] for k in keys], day)
+    return {(year, week): value for year, week, value
+            in zip(years.tolist(), weeks.tolist(), heatsums.tolist())}
 
 
 def main(argv):
@@ -205,24 +356,20 @@ def main(argv):
     fn_Temperatures, fn_RelHumidities = argv[0], argv[1]
     startd, endd = argv[2].split(',')
     fout = argv[3]
-    rawTemperatures = read_dwd_climate_data(fn_Temperatures, start_date=startd, end_date=endd)
-    rawRelHumidities = read_dwd_climate_data(fn_RelHumidities, start_date=startd, end_date=endd)
-
-    # convert %-values from DWD to fractional values
-    for k in rawRelHumidities:
-        rawRelHumidities[k] = map(lambda x: x/100.0, rawRelHumidities[k])
-    # group temperatures per day in order to facilitating the computation of daily min/max
-    groupedTemperatures = {}
-    for k in rawTemperatures:
-        groupedTemperatures[k[0]] = groupedTemperatures.get(k[0], []) + rawTemperatures[k]
-    # compute daily min/max temperatures
-    maxTemperatures, minTemperatures = {}, {}
-    for k in sorted(groupedTemperatures):
-        maxTemperatures[k], minTemperatures[k] = max(groupedTemperatures[k]), min(groupedTemperatures[k])
+    temp_times, temps = read_dwd_climate_arrays(fn_Temperatures, start_date=startd, end_date=endd)
+    hum_times, hums = read_dwd_climate_arrays(fn_RelHumidities, start_date=startd, end_date=endd)
 
-    # compute VPD and thermal time
-    VPD = compute_weekly_midday_vpd(rawTemperatures, rawRelHumidities)
-    HEATSUM = compute_heatsum_per_week(compute_heatsum_per_day(maxTemperatures, minTemperatures))
+    # compute daily min/max temperatures
+    days, dailyTemperatures = resample(temp_times, temps, how=('min', 'max'))
+    minTemperatures, maxTemperatures = dailyTemperatures['min'], dailyTemperatures['max']
+
+    # compute VPD and thermal time, convert %-values from DWD to fractional values
+    timestamps, vpd_temps, vpd_hums = align_series(temp_times, temps, hum_times, hums)
+    vpd_years, vpd_weeks, vpd = weekly_midday_vpd(timestamps, vpd_temps, vpd_hums / 100.0)
+    hs_years, hs_weeks, heatsum = weekly_heatsums(
+        days, daily_heatsums(minTemperatures, maxTemperatures))
+    VPD = dict(zip(zip(vpd_years.tolist(), vpd_weeks.tolist()), vpd.tolist()))
+    HEATSUM = dict(zip(zip(hs_years.tolist(), hs_weeks.tolist()), heatsum.tolist()))
 
     # write heatsum/vpd values
     out = open(fout, 'wb')
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""tests of climax.climatology (with a stub cursor instead of a database)"""
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import numpy as np
+
+from climax.climatology import (day_of_year, stream_days, Climatology,
+                                build_station_climatology, DAYS_PER_YEAR)
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+class RowsCursor(object):
+    """a cursor, whose results are the given rows"""
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        self.pending = list(self.rows)
+
+    def fetchmany(self, size):
+        rows, self.pending = self.pending[:size], self.pending[size:]
+        return rows
+
+
+def hourly_rows(num_days, seed=7):
+    """random hourly temperature rows (with missing hours) from 1999-12-25"""
+    rng = np.random.RandomState(seed)
+    start = datetime.datetime(1999, 12, 25)
+    return [(start + datetime.timedelta(hours=hour),
+             round(rng.uniform(-10, 38), 1))
+            for hour in range(num_days * 24) if rng.uniform() < 0.9]
+
+
+class DayOfYearTest(unittest.TestCase):
+    def test_leap_year_calendar(self):
+        start = (datetime.date(1999, 1, 1) - EPOCH).days
+        days = np.arange(start, start + 6 * 366)
+        expected = []
+        for day in days.tolist():
+            date = EPOCH + datetime.timedelta(days=day)
+            expected.append((datetime.date(2000, date.month, date.day) -
+                             datetime.date(2000, 1, 1)).days)
+        self.assertEqual(day_of_year(days).tolist(), expected)
+        self.assertEqual(day_of_year(days).max(), DAYS_PER_YEAR - 1)
+
+
+class StreamDaysTest(unittest.TestCase):
+    def test_whole_days(self):
+        rows = hourly_rows(10)
+        for chunk_size in (1, 5, 24, 100, 1000):
+            cursor = RowsCursor(rows)
+            cursor.execute('')
+            chunks = list(stream_days(cursor, ('temperature',), chunk_size))
+            self.assertEqual([row for chunk in chunks for row in chunk], rows)
+            # no day is split between two chunks
+            days = [set(chunk.days.tolist()) for chunk in chunks]
+            for first, second in zip(days, days[1:]):
+                self.assertTrue(max(first) < min(second))
+
+    def test_no_rows(self):
+        cursor = RowsCursor([])
+        cursor.execute('')
+        self.assertEqual(list(stream_days(cursor, ('temperature',))), [])
+
+
+class ClimatologyTest(unittest.TestCase):
+    def test_aggregates(self):
+        rng = np.random.RandomState(8)
+        days = np.arange(10000, 10000 + 4 * 365)
+        values = rng.uniform(0, 10, len(days))
+        climatology = Climatology(('light',))
+        climatology.add('light', days[:500], values[:500])
+        climatology.add('light', days[500:], values[500:])
+        doy = day_of_year(days)
+        for day in (0, 59, 100, 365):
+            selected = values[doy == day]
+            self.assertEqual(climatology.counts['light'][day], len(selected))
+            self.assertAlmostEqual(climatology.mean('light')[day], selected.mean())
+            self.assertAlmostEqual(climatology.std('light')[day], selected.std())
+        self.assertAlmostEqual(climatology.baseline('light', days[:3]),
+                               climatology.mean('light')[doy[:3]].sum())
+        self.assertEqual(climatology.baseline('light', []), 0.0)
+
+    def test_streaming(self):
+        """the climatology doesn't depend on the chunks of the stream"""
+        rows = hourly_rows(40)
+        expected = build_station_climatology(RowsCursor(rows), 1, chunk_size=10 ** 6)
+        self.assertTrue(expected.counts['heat_stress'].sum() >= 39)
+        for chunk_size in (7, 50):
+            climatology = build_station_climatology(RowsCursor(rows), 1,
+                                                    chunk_size=chunk_size)
+            for name in ('cold_stress', 'heat_stress'):
+                self.assertEqual(climatology.counts[name].tolist(),
+                                 expected.counts[name].tolist())
+                np.testing.assert_allclose(climatology.sums[name],
+                                           expected.sums[name])
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'station_1.npz')
+            climatology = build_station_climatology(RowsCursor(hourly_rows(5)), 1,
+                                                    tub=28.0)
+            climatology.save(path)
+            loaded = Climatology.load(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.params, {'tub': 28.0, 'tlb': 8.0})
+        self.assertEqual(loaded.names, ['cold_stress', 'heat_stress'])
+        for name in loaded.names:
+            self.assertEqual(loaded.sums[name].tolist(),
+                             climatology.sums[name].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""
+tests of climax.culture_matrix against the per-culture calculation in
+climax.climate_data, on synthetic culture data
+"""
+
+import datetime
+import unittest
+
+import numpy as np
+
+from climax.climate_data import (CultureData, culture_climate_data,
+                                 generate_daterange, get_degree_hours,
+                                 SHELTER_CULTURES, UNSPLIT_CULTURES)
+from climax.culture_matrix import CultureMatrix
+from climax.series import (ClimateSeries, CLIMATE_COLUMNS, LIGHT_COLUMNS,
+                           PRECIPITATION_COLUMNS, IRRIGATION_COLUMNS)
+
+# a culture with both treatments, a culture with only the control treatment
+# irrigated and a culture without irrigation
+SPLIT_CULTURE, CONTROL_ONLY_CULTURE, DRY_CULTURE = 1001, 1002, 1003
+
+CULTURE_IRRIGATION = {SHELTER_CULTURES[0]: (169, 170),
+                      UNSPLIT_CULTURES[0]: (169, 170),
+                      SPLIT_CULTURE: (169, 170),
+                      CONTROL_ONLY_CULTURE: (169,),
+                      DRY_CULTURE: ()}
+
+
+def to_hours(day):
+    """converts a datetime.date into hours since 1970-01-01 00:00"""
+    return np.datetime64(day, 'D').astype('datetime64[h]').astype(np.int64)
+
+
+def synthetic_culture(culture_id, planted, num_days, treatments, seed):
+    """
+    creates the data of a culture with random weather, precipitation and
+    irrigation (of the given treatment IDs) during its trial
+    """
+    rng = np.random.RandomState(seed)
+    first_day = planted + datetime.timedelta(days=14)
+    trial_dates = list(generate_daterange(
+        first_day, first_day + datetime.timedelta(days=num_days - 1)))
+    hours = np.arange(to_hours(trial_dates[0]), to_hours(trial_dates[-1]))
+    hours = hours[rng.uniform(size=len(hours)) < 0.97]  # missing hours
+
+    def with_gaps(values, fraction):
+        return np.where(rng.uniform(size=len(values)) < fraction, np.nan,
+                        values)
+
+    temperature = with_gaps(np.round(rng.uniform(-4, 36, len(hours)), 1), 0.03)
+    temperature[rng.uniform(size=len(hours)) < 0.01] = 0.0
+    climate = ClimateSeries(hours, CLIMATE_COLUMNS, [
+        temperature,
+        with_gaps(np.round(rng.uniform(0, 8, len(hours)), 1), 0.05),
+        with_gaps(rng.randint(20, 100, len(hours)).astype(float), 0.04)])
+
+    light_hours = np.arange(to_hours(trial_dates[0]), to_hours(trial_dates[-1]))
+    hour_of_day = light_hours % 24
+    radiation = np.where((hour_of_day >= 5) & (hour_of_day <= 19),
+                         rng.uniform(0, 900, len(light_hours)), 0.0)
+    light = ClimateSeries(light_hours, LIGHT_COLUMNS, [with_gaps(radiation, 0.01)])
+
+    days = np.arange(to_hours(planted) // 24, to_hours(trial_dates[-1]) // 24 + 3)
+    rain_days = days[rng.uniform(size=len(days)) < 0.4]
+    precipitation = ClimateSeries(rain_days * 24, PRECIPITATION_COLUMNS,
+                                  [np.round(rng.uniform(0, 15, len(rain_days)), 1)])
+
+    irrigation_rows = []
+    for day in days[rng.uniform(size=len(days)) < 0.25]:
+        for treatment_id in treatments:
+            irrigation_rows.append((day * 24, rng.uniform(0, 10), treatment_id))
+        if treatments and rng.uniform() < 0.2:  # a second row on the day
+            irrigation_rows.append((day * 24, rng.uniform(0, 10), treatments[0]))
+    irrigation = ClimateSeries(
+        [row[0] for row in irrigation_rows], IRRIGATION_COLUMNS,
+        [np.array([row[1] for row in irrigation_rows], dtype=float),
+         np.array([row[2] for row in irrigation_rows], dtype=float)])
+    return CultureData(culture_id, trial_dates, precipitation, irrigation,
+                       climate, light)
+
+
+def synthetic_cultures():
+    """returns the data of one synthetic culture per kind of culture"""
+    return [synthetic_culture(culture_id, datetime.date(2012, 3, 20 + i),
+                              90 + 17 * i, treatments, seed=i)
+            for i, (culture_id, treatments)
+            in enumerate(sorted(CULTURE_IRRIGATION.items()))]
+
+
+class CultureMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.cultures = synthetic_cultures()
+        self.matrix = CultureMatrix(self.cultures, degree_hours=True)
+
+    def assert_nearly_equal(self, expected, actual):
+        """compares nested tuples, whose floats may differ by rounding"""
+        if isinstance(expected, (tuple, list)):
+            self.assertEqual(len(expected), len(actual))
+            for expected_item, actual_item in zip(expected, actual):
+                self.assert_nearly_equal(expected_item, actual_item)
+        elif isinstance(expected, float) or isinstance(actual, float):
+            self.assertAlmostEqual(expected, actual, places=6)
+        else:
+            self.assertEqual(expected, actual)
+
+    def test_climate_data(self):
+        for floweringDate in ('2012-04-01', '2012-06-01', '2012-12-01'):
+            for soilVolume in (20, 42):
+                results = self.matrix.climate_data(
+                    [floweringDate] * len(self.cultures),
+                    [soilVolume] * len(self.cultures))
+                for culture, result in zip(self.cultures, results):
+                    expected = culture_climate_data(culture, floweringDate,
+                                                    soilVolume)
+                    self.assert_nearly_equal(expected, result)
+
+    def test_kinds_of_cultures(self):
+        results = dict(zip(self.matrix.culture_ids.tolist(),
+                           self.matrix.climate_data(
+                               ['2012-06-01'] * len(self.cultures),
+                               [42] * len(self.cultures))))
+        for culture_id, treatments in CULTURE_IRRIGATION.items():
+            has_irrigation, _, drought_days, _ = results[culture_id]
+            self.assertEqual(has_irrigation, bool(treatments))
+            # control and stress days, iff the culture has a treatment split
+            split = bool(treatments) and culture_id not in UNSPLIT_CULTURES
+            self.assertEqual(isinstance(drought_days[0], tuple), split)
+
+    def test_select_rows(self):
+        rows = [4, 0, 0, 2]
+        dates = ['2012-06-01', '2012-05-01', '2012-07-01', '2012-06-01']
+        volumes = [42, 20, 30, 42]
+        results = self.matrix.select_rows(rows).climate_data(dates, volumes)
+        for row, floweringDate, soilVolume, result in zip(rows, dates, volumes,
+                                                          results):
+            expected = culture_climate_data(self.cultures[row], floweringDate,
+                                            soilVolume)
+            self.assert_nearly_equal(expected, result)
+
+    def test_degree_hours(self):
+        results = self.matrix.degree_hours(['2012-06-01'] * len(self.cultures))
+        for culture, result in zip(self.cultures, results):
+            # (all synthetic hours lie within the trial)
+            expected = get_degree_hours(culture.climate_data,
+                                        flowerDate='2012-06-01')
+            self.assert_nearly_equal(expected, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""tests of climax.day_index against plain sums"""
+
+import unittest
+
+import numpy as np
+
+from climax.climate_data import (culture_climate_data,
+                                 culture_climate_data_for_dates)
+from climax.day_index import DayIndex
+
+from test_culture_matrix import synthetic_cultures
+
+FIRST_DAY = 15500  # 2012-06-09
+
+
+def flatten(result):
+    """returns the numbers of a nested climate data tuple as a list"""
+    if isinstance(result, (tuple, list)):
+        return [number for item in result for number in flatten(item)]
+    return [result]
+
+
+class DayIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        self.days = np.sort(rng.choice(np.arange(FIRST_DAY, FIRST_DAY + 60),
+                                       40, replace=False))
+        self.values = rng.uniform(0, 10, 40)
+        self.index = DayIndex(FIRST_DAY, FIRST_DAY + 59)
+        self.index.add('light', self.days, self.values)
+
+    def test_interval(self):
+        for start in range(FIRST_DAY - 3, FIRST_DAY + 63, 5):
+            for end in range(start, FIRST_DAY + 65, 7):
+                expected = self.values[(self.days >= start) &
+                                       (self.days < end)].sum()
+                self.assertAlmostEqual(
+                    self.index.interval('light', start, end), expected)
+
+    def test_split(self):
+        dates = ['2012-06-01', '2012-06-09', '2012-07-01', '2012-09-01']
+        before, after = self.index.split('light', dates)
+        for date, total_before, total_after in zip(dates, before, after):
+            day = int(np.datetime64(date, 'D').astype(np.int64))
+            self.assertAlmostEqual(total_before,
+                                   self.values[self.days < day].sum())
+            self.assertAlmostEqual(total_after,
+                                   self.values[self.days >= day].sum())
+        self.assertAlmostEqual(self.index.total('light'), self.values.sum())
+
+    def test_add(self):
+        self.assertEqual(self.index.names, ['light'])
+        self.assertTrue('light' in self.index)
+        self.index.add('flags', [FIRST_DAY, FIRST_DAY + 2], [True, True])
+        self.assertEqual(self.index.before('flags', [FIRST_DAY + 3]).tolist(), [2])
+        self.assertRaises(AssertionError, self.index.add, 'late',
+                          [FIRST_DAY + 60], [1.0])
+        self.assertRaises(AssertionError, DayIndex, FIRST_DAY, FIRST_DAY - 1)
+
+    def test_culture_climate_data_for_dates(self):
+        dates = ['2012-04-01', '2012-05-20', '2012-06-01', '2012-12-01']
+        for culture in synthetic_cultures():
+            results = culture_climate_data_for_dates(culture, dates, 42)
+            for date, result in zip(dates, results):
+                expected = culture_climate_data(culture, date, 42)
+                self.assertEqual(len(flatten(expected)), len(flatten(result)))
+                np.testing.assert_allclose(flatten(expected), flatten(result),
+                                           atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
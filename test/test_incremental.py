@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""tests of climax.incremental (with a stub cursor instead of a database)"""
+
+import os
+import shutil
+import tempfile
+import datetime
+import unittest
+
+from climax.incremental import (IncrementalState, source_fingerprints,
+                                source_keys, STATION_TABLES)
+from climax.output import RESULT_COLUMNS, RUN_COLUMNS
+
+
+def kind_of(query):
+    """returns the kind of source, whose fingerprints a query calculates"""
+    for station_data, table in STATION_TABLES.items():
+        if table in query:
+            return station_data
+    for kind, table in (('irrigation', 'irrigation I'),
+                        ('precipitation', 'precipitation P'),
+                        ('solar', 'solarCalc_hourlySolarRadiation')):
+        if table in query:
+            return kind
+    return 'culture'
+
+
+class StateCursor(object):
+    """returns the fingerprint rows of the given sources"""
+    def __init__(self, sources):
+        self.sources = sources  # maps from a kind to {culture ID: row}
+        self.queries = 0
+
+    def execute(self, query, params):
+        self.queries += 1
+        culture_ids = params.values()
+        rows = self.sources.get(kind_of(query), {})
+        self.rows = [(culture_id,) + rows[culture_id]
+                     for culture_id in sorted(culture_ids) if culture_id in rows]
+
+    def fetchall(self):
+        return self.rows
+
+
+def sources():
+    """the sources of the cultures 1 (irrigated) and 2 at the same location"""
+    planted, terminated = datetime.date(2012, 4, 1), datetime.date(2012, 9, 1)
+    return {'culture': {1: (planted, terminated), 2: (planted, terminated)},
+            'irrigation': {1: (10, 1234)},
+            'precipitation': {1: (90, 55), 2: (90, 55)},
+            'solar': {1: (3000, 77), 2: (3000, 77)},
+            'TAHV': {1: (3000, 99), 2: (3000, 99)}}
+
+
+def result(culture_id):
+    return [culture_id] + [1] * (len(RESULT_COLUMNS) - 1)
+
+
+LINES = [(1, '1\t2012-07-01\t42\n', 1), (2, '2\t2012-07-01\t42\n', 2),
+         (3, '1\t2012-07-15\t42\n', 1), (4, 'garbage\n', None)]
+
+
+class IncrementalStateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, sources, columns=RESULT_COLUMNS):
+        """selects the lines to recompute and records their results"""
+        state = IncrementalState(self.path, columns)
+        stale, cached = state.select_lines(StateCursor(sources), LINES)
+        for _, line in stale:
+            culture_id = int(line.split('\t')[0]) if '\t' in line else None
+            state.record(line, None if culture_id is None else
+                         result(culture_id) + [0] * (len(columns) -
+                                                    len(RESULT_COLUMNS)))
+        state.save()
+        return [number for number, _ in stale], [number for number, _, _ in cached]
+
+    def test_fingerprints(self):
+        fingerprints = source_fingerprints(StateCursor(sources()), [1, 2])
+        self.assertEqual(fingerprints['irrigation:1'], '10/1234')
+        self.assertEqual(fingerprints['culture:2'], '2012-04-01/2012-09-01')
+        self.assertFalse('irrigation:2' in fingerprints)
+        self.assertFalse('FFHM:1' in fingerprints)
+        self.assertTrue(set(fingerprints) <= set(source_keys(1) + source_keys(2)))
+        self.assertEqual(source_fingerprints(StateCursor(sources()), []), {})
+
+    def test_unchanged(self):
+        self.assertEqual(self.run_batch(sources()), ([1, 2, 3, 4], []))
+        self.assertEqual(self.run_batch(sources()), ([4], [1, 2, 3]))
+
+    def test_changed_sources(self):
+        self.run_batch(sources())
+        changed = sources()
+        changed['irrigation'][1] = (11, 4321)
+        self.assertEqual(self.run_batch(changed), ([1, 3, 4], [2]))
+        self.assertEqual(self.run_batch(changed), ([4], [1, 2, 3]))
+        # a source without any rows during the trial
+        del changed['TAHV'][2]
+        self.assertEqual(self.run_batch(changed), ([2, 4], [1, 3]))
+
+    def test_cached_results(self):
+        self.run_batch(sources())
+        state = IncrementalState(self.path)
+        _, cached = state.select_lines(StateCursor(sources()), LINES)
+        self.assertEqual([(number, tuple(cached_result)) for number, _, cached_result
+                          in cached],
+                         [(1, tuple(result(1))), (2, tuple(result(2))),
+                          (3, tuple(result(1)))])
+        self.assertEqual(cached[0][2]._fields, RESULT_COLUMNS)
+
+    def test_other_columns(self):
+        self.run_batch(sources())
+        columns = RESULT_COLUMNS + RUN_COLUMNS
+        self.assertEqual(self.run_batch(sources(), columns), ([1, 2, 3, 4], []))
+        self.assertEqual(self.run_batch(sources(), columns), ([4], [1, 2, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""tests of climax.index_advisor"""
+
+import re
+import datetime
+import unittest
+
+from climax import index_advisor, queries
+from climax.index_advisor import (QUERIES, EXCLUDED_QUERIES, INDEXES,
+                                  sample_parameters, query_parameters,
+                                  missing_indexes, migration, time_queries,
+                                  is_read_only, bind)
+
+PLANTED = datetime.date(2012, 4, 1)
+TERMINATED = datetime.date(2012, 8, 15)
+
+
+class AdvisorCursor(object):
+    """
+    a cursor, which answers the queries of sample_parameters() and
+    existing_indexes() and records all executed queries
+    """
+    def __init__(self, indexes=(), station_data=('FFHM', 'TAHV', 'UUHV')):
+        self.indexes = list(indexes)
+        self.station_data = station_data
+        self.executed = []
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+        if query.startswith('SELECT C.id, C.location_id'):
+            self.rows = [(params['CULTURE_IDS_0'], 7, data, 100 + i)
+                         for i, data in enumerate(self.station_data)]
+        elif query.startswith('SELECT C.id, C.planted'):
+            self.rows = [(params['CULTURE_IDS_0'], PLANTED, TERMINATED)]
+        elif query == index_advisor.EXISTING_INDEXES_QUERY:
+            self.rows = self.indexes
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+class QueriesTest(unittest.TestCase):
+    def test_all_queries(self):
+        names = set(name.split('[')[0] for name, _, _ in QUERIES)
+        expected = set(name for name in dir(queries) if name.endswith('_QUERY'))
+        self.assertEqual(names, expected - set(EXCLUDED_QUERIES))
+        self.assertIn('STATION_WINDOW_QUERY[UUHV]', [name for name, _, _ in QUERIES])
+        for name, query, _ in QUERIES:
+            self.assertNotIn('{', query, name)
+
+    def test_parameters(self):
+        sample = sample_parameters(AdvisorCursor(), 56878)
+        self.assertEqual(sample[0]['START'], datetime.date(2012, 4, 15))
+        self.assertEqual(sample[0]['LOCATION_IDS'], [7])
+        self.assertEqual(sample[1], {'FFHM': 100, 'TAHV': 101, 'UUHV': 102})
+        for name, query, station_data in QUERIES:
+            params = query_parameters(name, station_data, sample)
+            if isinstance(params, dict):
+                for parameter in re.findall(r'%\((\w+)\)s', query):
+                    self.assertIn(parameter, params, name)
+                if station_data is not None:
+                    self.assertEqual(params['STATION_ID'],
+                                     sample[1][station_data])
+            else:
+                self.assertEqual(len(params), query.count('%s'), name)
+
+    def test_missing_station(self):
+        sample = sample_parameters(AdvisorCursor(station_data=('FFHM',)), 1)
+        self.assertIsNone(query_parameters('STATION_WINDOW_QUERY[TAHV]',
+                                           'TAHV', sample))
+        self.assertRaises(ValueError, sample_parameters,
+                          AdvisorCursor(station_data=()), 1)
+
+    def test_time_queries(self):
+        cursor = AdvisorCursor()
+        samples = [sample_parameters(cursor, culture_id)
+                   for culture_id in (56878, 44443)]
+        del cursor.executed[:]
+        timings = time_queries(cursor, samples)
+        self.assertNotIn('UPSERT_RESULT_QUERY', timings)
+        self.assertEqual(len(timings),
+                         sum(1 for _, query, _ in QUERIES if is_read_only(query)))
+        # each query is run once per culture to warm up, then timed
+        executed = [query for query, _ in cursor.executed]
+        for name, query, station_data in QUERIES:
+            query, _ = bind(query, query_parameters(name, station_data,
+                                                    samples[0]))
+            self.assertEqual(executed.count(query),
+                             4 if is_read_only(query) else 0, name)
+
+
+class MigrationTest(unittest.TestCase):
+    def test_migration(self):
+        cursor = AdvisorCursor([
+            # an index of the same name with other columns
+            ('dwd_hourlyMeanWindspeed_FFHM', 'climax_station_datum',
+             'station_id,datum'),
+            # an index covering the columns
+            ('dwd_hourlyAirTemperature_TAHV', 'station',
+             'station_id,datum,invalid,amount,quality')])
+        missing = missing_indexes(cursor)
+        self.assertEqual(len(missing), len(INDEXES) - 1)
+        statements = migration(missing)
+        self.assertEqual(
+            statements[0],
+            'ALTER TABLE dwd_hourlyMeanWindspeed_FFHM DROP INDEX '
+            'climax_station_datum, ADD INDEX climax_station_datum '
+            '(station_id, datum, invalid, amount);')
+        self.assertFalse(any('TAHV' in statement for statement in statements))
+        self.assertEqual(
+            statements[1],
+            'ALTER TABLE dwd_hourlyRelHumidity_UUHV ADD INDEX '
+            'climax_station_datum (station_id, datum, invalid, amount);')
+
+
+if __name__ == '__main__':
+    unittest.main()
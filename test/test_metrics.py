@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""tests of climax.metrics and the degree hours of climax.climate_data"""
+
+import datetime
+import unittest
+
+from climax.metrics import compute_metrics
+from climax.climate_data import get_degree_hours
+
+
+def hourly_rows(day, temperatures):
+    """returns (datetime, temperature, windspeed, humidity) rows of a day"""
+    start = datetime.datetime.combine(day, datetime.time())
+    return [(start + datetime.timedelta(hours=hour), temperature, 2.0, 60.0)
+            for hour, temperature in enumerate(temperatures)]
+
+
+class DegreeHoursTest(unittest.TestCase):
+    def setUp(self):
+        self.day = datetime.date(2012, 6, 1)
+        self.rows = hourly_rows(self.day, [-1.0, 0.0, 0.0, 0.0, 1.0, None])
+
+    def test_zero_degrees_are_measured(self):
+        results = compute_metrics({'climate': self.rows},
+                                  ['cold_hours', 'cold_degree_hours'],
+                                  tub=30.0, tlb=8.0)
+        self.assertEqual(results['cold_hours'][1].tolist(), [5.0])
+        self.assertEqual(results['cold_degree_hours'][1].tolist(), [40.0])
+
+    def test_get_degree_hours(self):
+        degree_hours = get_degree_hours(self.rows, flowerDate='2012-07-01')
+        self.assertEqual(degree_hours, (0, 0, 5, 0, 0.0, 0.0, 40.0, 0.0))
+        self.assertTrue(all(type(hours) is int for hours in degree_hours[:4]))
+
+    def test_heat_hours(self):
+        rows = hourly_rows(self.day, [29.0, 30.0, 31.0, 33.5, None])
+        results = compute_metrics({'climate': rows},
+                                  ['heat_hours', 'heat_degree_hours'],
+                                  tub=30.0, tlb=8.0)
+        self.assertEqual(results['heat_hours'][1].tolist(), [2.0])
+        self.assertEqual(results['heat_degree_hours'][1].tolist(), [4.5])
+
+    def test_daily_minimum_ignores_zero(self):
+        # the daily temperature stress keeps treating 0.0 as missing
+        results = compute_metrics({'climate': hourly_rows(self.day, [0.0, 5.0])},
+                                  ['cold_stress'], tlb=8.0)
+        self.assertEqual(results['cold_stress'][1].tolist(), [3.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
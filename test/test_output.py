@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""tests of climax.output"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+from climax.climate_data import UNSPLIT_CULTURES
+from climax.login import ConnectionPool
+from climax.output import (DatabaseWriter, ClimateResult, ClimateRunResult,
+                           climate_result, format_result, get_writer,
+                           is_seekable, result_dtype, NULL_DAYS,
+                           RESULT_COLUMNS, RUN_COLUMNS, DEGREE_HOUR_COLUMNS)
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+SPLIT = (56878, (True, (1.5, 0.0, 2.0, 0.5), ((1, 2), (3, 4)), (100.0, 80.0)))
+UNSPLIT = (56878, (False, (1.5, 0.0, 2.0, 0.5), (5, 6), (100.0, 80.0)))
+RUNS = (2, None, None, 31.5, 1)
+DEGREE_HOURS = (3, 0, 12, 1, 5.5, 0.0, 20.25, 0.5)
+
+
+def result(culture_id):
+    """returns a ClimateResult of a culture without a treatment split"""
+    return ClimateResult(culture_id, 3, 4, None, None, None, None,
+                         1.5, 0.0, 2.0, 0.5, 100.0, 80.0)
+
+
+class ClimateResultTest(unittest.TestCase):
+    def test_treatment_split(self):
+        self.assertEqual(climate_result(SPLIT),
+                         ClimateResult(56878, None, None, 1, 2, 3, 4,
+                                       1.5, 0.0, 2.0, 0.5, 100.0, 80.0))
+        self.assertEqual(climate_result(UNSPLIT),
+                         ClimateResult(56878, 5, 6, None, None, None, None,
+                                       1.5, 0.0, 2.0, 0.5, 100.0, 80.0))
+        # irrigated cultures without a treatment split
+        unsplit = (UNSPLIT_CULTURES[0], (True,) + UNSPLIT[1][1:])
+        self.assertEqual(climate_result(unsplit)[1:3], (5, 6))
+
+    def test_extra_columns(self):
+        run_result = climate_result(SPLIT + (RUNS,))
+        self.assertTrue(isinstance(run_result, ClimateRunResult))
+        self.assertEqual(run_result[len(RESULT_COLUMNS):], RUNS)
+        columns = RESULT_COLUMNS + DEGREE_HOUR_COLUMNS
+        hours_result = climate_result(SPLIT + (DEGREE_HOURS,), columns)
+        self.assertEqual(hours_result._fields, columns)
+        self.assertEqual(hours_result.cold_hours_before, 12)
+
+    def test_format_result(self):
+        self.assertEqual(format_result(climate_result(UNSPLIT)),
+                         '56878\t5\t6\tNA\tNA\tNA\tNA\t1.5\t0.0\t2.0\t0.5'
+                         '\t100.0\t80.0\n')
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.columns = RESULT_COLUMNS + RUN_COLUMNS
+        self.results = [climate_result((culture_id,) + data[1:] + (RUNS,))
+                        for culture_id, data
+                        in enumerate([SPLIT, UNSPLIT] * 5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, output_format, **kwargs):
+        path = os.path.join(self.directory, 'results.' + output_format)
+        with open(path, 'wb') as output_file:
+            writer = get_writer(output_file, output_format, self.columns)
+            for key, value in kwargs.items():
+                setattr(writer, key, value)
+            for result in self.results:
+                writer.write(result)
+            writer.close()
+        return path
+
+    def test_tsv(self):
+        with open(self.write('tsv')) as tsv_file:
+            lines = tsv_file.readlines()
+        self.assertEqual(lines[0].split(), [name.replace('_', '-')
+                                            for name in self.columns])
+        self.assertEqual(lines[1:], [format_result(result)
+                                     for result in self.results])
+
+    def test_npy(self):
+        for batch_size in (1, 3, 100):
+            array = np.load(self.write('npy', batch_size=batch_size))
+            self.assertEqual(array.dtype, result_dtype(self.columns))
+            self.assertEqual(len(array), len(self.results))
+            for row, result in zip(array.tolist(), self.results):
+                self.assertEqual(row, tuple(NULL_DAYS if value is None else value
+                                            for value in result))
+
+    @unittest.skipIf(pyarrow is None, 'needs pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        table = pq.read_table(self.write('parquet', batch_size=3))
+        self.assertEqual(table.column_names, list(self.columns))
+        self.assertEqual(table.to_pydict()['control_drought_before'],
+                         [result.control_drought_before
+                          for result in self.results])
+
+    def test_is_seekable(self):
+        with open(os.path.join(self.directory, 'file'), 'wb') as output_file:
+            self.assertTrue(is_seekable(output_file))
+        read_end, write_end = os.pipe()
+        pipe = os.fdopen(write_end, 'wb')
+        try:
+            self.assertFalse(is_seekable(pipe))
+        finally:
+            pipe.close()
+            os.close(read_end)
+        self.assertTrue(is_seekable(StringIO()))
+
+    def test_unknown_format(self):
+        self.assertRaises(AssertionError, get_writer, StringIO(), 'xlsx')
+
+
+class TableConnection(object):
+    """a connection, which collects the committed rows of the results table"""
+    def __init__(self, table, fail_on):
+        self.table = table
+        self.fail_on = fail_on
+        self.pending = []
+
+    def cursor(self):
+        return TableCursor(self)
+
+    def commit(self):
+        self.table.extend(self.pending)
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+class TableCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        pass
+
+    def executemany(self, query, rows):
+        if any(row[1] in self.connection.fail_on for row in rows):
+            raise RuntimeError('duplicate key')
+        self.connection.pending.extend(rows)
+
+    def close(self):
+        pass
+
+
+class DatabaseWriterTest(unittest.TestCase):
+    def writer(self, fail_on=()):
+        self.table = []
+        self.pool = ConnectionPool(
+            size=1, connect=lambda: TableConnection(self.table, fail_on))
+        return DatabaseWriter(self.pool, 'run', batch_size=2)
+
+    def test_write(self):
+        writer = self.writer()
+        for culture_id in range(5):
+            writer.write(result(culture_id), '2012-07-01', 42.0)
+        writer.close()
+        self.assertEqual([row[1] for row in self.table], range(5))
+        self.assertEqual(self.table[0][:7],
+                         ('run', 0, '2012-07-01', 42.0, 3, 4, None))
+
+    def test_failed_insert(self):
+        writer = self.writer(fail_on=(2,))
+        try:
+            for culture_id in range(10):
+                writer.write(result(culture_id), '2012-07-01', 42.0)
+        except RuntimeError:
+            pass
+        # the error is raised by close() (again), the rows after the failed
+        # batch aren't inserted
+        self.assertRaises(RuntimeError, writer.close)
+        self.assertEqual([row[1] for row in self.table], [0, 1])
+        self.assertRaises(RuntimeError, writer.write, result(10),
+                          '2012-07-01', 42.0)
+        self.assertFalse(writer.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
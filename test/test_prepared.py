@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""tests of climax.prepared"""
+
+import unittest
+
+from climax import prepared
+from climax.prepared import (expand_list_parameters, to_prepared_statement,
+                             deallocate_statements, PreparedCursor)
+
+
+class RecordingConnection(object):
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return RecordingCursor(self.executed)
+
+
+class RecordingCursor(object):
+    """a cursor, which records the executed queries"""
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class ParametersTest(unittest.TestCase):
+    def test_expand_list_parameters(self):
+        query, params = expand_list_parameters(
+            'SELECT 1 WHERE id IN %(IDS)s AND day = %(DAY)s AND x IN %(X)s',
+            {'IDS': [3, 1, 2], 'DAY': '2012-07-01', 'X': (5,), 'UNUSED': 1})
+        self.assertEqual(query, 'SELECT 1 WHERE id IN (%(IDS_0)s, %(IDS_1)s, '
+                                '%(IDS_2)s) AND day = %(DAY)s AND x IN (%(X_0)s)')
+        self.assertEqual(params, {'IDS_0': 3, 'IDS_1': 1, 'IDS_2': 2,
+                                  'DAY': '2012-07-01', 'X_0': 5})
+
+    def test_empty_list(self):
+        self.assertRaises(AssertionError, expand_list_parameters,
+                          'SELECT 1 WHERE id IN %(IDS)s', {'IDS': []})
+
+    def test_to_prepared_statement(self):
+        statement, names = to_prepared_statement(
+            'SELECT a FROM t WHERE b = %(B)s AND c < %(C)s AND d > %(B)s;\n')
+        self.assertEqual(statement, 'SELECT a FROM t WHERE b = ? AND c < ? AND d > ?')
+        self.assertEqual(names, ['B', 'C', 'B'])
+
+
+class PreparedCursorTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = RecordingConnection()
+        self.cursor = PreparedCursor(self.connection.cursor(), self.connection)
+        self.executed = self.connection.executed
+
+    def test_execute(self):
+        query = 'SELECT a FROM t WHERE b = %(B)s AND c IN %(C)s'
+        self.cursor.execute(query, {'B': 7, 'C': [1, 2]})
+        self.cursor.execute(query, {'B': 8, 'C': [3, 4]})
+        self.assertEqual(self.executed[0], (
+            'PREPARE climax_0 FROM %(statement)s',
+            {'statement': 'SELECT a FROM t WHERE b = ? AND c IN (?, ?)'}))
+        self.assertEqual(self.executed[1][0],
+                         'SET @climax_b = %(B)s, @climax_c_0 = %(C_0)s, '
+                         '@climax_c_1 = %(C_1)s')
+        self.assertEqual(self.executed[2][0],
+                         'EXECUTE climax_0 USING @climax_b, @climax_c_0, @climax_c_1')
+        # the statement is only prepared once
+        self.assertEqual([q for q, _ in self.executed].count(
+            'PREPARE climax_0 FROM %(statement)s'), 1)
+        self.assertEqual(self.executed[3][1], {'B': 8, 'C_0': 3, 'C_1': 4})
+        self.assertEqual(self.cursor.fetchall(), [(1,)])
+
+    def test_without_parameters(self):
+        self.cursor.execute('SELECT 1')
+        self.assertEqual(self.executed, [('SELECT 1', None)])
+
+    def test_eviction_and_deallocation(self):
+        original = prepared.MAX_STATEMENTS
+        prepared.MAX_STATEMENTS = 2
+        try:
+            for column in ('a', 'b', 'a', 'c'):
+                self.cursor.execute('SELECT {} FROM t WHERE x = %(X)s'.format(column),
+                                    {'X': 1})
+        finally:
+            prepared.MAX_STATEMENTS = original
+        queries = [query for query, _ in self.executed
+                   if query.startswith(('PREPARE', 'DEALLOCATE'))]
+        # b is the least recently used statement, when c is prepared
+        self.assertEqual(queries, ['PREPARE climax_0 FROM %(statement)s',
+                                   'PREPARE climax_1 FROM %(statement)s',
+                                   'DEALLOCATE PREPARE climax_1',
+                                   'PREPARE climax_2 FROM %(statement)s'])
+        del self.executed[:]
+        deallocate_statements(self.connection)
+        self.assertEqual(sorted(query for query, _ in self.executed),
+                         ['DEALLOCATE PREPARE climax_0',
+                          'DEALLOCATE PREPARE climax_2'])
+        self.assertEqual(len(self.connection.climax_statements), 0)
+        deallocate_statements(RecordingConnection())  # nothing prepared
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""tests of climax.resample against the datetime module and plain loops"""
+
+import datetime
+import unittest
+from collections import defaultdict
+
+import numpy as np
+
+from climax.resample import (epoch_days, year_week, bucket_keys,
+                             grouped_stats, resample, STATISTICS)
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+class EpochDaysTest(unittest.TestCase):
+    def test_conversions(self):
+        day = (datetime.date(2012, 7, 1) - EPOCH).days
+        for timestamp in ('2012-07-01', datetime.date(2012, 7, 1),
+                          datetime.datetime(2012, 7, 1, 23, 59),
+                          np.datetime64('2012-07-01T13', 'h'), day):
+            self.assertEqual(int(epoch_days(timestamp)), day)
+
+    def test_hours(self):
+        hours = np.array([-25, -1, 0, 23, 24, 15522 * 24 + 13])
+        self.assertEqual(epoch_days(hours, unit='h').tolist(),
+                         [-2, -1, 0, 0, 1, 15522])
+        self.assertEqual(
+            epoch_days(hours, unit='h').tolist(),
+            epoch_days(hours.astype('datetime64[h]')).tolist())
+
+
+class BucketsTest(unittest.TestCase):
+    def setUp(self):
+        start = (datetime.date(2007, 12, 20) - EPOCH).days
+        self.days = np.arange(start, start + 2000)
+
+    def test_year_week(self):
+        years, weeks = year_week(self.days)
+        expected = [(EPOCH + datetime.timedelta(days=day)).strftime('%Y-%W')
+                    for day in self.days.tolist()]
+        self.assertEqual(['{}-{:0>2}'.format(year, week)
+                          for year, week in zip(years, weeks)], expected)
+
+    def test_week_buckets_of_hours(self):
+        hours = self.days * 24 + 17
+        self.assertEqual(bucket_keys(hours, 'week', unit='h').tolist(),
+                         bucket_keys(self.days, 'week').tolist())
+
+    def test_stage_buckets(self):
+        keys = bucket_keys(['2012-06-30', '2012-07-01', '2012-08-15',
+                            '2012-09-01'], by=['2012-07-01', '2012-09-01'])
+        self.assertEqual(keys.tolist(), [0, 1, 1, 2])
+
+    def test_unknown_bucket(self):
+        self.assertRaises(ValueError, bucket_keys, self.days, 'fortnight')
+
+
+class GroupedStatsTest(unittest.TestCase):
+    def test_against_loops(self):
+        rng = np.random.RandomState(3)
+        keys = rng.randint(0, 30, 500)
+        values = np.where(rng.uniform(size=500) < 0.1, np.nan,
+                          rng.uniform(-10, 30, 500))
+        buckets, stats = grouped_stats(keys, values)
+        grouped = defaultdict(list)
+        for key, value in zip(keys.tolist(), values.tolist()):
+            if value == value:
+                grouped[key].append(value)
+        self.assertEqual(buckets.tolist(), sorted(grouped))
+        for i, key in enumerate(buckets.tolist()):
+            bucket = grouped[key]
+            self.assertEqual(stats['count'][i], len(bucket))
+            self.assertAlmostEqual(stats['sum'][i], sum(bucket))
+            self.assertAlmostEqual(stats['mean'][i], sum(bucket) / len(bucket))
+            self.assertAlmostEqual(stats['median'][i], np.median(bucket))
+            self.assertEqual(stats['min'][i], min(bucket))
+            self.assertEqual(stats['max'][i], max(bucket))
+
+    def test_empty(self):
+        buckets, stats = grouped_stats([], [])
+        self.assertEqual(len(buckets), 0)
+        for name in STATISTICS:
+            self.assertEqual(len(stats[name]), 0)
+
+    def test_unknown_statistic(self):
+        self.assertRaises(ValueError, grouped_stats, [1], [1.0], ('mode',))
+
+    def test_resample_hours(self):
+        hours = np.arange(48) + 15522 * 24
+        days, stats = resample(hours, np.arange(48.0), how=('sum', 'max'),
+                               unit='h')
+        self.assertEqual(days.tolist(), [15522, 15523])
+        self.assertEqual(stats['sum'].tolist(), [sum(range(24)),
+                                                 sum(range(24, 48))])
+        self.assertEqual(stats['max'].tolist(), [23.0, 47.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""tests of climax.runs against straightforward loops"""
+
+import unittest
+
+import numpy as np
+
+from climax.runs import run_lengths, longest_run, count_runs, max_window_sum
+
+
+def runs_of(row):
+    """returns the lengths of the runs of True values of a row"""
+    runs, length = [], 0
+    for flag in row:
+        if flag:
+            length += 1
+        elif length:
+            runs.append(length)
+            length = 0
+    if length:
+        runs.append(length)
+    return runs
+
+
+class RunsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.flags = rng.uniform(size=(20, 60)) < 0.6
+        self.flags[0] = False
+        self.flags[1] = True
+        self.values = np.where(rng.uniform(size=(20, 60)) < 0.5,
+                               rng.uniform(0, 5, (20, 60)), 0.0)
+
+    def test_run_lengths(self):
+        self.assertEqual(
+            run_lengths(np.array([[True, True, False, True]])).tolist(),
+            [[1, 2, 0, 1]])
+        for row, lengths in zip(self.flags, run_lengths(self.flags)):
+            expected, length = [], 0
+            for flag in row:
+                length = length + 1 if flag else 0
+                expected.append(length)
+            self.assertEqual(lengths.tolist(), expected)
+
+    def test_longest_run(self):
+        self.assertEqual(longest_run(self.flags).tolist(),
+                         [max(runs_of(row) or [0]) for row in self.flags])
+        self.assertEqual(longest_run(np.zeros((2, 0), dtype=bool)).tolist(),
+                         [0, 0])
+
+    def test_count_runs(self):
+        for min_length in (1, 3, 7):
+            self.assertEqual(
+                count_runs(self.flags, min_length).tolist(),
+                [len([run for run in runs_of(row) if run >= min_length])
+                 for row in self.flags])
+
+    def test_max_window_sum(self):
+        for window in (1, 7, 100):
+            expected = [max(sum(row[start:start + window])
+                            for start in range(len(row)))
+                        for row in self.values.tolist()]
+            np.testing.assert_allclose(max_window_sum(self.values, window),
+                                       expected)
+        self.assertEqual(max_window_sum(np.zeros((2, 0)), 7).tolist(),
+                         [0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""tests of climax.schedule"""
+
+import itertools
+import unittest
+
+import numpy as np
+
+from climax import schedule
+from climax.schedule import DAY_COST, estimate_cost, estimate_costs, longest_first
+
+
+class CostCursor(object):
+    """a cursor, which returns TRIAL_COST_QUERY rows of known cultures"""
+    def __init__(self, rows):
+        self.rows = rows  # maps from a culture ID to its result row
+        self.queries = []
+
+    def execute(self, query, params):
+        culture_ids = [params[name] for name in sorted(params)]
+        self.queries.append(culture_ids)
+        self.results = [self.rows[culture_id] for culture_id in culture_ids
+                        if culture_id in self.rows]
+
+    def fetchall(self):
+        return self.results
+
+
+def makespan(costs, bins):
+    """returns the largest total cost of the bins"""
+    return max(sum(costs[item] for item in items) for items in bins)
+
+
+def optimal_makespan(costs, num_bins):
+    """finds the smallest makespan by trying all assignments"""
+    best = None
+    for assignment in itertools.product(range(num_bins), repeat=len(costs)):
+        totals = [0] * num_bins
+        for item, i in enumerate(assignment):
+            totals[i] += costs[item]
+        best = max(totals) if best is None else min(best, max(totals))
+    return best
+
+
+class LongestFirstTest(unittest.TestCase):
+    def test_assignment(self):
+        costs = [5, 1, 8, 3, 3, 9, 2]
+        bins = longest_first(costs, 3)
+        self.assertEqual(sorted(item for items in bins for item in items),
+                         range(len(costs)))
+        for items in bins:
+            self.assertEqual([costs[i] for i in items],
+                             sorted((costs[i] for i in items), reverse=True))
+
+    def test_makespan(self):
+        # longest-first is at most 4/3 - 1/(3 * bins) times the optimum
+        rng = np.random.RandomState(6)
+        for num_bins in (2, 3):
+            for _ in range(20):
+                costs = rng.randint(1, 100, 7).tolist()
+                bound = (4.0 / 3 - 1.0 / (3 * num_bins)) * \
+                    optimal_makespan(costs, num_bins)
+                self.assertTrue(
+                    makespan(costs, longest_first(costs, num_bins)) <= bound)
+
+    def test_empty_bins(self):
+        self.assertEqual(longest_first([4, 2], 5), [[0], [1]])
+        self.assertEqual(longest_first([], 3), [])
+
+
+class EstimateCostsTest(unittest.TestCase):
+    def test_costs(self):
+        cursor = CostCursor({1: (1, 100, 2000), 2: (2, None, None),
+                             3: (3, -5, 10)})
+        self.assertEqual(estimate_costs([3, 1, 2, 4, 1], cursor),
+                         {1: 100 * DAY_COST + 2000, 2: 0, 3: 10, 4: 0})
+        self.assertEqual(estimate_cost(1, cursor), 100 * DAY_COST + 2000)
+
+    def test_chunks(self):
+        cursor = CostCursor({culture_id: (culture_id, 1, 0)
+                             for culture_id in range(7)})
+        original = schedule.COST_QUERY_SIZE
+        schedule.COST_QUERY_SIZE = 3
+        try:
+            costs = estimate_costs(range(7), cursor)
+        finally:
+            schedule.COST_QUERY_SIZE = original
+        self.assertEqual(costs, dict.fromkeys(range(7), DAY_COST))
+        self.assertEqual([len(ids) for ids in cursor.queries], [3, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
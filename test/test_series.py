@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""tests of climax.series"""
+
+import datetime
+import unittest
+
+import numpy as np
+
+from climax.series import ClimateSeries, as_series, CLIMATE_COLUMNS
+
+ROWS = [(datetime.datetime(2012, 7, 1, 0), 12.5, 3.0, None),
+        (datetime.datetime(2012, 7, 1, 1), None, 2.5, 80.0),
+        (datetime.datetime(2012, 7, 1, 5), 11.0, None, 85.0),
+        (datetime.datetime(2012, 7, 2, 0), 0.0, 0.0, 0.0)]
+
+
+class ListCursor(object):
+    """a cursor, whose results are the given rows"""
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class ClimateSeriesTest(unittest.TestCase):
+    def test_round_trip(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS)
+        self.assertEqual(list(series), ROWS)
+        self.assertEqual(len(series), 4)
+        self.assertTrue(np.isnan(series['temperature'][1]))
+        self.assertEqual(series['humidity'][3], 0.0)
+
+    def test_hours_and_days(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS)
+        first_hour = (datetime.datetime(2012, 7, 1) -
+                      datetime.datetime(1970, 1, 1)).days * 24
+        self.assertEqual(series.hours.tolist(),
+                         [first_hour, first_hour + 1, first_hour + 5,
+                          first_hour + 24])
+        self.assertEqual(series.days.tolist(), [first_hour // 24] * 3 +
+                         [first_hour // 24 + 1])
+
+    def test_dates(self):
+        series = ClimateSeries.from_rows(
+            [(datetime.date(2012, 7, 1), 1.5)], ('amount',))
+        self.assertEqual(list(series),
+                         [(datetime.datetime(2012, 7, 1), 1.5)])
+
+    def test_from_cursor(self):
+        for chunk_size in (1, 3, 10):
+            series = ClimateSeries.from_cursor(ListCursor(ROWS), CLIMATE_COLUMNS,
+                                               chunk_size=chunk_size)
+            self.assertEqual(list(series), ROWS)
+        empty = ClimateSeries.from_cursor(ListCursor([]), CLIMATE_COLUMNS)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(empty.columns, CLIMATE_COLUMNS)
+
+    def test_dtypes(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS,
+                                         dtypes={'humidity': np.float32})
+        self.assertEqual(series['humidity'].dtype, np.float32)
+        self.assertEqual(series['temperature'].dtype, np.float64)
+        self.assertEqual(series.nbytes, 4 * 8 * 3 + 4 * 4)
+
+    def test_select_and_window(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS)
+        self.assertEqual(list(series.select(np.array([True, False, True, False]))),
+                         [ROWS[0], ROWS[2]])
+        window = series.window(series.hours[1], series.hours[3])
+        self.assertEqual(list(window), ROWS[1:3])
+        # a window is a view of the series
+        self.assertTrue(np.may_share_memory(window['humidity'],
+                                            series['humidity']))
+        self.assertEqual(len(series.window(0, 1)), 0)
+
+    def test_concatenate(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS)
+        parts = [series.window(series.hours[0], series.hours[2]),
+                 series.window(series.hours[2], series.hours[3] + 1)]
+        self.assertEqual(list(ClimateSeries.concatenate(parts)), ROWS)
+
+    def test_as_series(self):
+        series = ClimateSeries.from_rows(ROWS, CLIMATE_COLUMNS)
+        self.assertTrue(as_series(series, CLIMATE_COLUMNS) is series)
+        self.assertEqual(list(as_series(ROWS, CLIMATE_COLUMNS)), ROWS)
+
+    def test_column_lengths(self):
+        self.assertRaises(AssertionError, ClimateSeries, [1, 2], ('amount',),
+                          [np.zeros(3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
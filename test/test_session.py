@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""tests of climax.session (with fake database connections)"""
+
+import sys
+import pickle
+import threading
+import unittest
+from StringIO import StringIO
+
+from climax import session as session_module
+from climax.login import ConnectionPool
+from climax.session import ClimateSession
+
+
+class FakeConnection(object):
+    """a database connection, which may fail to be closed"""
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.closed = False
+        self.climax_statements = {}
+
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        self.closed = True
+        if self.fail:
+            raise RuntimeError('connection lost')
+
+
+class FakeCursor(object):
+    def execute(self, query, parameters=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSession(ClimateSession):
+    """a session, whose connections are FakeConnections"""
+    def __init__(self, *args, **kwargs):
+        super(FakeSession, self).__init__(*args, **kwargs)
+        self.opened = []
+        self.failing = set()
+
+    def connect(self):
+        connection = FakeConnection(fail=len(self.opened) in self.failing)
+        self.opened.append(connection)
+        return connection
+
+
+class SessionTest(unittest.TestCase):
+    def test_cursor_per_thread(self):
+        session = FakeSession()
+        cursor = session.cursor()
+        self.assertTrue(session.cursor() is cursor)
+        cursors = []
+        thread = threading.Thread(target=lambda: cursors.append(session.cursor()))
+        thread.start()
+        thread.join()
+        self.assertFalse(cursors[0] is cursor)
+        self.assertEqual(len(session.opened), 2)
+
+    def test_close(self):
+        session = FakeSession()
+        session.cursor()
+        session.close()
+        self.assertTrue(all(c.closed for c in session.opened))
+        # a closed session opens a new connection when it's used again
+        session.cursor()
+        self.assertEqual(len(session.opened), 2)
+
+    def test_close_failing_connection(self):
+        session = FakeSession()
+        session.failing = {0}
+        for _ in range(3):
+            thread = threading.Thread(target=session.cursor)
+            thread.start()
+            thread.join()
+        pool = session.pool
+        with pool.connection():
+            pass
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertRaises(RuntimeError, session.close)
+            self.assertTrue('connection lost' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+        # the other connections and the pool are closed all the same
+        self.assertTrue(all(c.closed for c in session.opened))
+        self.assertEqual(pool.opened, 0)
+
+    def test_pool_close(self):
+        connections = [FakeConnection(fail=True), FakeConnection()]
+        pool = ConnectionPool(size=2, connect=lambda: connections.pop())
+        closed = list(connections)
+        with pool.connection():
+            with pool.connection():
+                pass
+        self.assertRaises(RuntimeError, pool.close)
+        self.assertTrue(all(c.closed for c in closed))
+        self.assertEqual(pool.opened, 0)
+
+    def test_pickle(self):
+        session = FakeSession(tub=32.0, cache_size=5)
+        session.cursor()
+        session.station_index = 'index'
+        copy = pickle.loads(pickle.dumps(session, 2))
+        self.assertEqual((copy.tub, copy.cache_size, copy.station_index),
+                         (32.0, 5, 'index'))
+        self.assertEqual(copy._connections, [])
+        self.assertEqual(len(copy._cache), 0)
+
+    def test_cache(self):
+        fetched = []
+
+        def fetch(culture_id, cursor):
+            fetched.append(culture_id)
+            return culture_id
+
+        original = session_module.fetch_culture_data
+        session_module.fetch_culture_data = fetch
+        try:
+            session = FakeSession(cache_size=2)
+            for culture_id in (1, 2, 1, 3, 1, 2):
+                self.assertEqual(session.fetch_culture(culture_id), culture_id)
+            # 2 was the least recently used culture, when 3 was fetched
+            self.assertEqual(fetched, [1, 2, 3, 2])
+
+            uncached = FakeSession(cache_size=0)
+            uncached.fetch_culture(1)
+            uncached.fetch_culture(1)
+            self.assertEqual(fetched, [1, 2, 3, 2, 1, 1])
+        finally:
+            session_module.fetch_culture_data = original
+
+
+if __name__ == '__main__':
+    unittest.main()
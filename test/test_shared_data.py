@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""tests of climax.shared_data"""
+
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from climax.climate_data import fetch_culture_data, fetch_climate
+from climax.series import ClimateSeries, CLIMATE_COLUMNS
+from climax.shared_data import (SharedSeriesWriter, SharedWeatherData,
+                                join_climate, to_hours)
+from climax.stations import COLUMN_STATIONS
+from climax.queries import (TRIAL_DATES_QUERY, PREC_QUERY, IRRI_QUERY,
+                            FAST_CLIMATE_QUERY, DAYLIGHT_QUERY,
+                            CULTURE_SOURCES_QUERY, CULTURE_STATE_QUERY,
+                            STATION_WINDOW_QUERY, LOCATION_SOLAR_WINDOW_QUERY)
+
+FIRST_HOUR = datetime.datetime(2012, 3, 1)
+HOURS = 24 * 120
+
+# culture ID -> (location ID, planted, terminated)
+CULTURES = {10: (1, datetime.date(2012, 3, 20), datetime.date(2012, 5, 1)),
+            11: (1, datetime.date(2012, 4, 10), datetime.date(2012, 6, 1)),
+            20: (2, datetime.date(2012, 4, 1), datetime.date(2012, 5, 15)),
+            30: (3, datetime.date(2012, 4, 1), datetime.date(2012, 5, 15))}
+
+# (location ID, station data, station ID): location 2 shares the windspeed
+# station of location 1 and has no humidity station, location 3 has two
+# temperature stations (i.e. isn't shared)
+WEATHER_STATIONS = [(1, 'FFHM', 100), (1, 'TAHV', 101), (1, 'UUHV', 102),
+                    (2, 'FFHM', 100), (2, 'TAHV', 201),
+                    (3, 'FFHM', 100), (3, 'TAHV', 101), (3, 'TAHV', 201)]
+
+
+def station_rows(random, missing):
+    """
+    returns hourly (datetime, amount, invalid) rows, where a fraction of
+    the hours is missing, invalid or NULL
+    """
+    rows = []
+    for hour in range(HOURS):
+        if random.rand() < missing:
+            continue
+        amount = None if random.rand() < 0.02 else round(random.rand() * 30, 1)
+        invalid = 1 if random.rand() < 0.02 else None
+        rows.append((FIRST_HOUR + datetime.timedelta(hours=hour),
+                     amount, invalid))
+    return rows
+
+
+def in_window(rows, start, end):
+    """returns the valid (datetime, amount) rows in [start, end)"""
+    return [(datum, amount) for datum, amount, invalid in rows
+            if start <= datum < end and invalid is None]
+
+
+def to_datetime(day):
+    return datetime.datetime(day.year, day.month, day.day)
+
+
+class WeatherCursor(object):
+    """
+    a cursor on synthetic culture, weather station and solar data, which
+    answers the queries of climate_data.fetch_culture_data() and
+    SharedWeatherData.build() (the per-culture queries like the database,
+    i.e. independently of shared_data)
+    """
+    def __init__(self, seed=0):
+        random = np.random.RandomState(seed)
+        self.station_rows = {}
+        for _, station_data, station_id in WEATHER_STATIONS:
+            table = self.tables[station_data]
+            if (table, station_id) not in self.station_rows:
+                # the temperature and humidity stations miss more hours
+                missing = 0.02 if station_data == 'FFHM' else 0.1
+                self.station_rows[table, station_id] = station_rows(random,
+                                                                    missing)
+        self.solar_rows = {location_id: station_rows(random, 0.05)
+                           for location_id in (1, 2, 3)}
+        self.results = []
+        self.queries = []
+
+    tables = {station_data: table
+              for station_data, table in COLUMN_STATIONS.values()}
+
+    def culture_rows(self, culture_id, station_data):
+        """the valid rows of the culture's stations within its trial"""
+        location_id, planted, terminated = CULTURES[culture_id]
+        start = to_datetime(planted + datetime.timedelta(days=14))
+        rows = []
+        for location, data, station_id in WEATHER_STATIONS:
+            if location == location_id and data == station_data:
+                rows.extend(in_window(
+                    self.station_rows[self.tables[data], station_id],
+                    start, to_datetime(terminated)))
+        return sorted(rows)
+
+    def fast_climate(self, culture_id):
+        """the rows of FAST_CLIMATE_QUERY (temperature by wind hour,
+        humidity by temperature hour)"""
+        temperature = self.culture_rows(culture_id, 'TAHV')
+        humidity = self.culture_rows(culture_id, 'UUHV')
+        rows = []
+        for datum, windspeed in self.culture_rows(culture_id, 'FFHM'):
+            temperatures = [row for row in temperature if row[0] == datum]
+            for date2, amount in temperatures or [(None, None)]:
+                humidities = [row[1] for row in humidity
+                              if date2 is not None and row[0] == date2]
+                for relative_humidity in humidities or [None]:
+                    rows.append((datum, amount, windspeed, relative_humidity))
+        return rows
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if query == TRIAL_DATES_QUERY:
+            _, planted, terminated = CULTURES[params['CULTURE_ID']]
+            self.results = [(planted + datetime.timedelta(days=14), terminated)]
+        elif query == PREC_QUERY:
+            location_id = CULTURES[params['CULTURE_ID']][0]
+            self.results = [(datetime.date(2012, 4, day), float(location_id))
+                            for day in range(1, 30)]
+        elif query == IRRI_QUERY:
+            self.results = [(datetime.date(2012, 4, 20), 5.0, 170)]
+        elif query == FAST_CLIMATE_QUERY:
+            self.results = self.fast_climate(params['CULTURE_ID'])
+        elif query == DAYLIGHT_QUERY:
+            location_id, planted, terminated = CULTURES[params['CULTURE_ID']]
+            self.results = in_window(
+                self.solar_rows[location_id],
+                to_datetime(planted + datetime.timedelta(days=14)),
+                to_datetime(terminated))
+        elif query == LOCATION_SOLAR_WINDOW_QUERY:
+            self.results = in_window(self.solar_rows[params['LOCATION_ID']],
+                                     params['START'], params['END'])
+        elif query.startswith(CULTURE_SOURCES_QUERY.split('%(')[0]):
+            culture_ids = [params[name] for name in sorted(params)]
+            self.results = [(culture_id, location_id, station_data, station_id)
+                            for culture_id in culture_ids
+                            for location_id, station_data, station_id
+                            in WEATHER_STATIONS
+                            if location_id == CULTURES[culture_id][0]]
+        elif query.startswith(CULTURE_STATE_QUERY.split('%(')[0]):
+            self.results = [(culture_id,) + CULTURES[culture_id][1:]
+                            for culture_id in params.values()]
+        else:
+            for table, station_id in self.station_rows:
+                if (query == STATION_WINDOW_QUERY.format(table=table) and
+                        params['STATION_ID'] == station_id):
+                    self.results = in_window(self.station_rows[table, station_id],
+                                             params['START'], params['END'])
+                    break
+            else:
+                raise AssertionError('unexpected query: ' + query)
+
+    def fetchone(self):
+        return self.results.pop(0) if self.results else None
+
+    def fetchmany(self, size):
+        rows, self.results = self.results[:size], self.results[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.results = self.results, []
+        return rows
+
+
+class SharedWeatherDataTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameCulture(self, shared_culture, culture):
+        self.assertEqual(shared_culture.culture_id, culture.culture_id)
+        self.assertEqual(shared_culture.trial_dates, culture.trial_dates)
+        for field in ('precipitation', 'irrigation', 'climate_data',
+                      'light_data'):
+            self.assertEqual(list(getattr(shared_culture, field)),
+                             list(getattr(culture, field)), field)
+
+    def test_fetch_culture(self):
+        cursor = WeatherCursor()
+        shared = SharedWeatherData.build(cursor, list(CULTURES),
+                                         directory=self.directory)
+        try:
+            # location 3 has two temperature stations
+            self.assertEqual(sorted(shared.locations), [10, 11, 20])
+            self.assertNotIn(30, shared)
+            for culture_id in (10, 11, 20):
+                culture = fetch_culture_data(culture_id, cursor)
+                # hours without temperature or humidity are in the results
+                self.assertTrue(any(row[1] is None or row[3] is None
+                                    for row in culture.climate_data))
+                self.assertSameCulture(shared.fetch_culture(culture_id, cursor),
+                                       culture)
+        finally:
+            shared.close()
+        self.assertFalse(os.path.exists(shared.series.path))
+
+    def test_station_queries(self):
+        cursor = WeatherCursor()
+        shared = SharedWeatherData.build(cursor, list(CULTURES),
+                                         directory=self.directory)
+        shared.close()
+        # each station is fetched once, although it's used at several
+        # locations (the windspeed station 100 at all three)
+        station_queries = [query for query in cursor.queries
+                           if query.startswith('SELECT S.datum')]
+        self.assertEqual(len(station_queries), 4)
+
+    def test_join_climate(self):
+        cursor = WeatherCursor()
+        for culture_id in (10, 11, 20):
+            location_id, planted, terminated = CULTURES[culture_id]
+            columns = {}
+            for column in CLIMATE_COLUMNS:
+                station_data = COLUMN_STATIONS[column][0]
+                rows = cursor.culture_rows(culture_id, station_data)
+                if rows:
+                    columns[column] = ClimateSeries.from_rows(rows, ('amount',))
+            self.assertEqual(list(join_climate(columns)),
+                             list(fetch_climate(culture_id, cursor)))
+
+    def test_join_climate_missing_hours(self):
+        hours = [0, 1, 2, 3]
+        columns = {
+            'windspeed': ClimateSeries(hours, ('amount',), [np.arange(4.0)]),
+            'temperature': ClimateSeries([1, 2, 5], ('amount',),
+                                         [np.array([10.0, np.nan, 11.0])]),
+            'humidity': ClimateSeries([0, 2, 3], ('amount',),
+                                      [np.array([80.0, 81.0, 82.0])])}
+        climate = join_climate(columns)
+        self.assertEqual(climate.hours.tolist(), hours)
+        self.assertEqual(climate['windspeed'].tolist(), [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual([row[1] for row in climate], [None, 10.0, None, None])
+        # like FAST_CLIMATE_QUERY, the humidity is joined on the hours of
+        # the temperature rows
+        self.assertEqual([row[3] for row in climate], [None, None, 81.0, None])
+
+    def test_empty(self):
+        shared = SharedWeatherData.build(WeatherCursor(), [],
+                                         directory=self.directory)
+        self.assertNotIn(10, shared)
+        shared.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class SharedSeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'series')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        climate = ClimateSeries([5, 6, 8], CLIMATE_COLUMNS,
+                                [np.array([1.0, np.nan, 3.0]),
+                                 np.array([2.0, 2.5, 0.0]),
+                                 np.array([80.0, 81.0, np.nan])])
+        light = ClimateSeries([5, 7], ('radiation',), [np.array([0.5, 1.5])])
+        empty = ClimateSeries([], ('radiation',), [np.zeros(0)])
+        writer = SharedSeriesWriter(self.path)
+        writer.add('climate:1', climate)
+        writer.add('light:1', light)
+        writer.add('light:2', empty)
+        shared = writer.close()
+        # the workers get a pickled copy
+        shared = pickle.loads(pickle.dumps(shared, pickle.HIGHEST_PROTOCOL))
+        self.assertIsNone(shared._memmap)
+        self.assertIn('light:2', shared)
+        self.assertNotIn('climate:2', shared)
+        for name, series in (('climate:1', climate), ('light:1', light),
+                             ('light:2', empty)):
+            self.assertEqual(shared[name].columns, series.columns)
+            self.assertEqual(list(shared[name]), list(series))
+        self.assertIsInstance(shared['climate:1']['humidity'], np.memmap)
+        self.assertEqual(shared['climate:1'].window(6, 8).hours.tolist(), [6])
+
+    def test_empty_file(self):
+        shared = SharedSeriesWriter(self.path).close()
+        self.assertEqual(shared.layout, {})
+        self.assertTrue(os.path.getsize(self.path) > 0)
+        self.assertEqual(to_hours(datetime.date(1970, 1, 2)), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
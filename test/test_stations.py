@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""tests of the k-d tree and the gap filling in climax.stations"""
+
+import unittest
+
+import numpy as np
+
+from climax.stations import (KDTree, StationIndex, unit_vectors, chord_to_km,
+                             inverse_distance_fill)
+
+
+class KDTreeTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.points = unit_vectors(rng.uniform(47, 55, 300),
+                                   rng.uniform(6, 15, 300))
+        self.queries = unit_vectors(rng.uniform(46, 56, 50),
+                                    rng.uniform(5, 16, 50))
+
+    def test_query_matches_brute_force(self):
+        for leaf_size in (1, 4, 8, 500):
+            tree = KDTree(self.points, leaf_size=leaf_size)
+            for point in self.queries:
+                distances, indices = tree.query(point, k=5)
+                brute_force = np.sqrt(((self.points - point) ** 2).sum(axis=1))
+                expected = np.argsort(brute_force)[:5]
+                np.testing.assert_allclose(distances, brute_force[expected])
+                self.assertEqual(sorted(indices.tolist()),
+                                 sorted(expected.tolist()))
+
+    def test_fewer_points_than_k(self):
+        distances, indices = KDTree(self.points[:3]).query(self.queries[0], k=5)
+        self.assertEqual(sorted(indices.tolist()), [0, 1, 2])
+        self.assertEqual(len(distances), 3)
+
+    def test_empty_tree(self):
+        distances, indices = KDTree(np.zeros((0, 3))).query(self.queries[0], k=2)
+        self.assertEqual(len(distances), 0)
+        self.assertEqual(len(indices), 0)
+
+
+class StationIndexTest(unittest.TestCase):
+    def test_neighbours(self):
+        index = StationIndex([1, 2, 3, 4], [52.0, 52.1, 52.0, 48.0],
+                             [13.0, 13.0, 13.5, 11.0])
+        neighbours = index.neighbours(1, k=3, max_distance=50.0)
+        self.assertEqual([station for station, _ in neighbours], [2, 3])
+        # 0.1 degrees of latitude are about 11.1 km
+        self.assertAlmostEqual(neighbours[0][1], 11.12, places=1)
+        self.assertEqual(index.neighbours(99), [])
+
+    def test_chord_to_km(self):
+        self.assertAlmostEqual(chord_to_km(2.0), np.pi * 6371.0)
+
+
+class InverseDistanceFillTest(unittest.TestCase):
+    def test_fill(self):
+        filled = inverse_distance_fill(
+            np.array([1.0, np.nan, np.nan, np.nan]),
+            np.array([[10.0, 10.0, np.nan, 10.0],
+                      [20.0, 20.0, np.nan, np.nan]]), [1.0, 2.0])
+        # weights 1 and 1/4
+        self.assertEqual(filled[0], 1.0)
+        self.assertAlmostEqual(filled[1], (10.0 + 20.0 / 4) / 1.25)
+        self.assertTrue(np.isnan(filled[2]))
+        self.assertEqual(filled[3], 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""tests of climax.stress_grid against straightforward loops"""
+
+import unittest
+
+import numpy as np
+
+from climax.climate_data import get_temp_stress_days, get_temp_stress_grid
+from climax.stress_grid import sums_below, sums_above, temp_stress_grid
+
+from test_culture_matrix import synthetic_cultures
+
+
+class StressGridTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.values = np.round(rng.uniform(-5, 35, 200), 1)
+        # thresholds between, below, above and equal to the values
+        self.thresholds = np.concatenate(
+            (np.arange(-10.0, 40.0, 0.7), self.values[:10]))
+
+    def test_sums_below(self):
+        expected = [sum(threshold - value for value in self.values
+                        if value < threshold)
+                    for threshold in self.thresholds]
+        np.testing.assert_allclose(sums_below(self.values, self.thresholds),
+                                   expected, atol=1e-9)
+
+    def test_sums_above(self):
+        expected = [sum(value - threshold for value in self.values
+                        if value > threshold)
+                    for threshold in self.thresholds]
+        np.testing.assert_allclose(sums_above(self.values, self.thresholds),
+                                   expected, atol=1e-9)
+
+    def test_no_values(self):
+        self.assertEqual(sums_below([], [1.0, 2.0]).tolist(), [0.0, 0.0])
+        self.assertEqual(sums_above([], [1.0, 2.0]).tolist(), [0.0, 0.0])
+
+    def test_flowering_split(self):
+        days = np.arange(10)
+        tmin = np.arange(10, dtype=float)
+        tmax = tmin + 20
+        cold_before, cold_after, heat_before, heat_after = temp_stress_grid(
+            days, tmin, tmax, [25.0], [3.0], flowering_day=4)
+        self.assertEqual(cold_before.tolist(), [3.0 + 2.0 + 1.0])
+        self.assertEqual(cold_after.tolist(), [0.0])
+        self.assertEqual(heat_before.tolist(), [0.0])
+        self.assertEqual(heat_after.tolist(), [1.0 + 2.0 + 3.0 + 4.0])
+
+    def test_temp_stress_days(self):
+        tubs, tlbs = np.arange(25.0, 35.0, 2.5), np.arange(0.0, 10.0, 2.5)
+        for culture in synthetic_cultures()[:2]:
+            grid = get_temp_stress_grid(culture.climate_data, tubs, tlbs,
+                                        flowerDate='2012-05-15')
+            for i, (tub, tlb) in enumerate(zip(tubs, tlbs)):
+                expected = get_temp_stress_days(culture.climate_data, tub, tlb,
+                                                flowerDate='2012-05-15')
+                np.testing.assert_allclose(
+                    [grid[0][i], grid[1][i], grid[2][i], grid[3][i]], expected,
+                    atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
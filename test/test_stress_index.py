@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""tests of climax.stress_index against the dense daily flags"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from climax.culture_matrix import CultureMatrix
+from climax.stress_index import (FLAGS, StressIndex, StressIndexBuilder,
+                                 trial_flags)
+
+from test_culture_matrix import synthetic_cultures
+
+FLOWERING_DATE = '2012-06-01'
+
+
+class SourcesCursor(object):
+    """a cursor, which returns one CULTURE_SOURCES_QUERY row per culture"""
+    def __init__(self, locations):
+        self.locations = locations
+
+    def execute(self, query, parameters=None):
+        self.rows = [(culture_id, location_id, None, None)
+                     for culture_id, location_id in sorted(self.locations.items())]
+
+    def fetchall(self):
+        return self.rows
+
+
+class StressIndexTest(unittest.TestCase):
+    def setUp(self):
+        cultures = synthetic_cultures()
+        self.matrix = CultureMatrix(cultures)
+        self.soil_volumes = [42.0] * len(cultures)
+        drought_flags = self.matrix.drought_flags(self.soil_volumes)
+        self.daily = self.matrix.daily_flags(drought_flags)
+        self.flags = trial_flags(self.matrix, drought_flags)
+        self.culture_ids = self.matrix.culture_ids.tolist()
+        # two cultures per location (the last one alone)
+        self.locations = {culture_id: 10 + i // 2
+                          for i, culture_id in enumerate(self.culture_ids)}
+        self.cursor = SourcesCursor(self.locations)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stress_index.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, update=False, rows=None):
+        builder = StressIndexBuilder(self.path, update=update)
+        for row in (range(len(self.flags)) if rows is None else rows):
+            builder.add(self.culture_ids[row], FLOWERING_DATE,
+                        self.soil_volumes[row], self.flags[row])
+        return builder
+
+    def dense(self, flag, index):
+        """returns the daily flags of the rows of an index on its day range"""
+        dense = np.zeros((len(index.culture_ids), index.num_days), dtype=bool)
+        for row, culture_id in enumerate(index.culture_ids.tolist()):
+            matrix_row = self.culture_ids.index(culture_id)
+            offset = self.matrix.first_days[matrix_row] - index.first_day
+            num_days = self.matrix.num_days[matrix_row]
+            dense[row, offset:offset + num_days] = \
+                self.daily[flag][matrix_row, :num_days]
+        return dense
+
+    def test_build(self):
+        index = self.build().build(self.cursor)
+        self.assertEqual(index.culture_ids.tolist(), sorted(self.culture_ids))
+        self.assertEqual(index.first_day, self.matrix.first_days.min())
+        self.assertEqual(index.num_days,
+                         (self.matrix.first_days + self.matrix.num_days).max() -
+                         index.first_day)
+        self.assertEqual(index.location_ids.tolist(),
+                         [self.locations[culture_id]
+                          for culture_id in index.culture_ids.tolist()])
+        for flag in FLAGS:
+            unpacked = np.unpackbits(index.bits[flag], axis=1)[:, :index.num_days]
+            self.assertTrue((unpacked == self.dense(flag, index)).all())
+
+    def test_count_days(self):
+        index = self.build().build(self.cursor)
+        for flag in FLAGS:
+            dense = self.dense(flag, index)
+            for start, end in ((0, index.num_days), (3, 17), (40, 41), (-5, 500)):
+                first = np.datetime64(index.first_day + start, 'D')
+                last = np.datetime64(index.first_day + end, 'D')
+                expected = dense[:, max(start, 0):max(end, 0)].sum(axis=1)
+                self.assertEqual(
+                    index.count_days(flag, str(first), str(last)).tolist(),
+                    expected.tolist())
+
+    def test_count_after_flowering(self):
+        index = self.build().build(self.cursor)
+        flowering = index.flowering_days[0] - index.first_day
+        for flag in FLAGS:
+            dense = self.dense(flag, index)
+            self.assertEqual(
+                index.count_after_flowering(flag, 7, offset=1).tolist(),
+                dense[:, flowering + 1:flowering + 8].sum(axis=1).tolist())
+
+    def test_flagged_on(self):
+        index = self.build().build(self.cursor)
+        for flag in FLAGS:
+            dense = self.dense(flag, index)
+            for position in (0, 11, 50, index.num_days - 1):
+                day = str(np.datetime64(index.first_day + position, 'D'))
+                cultures = index.culture_ids[dense[:, position]]
+                self.assertEqual(index.flagged_on(flag, day, 'culture').tolist(),
+                                 sorted(cultures.tolist()))
+                self.assertEqual(
+                    index.flagged_on(flag, day, 'location').tolist(),
+                    sorted(set(self.locations[culture_id]
+                               for culture_id in cultures.tolist())))
+            self.assertEqual(len(index.flagged_on(flag, '1999-01-01')), 0)
+
+    def test_location_bits(self):
+        index = self.build().build(self.cursor)
+        self.assertEqual(index.locations.tolist(),
+                         sorted(set(self.locations.values())))
+        for flag in FLAGS:
+            for row, location_id in enumerate(index.locations.tolist()):
+                expected = np.bitwise_or.reduce(
+                    index.bits[flag][index.location_ids == location_id], axis=0)
+                self.assertEqual(index.location_bits[flag][row].tolist(),
+                                 expected.tolist())
+
+    def test_save_and_load(self):
+        self.build().save(self.cursor)
+        index = self.build().build(self.cursor)
+        loaded = StressIndex.load(self.path)
+        self.assertFalse(os.path.exists(self.path + '.tmp.npz'))
+        self.assertEqual((loaded.first_day, loaded.num_days),
+                         (index.first_day, index.num_days))
+        for name in ('culture_ids', 'flowering_days', 'soil_volumes',
+                     'location_ids', 'locations'):
+            self.assertEqual(getattr(loaded, name).tolist(),
+                             getattr(index, name).tolist())
+        for flag in FLAGS:
+            self.assertTrue((loaded.bits[flag] == index.bits[flag]).all())
+
+    def test_update(self):
+        self.build(rows=[0, 1, 2]).save(self.cursor)
+        # the rows of the existing index are kept, unless added again
+        self.build(update=True, rows=[2, 3, 4]).save(self.cursor)
+        updated = StressIndex.load(self.path)
+        index = self.build().build(self.cursor)
+        self.assertEqual(updated.culture_ids.tolist(), index.culture_ids.tolist())
+        self.assertEqual((updated.first_day, updated.num_days),
+                         (index.first_day, index.num_days))
+        for flag in FLAGS:
+            self.assertTrue((updated.bits[flag] == index.bits[flag]).all())
+
+        # without update, the existing rows are dropped
+        self.build(rows=[3]).save(self.cursor)
+        self.assertEqual(StressIndex.load(self.path).culture_ids.tolist(),
+                         [self.culture_ids[3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
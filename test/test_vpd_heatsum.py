@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+tests of the vectorized climax.vpd_heatsum functions against the loops they
+replaced
+"""
+
+import datetime
+import unittest
+
+import numpy as np
+
+from climax.vpd_heatsum import (calc_VPD, calc_heat_sum,
+                                compute_weekly_midday_vpd,
+                                compute_heatsum_per_day,
+                                compute_heatsum_per_week)
+
+
+def loop_weekly_midday_vpd(temperatures, relHumidity):
+    """the former compute_weekly_midday_vpd()"""
+    hourly = {timepoint: calc_VPD(temperatures[timepoint][0], relHumidity[timepoint][0])
+              for timepoint in set(temperatures.keys()).intersection(set(relHumidity.keys()))}
+    daily = {}
+    midday = (datetime.datetime.strptime('10:00:00', '%H:%M:%S'),
+              datetime.datetime.strptime('14:00:00', '%H:%M:%S'))
+    for tp in hourly:
+        hour = datetime.datetime.strptime(tp[1], '%H:%M:%S')
+        if midday[0] <= hour <= midday[1]:
+            daily[tp[0]] = daily.get(tp[0], []) + [hourly[tp]]
+
+    weekly = {}
+    for k in sorted(daily):
+        week = tuple(map(int, datetime.datetime.strftime(datetime.datetime.strptime(k, '%Y-%m-%d'), '%Y-%W').split('-')))
+        weekly[week] = weekly.get(week, []) + [np.median(daily[k])]
+    return {week: sum(weekly[week])/len(weekly[week]) for week in weekly}
+
+
+def loop_heatsum_per_day(maxTemps, minTemps):
+    """the former compute_heatsum_per_day()"""
+    heatsum, heatsum_day = 0, {}
+    for k in sorted(set(maxTemps.keys()).intersection(set(minTemps.keys()))):
+        heatsum += calc_heat_sum(minTemps[k], maxTemps[k])
+        heatsum_day[k] = heatsum
+    return heatsum_day
+
+
+def loop_heatsum_per_week(heatsum_day, day=5):
+    """the former compute_heatsum_per_week()"""
+    heatsum_week = {}
+    for k in heatsum_day:
+        year, week, weekday = map(int, datetime.datetime.strftime(datetime.datetime.strptime(k, '%Y-%m-%d'), '%Y %W %w').split())
+        if weekday == day:
+            heatsum_week[(year, week)] = heatsum_day[k]
+    return heatsum_week
+
+
+class VPDHeatsumTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        start = datetime.datetime(2011, 12, 20)
+        self.temperatures, self.humidity = {}, {}
+        for hour in range(24 * 60):
+            timestamp = start + datetime.timedelta(hours=hour)
+            key = (timestamp.strftime('%Y-%m-%d'), timestamp.strftime('%H:%M:%S'))
+            if rng.uniform() < 0.9:
+                self.temperatures[key] = [round(rng.uniform(-5, 32), 1)]
+            if rng.uniform() < 0.9:
+                self.humidity[key] = [round(rng.uniform(0.2, 1.0), 2)]
+        days = [(start + datetime.timedelta(days=i)).strftime('%Y-%m-%d')
+                for i in range(60)]
+        self.min_temps = {day: round(rng.uniform(-8, 15), 1) for day in days}
+        self.max_temps = {day: round(rng.uniform(5, 36), 1) for day in days
+                          if rng.uniform() < 0.95}
+
+    def assert_dicts_equal(self, expected, actual):
+        self.assertEqual(sorted(expected), sorted(actual))
+        for key in expected:
+            self.assertAlmostEqual(expected[key], actual[key], places=9)
+
+    def test_calc_VPD(self):
+        temperatures = np.array([-5.0, 0.0, 12.5, 30.0])
+        humidity = np.array([0.3, 1.0, 0.55, 0.9])
+        np.testing.assert_allclose(
+            calc_VPD(temperatures, humidity),
+            [calc_VPD(t, h) for t, h in zip(temperatures.tolist(),
+                                            humidity.tolist())])
+
+    def test_calc_heat_sum(self):
+        tmin = np.array([-2.0, 5.0, 10.0, 20.0])
+        tmax = np.array([8.0, 12.0, 35.0, 31.0])
+        np.testing.assert_allclose(
+            calc_heat_sum(tmin, tmax),
+            [calc_heat_sum(low, high) for low, high in zip(tmin.tolist(),
+                                                           tmax.tolist())])
+
+    def test_weekly_midday_vpd(self):
+        self.assert_dicts_equal(
+            loop_weekly_midday_vpd(self.temperatures, self.humidity),
+            compute_weekly_midday_vpd(self.temperatures, self.humidity))
+        self.assertEqual(compute_weekly_midday_vpd({}, self.humidity), {})
+
+    def test_heatsums(self):
+        expected = loop_heatsum_per_day(self.max_temps, self.min_temps)
+        heatsum_day = compute_heatsum_per_day(self.max_temps, self.min_temps)
+        self.assert_dicts_equal(expected, heatsum_day)
+        for day in range(7):
+            self.assert_dicts_equal(loop_heatsum_per_week(expected, day),
+                                    compute_heatsum_per_week(heatsum_day, day))
+        self.assertEqual(compute_heatsum_per_week({}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()